@@ -0,0 +1,85 @@
+"""
+Микробенчмарк форматтера сообщений sender._auto_html.
+
+Сначала сверяет вывод с эталонным корпусом (auto_html_corpus.json — ответы
+прежней реализации на regex-каскаде), затем меряет сообщения/сек для коротких,
+длинных и насыщенных ссылками текстов.
+
+Запуск из корня репозитория:
+    python -m benchmarks.auto_html_bench [--seconds 1.0] [--check-only]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+# Сеть и БД не нужны; заглушки только для импорта source.config
+for _key in ("BOT_TOKEN", "BASE_URL", "NEXTCLOUD_USER", "NEXTCLOUD_PASS",
+             "MYSQL_USER", "MYSQL_PASS", "MYSQL_DB"):
+    os.environ.setdefault(_key, "1:bench" if _key == "BOT_TOKEN" else "bench")
+
+from source.connections.sender import _auto_html  # noqa: E402
+
+CORPUS = Path(__file__).with_name("auto_html_corpus.json")
+CLOUD = "https://cloud.example.org"
+
+SHORT = "✏️ *Изменения в карточке* «Релиз»:\nКолонка: *В работе* → *Готово*"
+LONG = (
+    "🆕 Новая задача: *Большое описание*\nDescription: \n\\\\\\"
+    + "Абзац с *акцентом*, `кодом`, ~правкой~ и _курсивом_.\n" * 120
+    + "///\n"
+    + "\n".join(f"*user{i}:* комментарий номер {i}" for i in range(40))
+)
+LINKS = "📎 Новые вложения:\n" + "\n".join(
+    f'<a href="{CLOUD}/s/Token{i}/preview">медиа {i}</a> к карточке '
+    f'<a href="{CLOUD}/apps/deck/board/1/card/{i}">{i}</a>'
+    for i in range(150)
+)
+
+
+def check_corpus() -> int:
+    """Возвращает число расхождений с эталоном (и печатает их)."""
+    mismatches = 0
+    for case in json.loads(CORPUS.read_text(encoding="utf-8")):
+        got = _auto_html(case["input"])
+        if got != case["expected"]:
+            mismatches += 1
+            print(f"MISMATCH: {case['input'][:60]!r}\n  expected {case['expected'][:120]!r}\n  got      {got[:120]!r}")
+    return mismatches
+
+
+def measure(text: str, seconds: float) -> float:
+    """Сообщений в секунду для одного входа."""
+    count = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while True:
+        for _ in range(50):
+            _auto_html(text)
+        count += 50
+        now = time.perf_counter()
+        if now >= deadline:
+            return count / (now - started)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=1.0, help="время замера на каждый вход")
+    parser.add_argument("--check-only", action="store_true", help="только сверка с корпусом")
+    args = parser.parse_args()
+
+    mismatches = check_corpus()
+    print(f"corpus: {'OK' if not mismatches else f'{mismatches} mismatches'}")
+    if mismatches or args.check_only:
+        return 1 if mismatches else 0
+
+    for name, text in (("short", SHORT), ("long", LONG), ("links", LINKS)):
+        rate = measure(text, args.seconds)
+        print(f"{name:<6} {len(text):>6} chars  {rate:>10.0f} msgs/sec")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Бенчмарк пересборки таймеров напоминаний о дедлайнах.
+
+На синтетических парах (карточка, исполнитель) строит таймеры поштучно
+(_schedule_card для каждой карточки) и колоночно (_schedule_cards_columnar),
+сверяет записи и печатает время обоих способов.
+
+Запуск из корня репозитория:
+    python -m benchmarks.deadline_bench [--pairs 100000] [--repeat 3] [--seed 1]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+# Сеть и БД не нужны; заглушки только для импорта source.config
+for _key in ("BOT_TOKEN", "BASE_URL", "NEXTCLOUD_USER", "NEXTCLOUD_PASS",
+             "MYSQL_USER", "MYSQL_PASS", "MYSQL_DB"):
+    os.environ.setdefault(_key, "1:bench" if _key == "BOT_TOKEN" else "bench")
+
+from source import deadlines  # noqa: E402
+from source.cards import Card  # noqa: E402
+from source.config import TIMEZONES  # noqa: E402
+from source.deadline_timers import DeadlineTimers  # noqa: E402
+
+STAGES = (None, None, "pre_24h", "due", "post_repeat")
+
+
+def make_state(pairs: int, now: datetime, rnd: random.Random):
+    """Карточки по 1–3 исполнителя, дедлайны от −30 до +5 дней, случайные отправленные напоминания."""
+    users = {f"user{i}": (i, TIMEZONES[rnd.randint(-12, 14)]) for i in range(max(1, pairs // 20))}
+    logins = list(users)
+    cards, last_sent = [], {}
+    card_id = 0
+    while pairs > 0:
+        card_id += 1
+        assigned = rnd.sample(logins, min(len(logins), pairs, rnd.randint(1, 3)))
+        pairs -= len(assigned)
+        due = now + timedelta(seconds=rnd.randint(-30 * 86400, 5 * 86400))
+        cards.append(Card(
+            card_id=card_id, title=f"Задача {card_id}", description="", board_id=1, board_title="",
+            stack_id=0, stack_title="", duedate=due, assigned_logins=assigned,
+        ))
+        for login in assigned:
+            stage = rnd.choice(STAGES)
+            if stage is not None:
+                last_sent[(card_id, login)] = (stage, now - timedelta(seconds=rnd.randint(0, 10 * 86400)))
+    # Часть исполнителей не зарегистрирована
+    for login in logins[::10]:
+        users.pop(login)
+    return users, cards, last_sent
+
+
+def build(users, cards, last_sent, now: datetime, columnar: bool):
+    """Пересобирает таймеры; возвращает (время, записи, сброшенные карточки)."""
+    deadlines._timers = DeadlineTimers()
+    deadlines._cards.clear()
+    deadlines._pending_resets.clear()
+    deadlines._users.clear()
+    deadlines._users.update(users)
+    deadlines._last_sent.clear()
+    deadlines._last_sent.update(last_sent)
+    started = time.perf_counter()
+    if columnar:
+        if not deadlines._schedule_cards_columnar(cards, now):
+            raise SystemExit("колоночный режим недоступен для этих часовых поясов")
+    else:
+        for item in cards:
+            deadlines._schedule_card(item, now)
+    elapsed = time.perf_counter() - started
+    entries = sorted(entry[:4] for entry in deadlines._timers._heap)
+    return elapsed, entries, set(deadlines._pending_resets)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pairs", type=int, default=100_000, help="число пар (карточка, исполнитель)")
+    parser.add_argument("--repeat", type=int, default=3, help="сколько замеров, берётся лучший")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    now = datetime(2025, 3, 14, 12, 30, tzinfo=timezone.utc)
+    users, cards, last_sent = make_state(args.pairs, now, random.Random(args.seed))
+
+    results = {}
+    for columnar in (False, True):
+        best = None
+        for _ in range(args.repeat):
+            elapsed, entries, resets = build(users, cards, last_sent, now, columnar)
+            best = elapsed if best is None else min(best, elapsed)
+        results[columnar] = (best, entries, resets)
+
+    (loop_s, loop_entries, loop_resets), (col_s, col_entries, col_resets) = results[False], results[True]
+    same = loop_entries == col_entries and loop_resets == col_resets
+    print(f"pairs={args.pairs} cards={len(cards)} timers={len(loop_entries)} resets={len(loop_resets)}")
+    print(f"timers: {'OK' if same else 'MISMATCH'}")
+    print(f"loop     {loop_s * 1000:>9.1f} ms")
+    print(f"columnar {col_s * 1000:>9.1f} ms  (x{loop_s / col_s:.1f})")
+    return 0 if same else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,6 +8,7 @@ from source.app_logging import logger, is_debug
 from source.scheduler import poll_new_tasks
 from source.connections.bot_factory import bot
 from source.connections.sender import send_message_limited
+from source.connections.outbox import start_outbox_workers
 from source.config import FORUM_CHAT_ID, BOT_START_MESSAGE_TOPIC_ID, COMMIT_HASH, COMMIT_REPO_URL, CALDAV_PASSWORD, CALDAV_USERNAME
 import source.handlers  # noqa: F401
 import source.callbacks  # noqa: F401
@@ -161,6 +162,8 @@ def run():
     init_db()
     auto_migrate()
 
+    start_outbox_workers()
+
     backoff = 5.0
     while True:
         try:
@@ -1,52 +1,54 @@
-import requests
-from requests.auth import HTTPBasicAuth
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 from source.connections.bot_factory import bot
 from source.db.repos.users import delete_login_token, get_token, save_login_to_db_with_token, get_email_by_tg_id
-from source.config import BASE_URL, USERNAME, PASSWORD, HEADERS, WEB_APP_URL
+from source.config import BASE_URL, HEADERS, WEB_APP_URL
+from source.connections.nextcloud_client import nc_get, nc_post, nc_put
+from source.connections.board_topology import get_topology, invalidate_topology
 from source.connections.sender import send_message_limited, edit_message_limited
 from source.nc_calendar import update_event_partstat, msg_design_from_button
 from source.db.repos.caldav_calendar import get_name_by_id
+from source.deadlines import notify_users_changed
+
+# order для reorder: Deck ставит карточку с order больше числа карточек в конец колонки,
+# поэтому счётчики карточек (которые в кэше топологии устаревают) не нужны
+END_OF_STACK = 2 ** 31 - 1
+
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("move:"))
 def handle_card_move(call):
     """
     Перемещение карточки из одной колонки в другую
     """
-    _, board_id, current_stack_id, card_id, new_stack_id = call.data.split(":")
+    _, board_id, _, card_id, new_stack_id = call.data.split(":")
     board_id = int(board_id)
-    current_stack_id = int(current_stack_id)
     card_id = int(card_id)
     new_stack_id = int(new_stack_id)
-    all_stacks_resp = requests.get(f"{BASE_URL}/boards/{board_id}/stacks?details=true", headers=HEADERS,
-                                   auth=HTTPBasicAuth(USERNAME, PASSWORD))
-    all_stacks_resp.raise_for_status()
-    all_stacks = sorted(all_stacks_resp.json(), key=lambda s: s['order'])
-    new_stack_data = next(s for s in all_stacks if s['id'] == new_stack_id)
-    position = len(new_stack_data.get("cards", []))
+    topology = get_topology(board_id)
+    new_stack = topology.stack(new_stack_id)
+    if new_stack is None:
+        topology = get_topology(board_id, refresh=True)
+        new_stack = topology.stack(new_stack_id)
+    if new_stack is None:
+        bot.answer_callback_query(call.id, "Колонка не найдена")
+        return
     reorder_url = f"{BASE_URL}/boards/{board_id}/stacks/{new_stack_id}/cards/{card_id}/reorder"
-    payload = {"stackId": new_stack_id, "order": position}
-    move_resp = requests.put(reorder_url, headers=HEADERS, auth=HTTPBasicAuth(USERNAME, PASSWORD), json=payload)
+    payload = {"stackId": new_stack_id, "order": END_OF_STACK}
+    move_resp = nc_put(reorder_url, headers=HEADERS, json=payload)
     if move_resp.status_code not in (200, 204):
+        invalidate_topology(board_id)
         bot.answer_callback_query(call.id, f"Ошибка API ({move_resp.status_code})")
         return
-    updated_stacks_resp = requests.get(f"{BASE_URL}/boards/{board_id}/stacks?details=true", headers=HEADERS,
-                                       auth=HTTPBasicAuth(USERNAME, PASSWORD))
-    updated_stacks_resp.raise_for_status()
-    updated_stacks = sorted(updated_stacks_resp.json(), key=lambda s: s['order'])
-    new_idx = next(idx for idx, s in enumerate(updated_stacks) if s['id'] == new_stack_id)
+    prev_stack, next_stack = topology.neighbours(new_stack_id)
     new_kb = InlineKeyboardMarkup()
-    if new_idx > 0:
-        prev_stack = updated_stacks[new_idx - 1]
+    if prev_stack is not None:
         new_kb.add(InlineKeyboardButton(
-            text=f"⬅ {prev_stack['title']}",
-            callback_data=f"move:{board_id}:{new_stack_id}:{card_id}:{prev_stack['id']}"
+            text=f"⬅ {prev_stack.title}",
+            callback_data=f"move:{board_id}:{new_stack_id}:{card_id}:{prev_stack.id}"
         ))
-    if new_idx < len(updated_stacks) - 1:
-        next_stack = updated_stacks[new_idx + 1]
+    if next_stack is not None:
         new_kb.add(InlineKeyboardButton(
-            text=f"➡ {next_stack['title']}",
-            callback_data=f"move:{board_id}:{new_stack_id}:{card_id}:{next_stack['id']}"
+            text=f"➡ {next_stack.title}",
+            callback_data=f"move:{board_id}:{new_stack_id}:{card_id}:{next_stack.id}"
         ))
     bot.answer_callback_query(call.id, "Перемещено")
     bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=new_kb)
@@ -60,7 +62,7 @@ def check_login(call):
         'Accept': 'application/json'
     }
     try:
-        response = requests.post(endpoint, data={'token': poll_token}, headers=headers)
+        response = nc_post(endpoint, auth=None, data={'token': poll_token}, headers=headers)
         response.raise_for_status()
         if response.status_code == 404:
             bot.answer_callback_query(call.id, "Вы еще не подтвердили вход в браузере!", show_alert=True)
@@ -77,7 +79,7 @@ def check_login(call):
 
             user_url = WEB_APP_URL + "/ocs/v2.php/cloud/user"
 
-            user_response = requests.get(
+            user_response = nc_get(
                 user_url,
                 auth=(nc_login, nc_token),
                 headers=headers_get_info
@@ -89,6 +91,7 @@ def check_login(call):
             email = data.get("ocs", {}).get("data", {}).get("email")
             nc_login = data.get("ocs", {}).get("data", {}).get("id")
             save_login_to_db_with_token(call.from_user.id, nc_login, email, nc_token)
+            notify_users_changed()
             bot.edit_message_text(f"✅ Успешно! Аккаунт {nc_login} привязан.",
                                   call.message.chat.id,
                                   call.message.message_id)
@@ -0,0 +1,59 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, ClassVar, Dict, List, Optional, Tuple
+
+
+@dataclass(slots=True)
+class Card:
+    """
+    Карточка Deck в том виде, в котором её используют опрос, дедлайны и /mycards.
+    Строится из ответа API (nextcloud_api) или из строки таблицы tasks (Card.from_task).
+    """
+    card_id: int
+    title: str
+    description: str
+    board_id: int
+    board_title: str
+    stack_id: int
+    stack_title: str
+    prev_stack_id: Optional[int] = None
+    prev_stack_title: Optional[str] = None
+    next_stack_id: Optional[int] = None
+    next_stack_title: Optional[str] = None
+    duedate: Optional[datetime] = None
+    done: Optional[datetime] = None
+    etag: Optional[str] = None
+    assigned_logins: List[str] = field(default_factory=list)
+    comments_count: int = 0
+    attachments_count: int = 0
+    # Сколько секунд назад карточка менялась в Deck (0 — неизвестно)
+    last_modified: int = 0
+    labels: List[str] = field(default_factory=list)
+    # Из снимка БД — set id; после загрузки из API — список словарей
+    attachments_data: Any = field(default_factory=set)
+    comments_data: Any = field(default_factory=set)
+    # Нужно ли догрузить комментарии/вложения из API
+    need_comments: bool = False
+    need_attachments: bool = False
+
+    # Поля, которые хранятся в таблице tasks
+    TASK_COLUMNS: ClassVar[Tuple[str, ...]] = (
+        'card_id', 'title', 'description',
+        'board_id', 'board_title',
+        'stack_id', 'stack_title',
+        'prev_stack_id', 'prev_stack_title',
+        'next_stack_id', 'next_stack_title',
+        'duedate', 'done', 'etag',
+    )
+
+    @classmethod
+    def from_task(cls, task, assigned_logins: Optional[List[str]] = None) -> "Card":
+        """Строит карточку из ORM-объекта Task."""
+        card = cls(**{name: getattr(task, name) for name in cls.TASK_COLUMNS})
+        if assigned_logins is not None:
+            card.assigned_logins = assigned_logins
+        return card
+
+    def task_row(self) -> Dict[str, Any]:
+        """Строка таблицы tasks для upsert."""
+        return {name: getattr(self, name) for name in self.TASK_COLUMNS}
@@ -0,0 +1,107 @@
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from source.cards import Card
+
+
+@dataclass(slots=True)
+class PendingChange:
+    """Изменения карточки, ожидающие уведомления."""
+    # Состояние карточки до первого изменения в окне
+    baseline: Card
+    first_at: float
+    last_at: float
+    # Сколько опросов увидели новые изменения
+    polls: int = 1
+
+
+class ChangeCoalescer:
+    """
+    Объединяет изменения карточки в одно уведомление.
+
+    Первое изменение запоминает исходное состояние карточки; уведомление
+    уходит, когда карточка не менялась window секунд (но не позже max_delay
+    после первого изменения), и описывает итоговую разницу: например,
+    колонка A → C вместо двух сообщений A → B и B → C.
+    При window == 0 уведомление уходит в том же опросе.
+    """
+
+    def __init__(self, window: float, max_delay: Optional[float] = None):
+        self.window = max(0.0, window)
+        self.max_delay = max(self.window, max_delay if max_delay is not None else 3 * self.window)
+        self.merged = 0
+        self._pending: Dict[int, PendingChange] = {}
+
+    def record(self, card_id: int, baseline: Card, now: Optional[float] = None) -> PendingChange:
+        """
+        Отмечает изменение карточки; baseline учитывается только для первого изменения в окне.
+        Возвращает накопленные изменения карточки (чтобы сохранить их в БД).
+        """
+        now = time.monotonic() if now is None else now
+        pending = self._pending.get(card_id)
+        if pending is None:
+            pending = self._pending[card_id] = PendingChange(baseline=baseline, first_at=now, last_at=now)
+        else:
+            pending.last_at = now
+            pending.polls += 1
+            self.merged += 1
+        return pending
+
+    def restore(self, card_id: int, baseline: Card, first_age: float, last_age: float, polls: int,
+                now: Optional[float] = None) -> None:
+        """
+        Восстанавливает изменения, сохранённые до перезапуска:
+        first_age/last_age — сколько секунд назад было первое и последнее изменение.
+        """
+        now = time.monotonic() if now is None else now
+        self._pending[card_id] = PendingChange(
+            baseline=baseline, first_at=now - first_age, last_at=now - last_age, polls=polls,
+        )
+
+    def age(self, pending: PendingChange, now: Optional[float] = None) -> Tuple[float, float]:
+        """Сколько секунд назад были первое и последнее изменение."""
+        now = time.monotonic() if now is None else now
+        return now - pending.first_at, now - pending.last_at
+
+    def due(self, card_id: int, now: Optional[float] = None) -> Optional[PendingChange]:
+        """
+        Возвращает изменения карточки, если пора отправлять уведомление.
+        Изменения не забываются, пока не вызван discard — после того как
+        уведомление зафиксировано в outbox.
+        """
+        pending = self._pending.get(card_id)
+        if pending is None:
+            return None
+        now = time.monotonic() if now is None else now
+        if now - pending.last_at < self.window and now - pending.first_at < self.max_delay:
+            return None
+        return pending
+
+    def discard(self, card_ids: Iterable[int]) -> None:
+        """Забывает изменения карточек, уведомления о которых поставлены в outbox."""
+        for card_id in card_ids:
+            self._pending.pop(card_id, None)
+
+    def drop_unseen(self, seen_ids: Iterable[int], board_ids: Iterable[int],
+                    now: Optional[float] = None) -> List[int]:
+        """
+        Забывает карточки досок board_ids (загруженных в этом опросе), которых
+        в опросе не было (удалены или перенесены в архив) и чьё уведомление уже
+        просрочено. Карточки незагрузившихся досок ждут следующего опроса.
+        Возвращает card_id забытых.
+        """
+        now = time.monotonic() if now is None else now
+        seen = set(seen_ids)
+        boards = set(board_ids)
+        stale = [
+            card_id for card_id, pending in self._pending.items()
+            if card_id not in seen and pending.baseline.board_id in boards
+            and now - pending.first_at >= self.max_delay
+        ]
+        for card_id in stale:
+            del self._pending[card_id]
+        return stale
+
+    def __len__(self) -> int:
+        return len(self._pending)
@@ -64,10 +64,44 @@ MYSQL_PASS = os.getenv("MYSQL_PASS")
 MYSQL_DB = os.getenv("MYSQL_DB")
 
 POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", "60"))
-DEADLINES_INTERVAL = int(os.getenv("DEADLINES_INTERVAL", "2"))
+CHANGE_COALESCE_WINDOW = float(os.getenv("CHANGE_COALESCE_WINDOW", "120"))
+DEADLINES_RESYNC_INTERVAL = max(60, int(os.getenv("DEADLINES_RESYNC_INTERVAL", "3600")))
 QUIET_HOURS = os.getenv("QUIET_HOURS", "0-8")
 DEADLINE_REPEAT_DAYS = int(os.getenv("DEADLINE_REPEAT_DAYS", "5"))
+DEADLINES_VECTORIZED = os.getenv("DEADLINES_VECTORIZED", "1") == "1"
 ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "7"))
+FETCH_WORKERS = max(1, int(os.getenv("FETCH_WORKERS", "4")))
+DECK_BOARD_CACHE_TTL = int(os.getenv("DECK_BOARD_CACHE_TTL", "900"))
+DECK_BOARD_CACHE_BOARDS = max(0, int(os.getenv("DECK_BOARD_CACHE_BOARDS", "20")))
+
+NC_CONNECT_TIMEOUT = float(os.getenv("NC_CONNECT_TIMEOUT", "5"))
+NC_READ_TIMEOUT = float(os.getenv("NC_READ_TIMEOUT", "30"))
+NC_POOL_SIZE = int(os.getenv("NC_POOL_SIZE", str(max(10, FETCH_WORKERS))))
+NC_RETRIES = int(os.getenv("NC_RETRIES", "3"))
+NC_REUSE_SHARES = os.getenv("NC_REUSE_SHARES", "1") == "1"
+
+OUTBOX_WORKERS = max(1, int(os.getenv("OUTBOX_WORKERS", "4")))
+OUTBOX_BATCH = max(1, int(os.getenv("OUTBOX_BATCH", "50")))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1"))
+OUTBOX_MAX_ATTEMPTS = max(1, int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5")))
+OUTBOX_LOG_INFLIGHT = max(1, int(os.getenv("OUTBOX_LOG_INFLIGHT", "3")))
+OUTBOX_LOG_MAX_PENDING = max(2, int(os.getenv("OUTBOX_LOG_MAX_PENDING", "100")))
+TG_MAX_RETRIES = max(0, int(os.getenv("TG_MAX_RETRIES", "3")))
+TG_PRIVATE_RATE = float(os.getenv("TG_PRIVATE_RATE", "1"))
+TG_GROUP_RATE = float(os.getenv("TG_GROUP_RATE", "20"))
+TG_FORUM_RATE = float(os.getenv("TG_FORUM_RATE", str(TG_GROUP_RATE)))
+TG_LIMITER_MAX_CHATS = max(1, int(os.getenv("TG_LIMITER_MAX_CHATS", "10000")))
+TG_MESSAGE_LIMIT = min(4096, max(256, int(os.getenv("TG_MESSAGE_LIMIT", "4096"))))
+TG_LANE_WEIGHTS = tuple(max(1, int(w)) for w in os.getenv("TG_LANE_WEIGHTS", "8,3,1").split(","))
+TG_LANE_QUEUE = max(1, int(os.getenv("TG_LANE_QUEUE", "200")))
+STATS_LOG_MINUTES = max(0.0, float(os.getenv("STATS_LOG_MINUTES", "10")))
+# Сколько часов «Изменения в карточке» редактируют прошлое сообщение о ней вместо отправки нового:
+# в логе форум-чата и в личке. Правка сообщения в Telegram приходит без звука и уведомления,
+# поэтому в личке по умолчанию каждое изменение — новое сообщение (0); окно включается явно,
+# если тишина важнее того, чтобы исполнитель заметил повторное изменение.
+CARD_MESSAGE_EDIT_HOURS = max(0.0, float(os.getenv("CARD_MESSAGE_EDIT_HOURS", "24")))
+CARD_MESSAGE_EDIT_HOURS_PRIVATE = max(0.0, float(os.getenv("CARD_MESSAGE_EDIT_HOURS_PRIVATE", "0")))
+
 TIMEZONE = "Europe/Moscow"
 
 APP_DEBUG = os.getenv("APP_DEBUG", "0")
@@ -0,0 +1,97 @@
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from source.app_logging import logger
+from source.config import BASE_URL, HEADERS
+from source.connections.nextcloud_client import nc_get
+
+
+@dataclass
+class StackInfo:
+    id: int
+    title: str
+    order: int
+
+
+@dataclass
+class BoardTopology:
+    """
+    Колонки доски в порядке отображения, соседи каждой колонки и колонка «готово».
+    """
+    board_id: int
+    etag: Optional[str]
+    stacks: List[StackInfo] = field(default_factory=list)
+
+    def index_of(self, stack_id: int) -> Optional[int]:
+        return next((i for i, s in enumerate(self.stacks) if s.id == stack_id), None)
+
+    def stack(self, stack_id: int) -> Optional[StackInfo]:
+        idx = self.index_of(stack_id)
+        return self.stacks[idx] if idx is not None else None
+
+    def neighbours(self, stack_id: int) -> Tuple[Optional[StackInfo], Optional[StackInfo]]:
+        """Возвращает (предыдущая, следующая) колонки."""
+        idx = self.index_of(stack_id)
+        if idx is None:
+            return None, None
+        prev_stack = self.stacks[idx - 1] if idx > 0 else None
+        next_stack = self.stacks[idx + 1] if idx < len(self.stacks) - 1 else None
+        return prev_stack, next_stack
+
+    @property
+    def done_stack(self) -> Optional[StackInfo]:
+        """Колонка «готово»: последняя по order (при order == 999 — с наибольшим id)."""
+        if not self.stacks:
+            return None
+        return max(self.stacks, key=lambda s: (s.order, s.id if s.order == 999 else 0))
+
+
+_topologies: Dict[int, BoardTopology] = {}
+_lock = threading.Lock()
+
+
+def update_topology(board_id: int, stacks: list, etag: Optional[str] = None) -> BoardTopology:
+    """
+    Обновляет топологию доски по ответу /stacks?details=true.
+    Если ETag не изменился, сохранённая топология остаётся как есть.
+    """
+    with _lock:
+        current = _topologies.get(board_id)
+        if current is not None and etag is not None and current.etag == etag:
+            return current
+
+        topology = BoardTopology(
+            board_id=board_id,
+            etag=etag,
+            stacks=[
+                StackInfo(id=s['id'], title=s['title'], order=s['order'])
+                for s in sorted(stacks, key=lambda s: s['order'])
+            ],
+        )
+        _topologies[board_id] = topology
+        return topology
+
+
+def invalidate_topology(board_id: int) -> None:
+    """Сбрасывает топологию доски; следующий get_topology() загрузит её заново."""
+    with _lock:
+        _topologies.pop(board_id, None)
+
+
+def get_topology(board_id: int, refresh: bool = False) -> BoardTopology:
+    """
+    Возвращает топологию доски из кэша.
+    Если её нет (или refresh=True) — загружает колонки из Deck.
+    """
+    if not refresh:
+        topology = _topologies.get(board_id)
+        if topology is not None:
+            return topology
+
+    logger.debug(f"CLOUD: загружаю колонки доски {board_id}")
+    resp = nc_get(f"{BASE_URL}/boards/{board_id}/stacks?details=true", headers=HEADERS)
+    resp.raise_for_status()
+    if refresh:
+        invalidate_topology(board_id)
+    return update_topology(board_id, resp.json(), resp.headers.get('ETag'))
@@ -1,46 +1,57 @@
 import time
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime, timezone, timedelta
 from typing import Tuple, Optional, Any
 
-import requests
 import socket
 import http.client
 
 from requests.exceptions import RequestException, ConnectionError, Timeout
-from requests.auth import HTTPBasicAuth
+from sqlalchemy.exc import SQLAlchemyError
 
 from source.app_logging import logger
-from source.config import BASE_URL, USERNAME, PASSWORD, HEADERS, POLL_INTERVAL, OCS_BASE_URL
-from source.db.repos.tasks import get_etag_count, get_task_attachments, get_task_comments
-
-def in_done_stack(card: dict):
-    board_id = card['board_id']
-    card_id = card['card_id']
-    stack_id = card['stack_id']
-    all_stacks_resp = requests.get(f"{BASE_URL}/boards/{board_id}/stacks?details=true", headers=HEADERS,
-                                   auth=HTTPBasicAuth(USERNAME, PASSWORD))
-    all_stacks_resp.raise_for_status()
-    data = all_stacks_resp.json()
-    if not data:
+from source.cards import Card
+from source.connections.nextcloud_client import nc_get, nc_post, nc_put
+from source.connections.board_topology import get_topology, update_topology, invalidate_topology
+from source.config import BASE_URL, HEADERS, OCS_BASE_URL, FETCH_WORKERS, \
+    DECK_BOARD_CACHE_TTL, DECK_BOARD_CACHE_BOARDS, NC_REUSE_SHARES
+from source.db.repos.tasks import get_previous_state_snapshot
+from source.db.repos.shares import get_share_urls, save_share_urls
+
+def in_done_stack(card: Card):
+    """
+    Переносит готовую карточку в колонку «готово».
+    Колонки доски берутся из кэша топологии, поэтому нужен только запрос reorder.
+    Возвращает [название колонки, id колонки] или None, если переносить не нужно
+    или не удалось.
+    """
+    board_id = card.board_id
+    card_id = card.card_id
+    stack_id = card.stack_id
+    topology = get_topology(board_id)
+    if not topology.stacks:
         return None
 
-    now_stack = next((s['order'] for s in data if s['id'] == stack_id), None)
-    if now_stack == 0 or now_stack is None:
+    now_stack = topology.stack(stack_id)
+    if now_stack is None or now_stack.order == 0:
         return None
 
-    done_stack = max(data, key=lambda s: (s['order'], s['id'] if s['order'] == 999 else 0))
-    if done_stack['order'] == now_stack:
+    done_stack = topology.done_stack
+    if done_stack.order == now_stack.order:
         return None
 
-    new_stack_id = done_stack['id']
+    new_stack_id = done_stack.id
     position = 0
     reorder_url = f"{BASE_URL}/boards/{board_id}/stacks/{new_stack_id}/cards/{card_id}/reorder"
     payload = {"stackId": new_stack_id, "order": position}
-    move_resp = requests.put(reorder_url, headers=HEADERS, auth=HTTPBasicAuth(USERNAME, PASSWORD), json=payload)
+    move_resp = nc_put(reorder_url, headers=HEADERS, json=payload)
     if move_resp.status_code not in (200, 204):
+        # Возможно, колонки доски изменились — следующий запрос загрузит их заново
+        invalidate_topology(board_id)
         return None
-    return [done_stack['title'], new_stack_id]
+    return [done_stack.title, new_stack_id]
 
 
 def _extract_counts(card: dict) -> Tuple[int, int]:
@@ -56,10 +67,9 @@ def _extract_counts(card: dict) -> Tuple[int, int]:
     return int(comments or 0), int(atts or 0)
 
 def _get_list_attachments(board_id, stack_id, card_id):
-    attachs = requests.get(
+    attachs = nc_get(
                             f"{BASE_URL}/boards/{board_id}/stacks/{stack_id}/cards/{card_id}/attachments?details=true",
                             headers=HEADERS,
-                            auth=HTTPBasicAuth(USERNAME, PASSWORD),
                         )
     attachs.raise_for_status()
     attachments = attachs.json()
@@ -197,56 +207,137 @@ def _extract_share_url(payload: dict) -> Optional[str]:
     return payload.get('ocs', {}).get('data', {}).get('url')
 
 
-def get_url_attachment(path):
-    ocs_headers = {'OCS-APIRequest': 'true'}
-    share_url = f"{OCS_BASE_URL}/files_sharing/api/v1/shares?format=json"
-    for candidate_path in _candidate_share_paths(path):
-        body = {'path': candidate_path, 'shareType': 3}
-        try:
-            attach = requests.post(
-                share_url,
-                headers=ocs_headers,
-                auth=HTTPBasicAuth(USERNAME, PASSWORD),
-                data=body,
-                timeout=20,
-            )
-        except RequestException as exc:
-            logger.warning(f"CLOUD: share create failed for path='{candidate_path}': {exc}")
-            continue
+_OCS_HEADERS = {'OCS-APIRequest': 'true'}
+_SHARES_URL = f"{OCS_BASE_URL}/files_sharing/api/v1/shares"
+_SHARE_TYPE_LINK = 3
 
-        if attach.status_code in (403, 404):
-            logger.info(f"CLOUD: cannot share path='{candidate_path}' (HTTP {attach.status_code})")
-            continue
 
-        if attach.status_code >= 500:
-            logger.warning(f"CLOUD: share create failed for path='{candidate_path}' (HTTP {attach.status_code})")
-            continue
+def _find_link_share(candidate_path: str) -> Optional[str]:
+    """
+    Ищет уже существующую публичную ссылку на файл (GET shares?path=),
+    чтобы не плодить новые ссылки на одно и то же вложение.
+    Ссылки с паролем или сроком действия не переиспользуются.
+    """
+    try:
+        resp = nc_get(
+            _SHARES_URL,
+            headers=_OCS_HEADERS,
+            params={'format': 'json', 'path': candidate_path},
+            timeout=20,
+        )
+    except RequestException as exc:
+        logger.warning(f"CLOUD: share lookup failed for path='{candidate_path}': {exc}")
+        return None
 
-        if attach.status_code >= 400:
-            logger.info(f"CLOUD: share create rejected for path='{candidate_path}' (HTTP {attach.status_code})")
-            continue
+    if resp.status_code >= 400:
+        return None
 
-        try:
-            attachment_payload = attach.json()
-        except ValueError:
-            logger.warning(f"CLOUD: share create returned non-JSON for path='{candidate_path}'")
-            continue
+    try:
+        shares = resp.json().get('ocs', {}).get('data') or []
+    except ValueError:
+        return None
 
-        ocs_meta = attachment_payload.get('ocs', {}).get('meta', {})
-        if ocs_meta.get('statuscode') not in (100, 200, 997, None):
-            logger.info(
-                f"CLOUD: share create OCS error for path='{candidate_path}' "
-                f"(statuscode={ocs_meta.get('statuscode')}, message={ocs_meta.get('message')})"
-            )
+    for share in shares:
+        if not isinstance(share, dict):
+            continue
+        if int(share.get('share_type', -1)) != _SHARE_TYPE_LINK:
             continue
-        url = _extract_share_url(attachment_payload)
+        if share.get('password') or share.get('expiration'):
+            continue
+        if share.get('url'):
+            return share['url']
+    return None
+
+
+def _create_link_share(candidate_path: str) -> Optional[str]:
+    body = {'path': candidate_path, 'shareType': _SHARE_TYPE_LINK}
+    try:
+        attach = nc_post(
+            f"{_SHARES_URL}?format=json",
+            headers=_OCS_HEADERS,
+            data=body,
+            timeout=20,
+        )
+    except RequestException as exc:
+        logger.warning(f"CLOUD: share create failed for path='{candidate_path}': {exc}")
+        return None
+
+    if attach.status_code in (403, 404):
+        logger.info(f"CLOUD: cannot share path='{candidate_path}' (HTTP {attach.status_code})")
+        return None
+
+    if attach.status_code >= 500:
+        logger.warning(f"CLOUD: share create failed for path='{candidate_path}' (HTTP {attach.status_code})")
+        return None
+
+    if attach.status_code >= 400:
+        logger.info(f"CLOUD: share create rejected for path='{candidate_path}' (HTTP {attach.status_code})")
+        return None
+
+    try:
+        attachment_payload = attach.json()
+    except ValueError:
+        logger.warning(f"CLOUD: share create returned non-JSON for path='{candidate_path}'")
+        return None
+
+    ocs_meta = attachment_payload.get('ocs', {}).get('meta', {})
+    if ocs_meta.get('statuscode') not in (100, 200, 997, None):
+        logger.info(
+            f"CLOUD: share create OCS error for path='{candidate_path}' "
+            f"(statuscode={ocs_meta.get('statuscode')}, message={ocs_meta.get('message')})"
+        )
+        return None
+    return _extract_share_url(attachment_payload)
+
+
+def _share_path(path: Optional[str]) -> Optional[str]:
+    """Перебирает варианты пути: сначала ищет существующую ссылку (NC_REUSE_SHARES), затем создаёт новую."""
+    for candidate_path in _candidate_share_paths(path):
+        url = _find_link_share(candidate_path) if NC_REUSE_SHARES else None
+        if url is None:
+            url = _create_link_share(candidate_path)
         if url:
             return url
-
     return None
 
+
+def _cached_share_urls(file_ids) -> dict:
+    try:
+        return get_share_urls(file_ids)
+    except SQLAlchemyError as exc:
+        logger.warning(f"CLOUD: не удалось прочитать кэш ссылок на вложения: {exc}")
+        return {}
+
+
+def _remember_share_urls(urls: dict) -> None:
+    try:
+        save_share_urls(urls)
+    except SQLAlchemyError as exc:
+        logger.warning(f"CLOUD: не удалось сохранить ссылки на вложения: {exc}")
+
+
+def get_url_attachments(paths: dict) -> dict:
+    """
+    Публичные ссылки для пачки вложений { file_id: path } -> { file_id: url | None }.
+    Известные ссылки берутся из кэша одним запросом, недостающие создаются параллельно.
+    """
+    if not paths:
+        return {}
+
+    urls = _cached_share_urls(paths.keys())
+    missing = {file_id: path for file_id, path in paths.items() if file_id not in urls}
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(missing))) as pool:
+            created = dict(zip(missing, pool.map(_share_path, missing.values())))
+        fresh = {file_id: url for file_id, url in created.items() if url}
+        _remember_share_urls(fresh)
+        urls.update(fresh)
+
+    return {file_id: urls.get(file_id) for file_id in paths}
+
+
 def get_comments(card_id):
-    comm = requests.get(f"{OCS_BASE_URL}/deck/api/v1/cards/{card_id}/comments?format=json", headers=HEADERS, auth=HTTPBasicAuth(USERNAME, PASSWORD))
+    comm = nc_get(f"{OCS_BASE_URL}/deck/api/v1/cards/{card_id}/comments?format=json", headers=HEADERS)
     comm.raise_for_status()
     comments = comm.json().get('ocs', {}).get('data', {})
     result = [
@@ -264,7 +355,7 @@ def get_board_title(board_id):
     """
     Возвращает название доски по ID.
     """
-    boards_resp = requests.get(f"{BASE_URL}/boards", headers=HEADERS, auth=HTTPBasicAuth(USERNAME, PASSWORD))
+    boards_resp = nc_get(f"{BASE_URL}/boards", headers=HEADERS)
     boards_resp.raise_for_status()
     boards = boards_resp.json()
     for board in boards:
@@ -280,7 +371,7 @@ def fetch_user_tasks(login):
     """
     logger.debug("CLOUD: получаю задачи пользователя")
     result = []
-    boards_resp = requests.get(f"{BASE_URL}/boards", headers=HEADERS, auth=HTTPBasicAuth(USERNAME, PASSWORD))
+    boards_resp = nc_get(f"{BASE_URL}/boards", headers=HEADERS)
     boards_resp.raise_for_status()
     boards = boards_resp.json()
 
@@ -291,10 +382,9 @@ def fetch_user_tasks(login):
         board_id = board['id']
         board_title = board['title']
 
-        stacks_resp = requests.get(
+        stacks_resp = nc_get(
             f"{BASE_URL}/boards/{board_id}/stacks?details=true",
             headers=HEADERS,
-            auth=HTTPBasicAuth(USERNAME, PASSWORD)
         )
         stacks_resp.raise_for_status()
         stacks = sorted(stacks_resp.json(), key=lambda s: s['order'])
@@ -303,15 +393,7 @@ def fetch_user_tasks(login):
             stack_id = stack['id']
             stack_title = stack['title']
 
-            cards = stack.get('cards') or []
-            if not cards:
-                sd = requests.get(
-                    f"{BASE_URL}/boards/{board_id}/stacks/{stack_id}?details=true",
-                    headers=HEADERS,
-                    auth=HTTPBasicAuth(USERNAME, PASSWORD)
-                )
-                sd.raise_for_status()
-                cards = sd.json().get('cards', [])
+            cards = _resolve_stack_cards(board_id, stack)
 
             for card in cards:
                 assigned = [u['participant']['uid'] for u in (card.get('assignedUsers') or [])]
@@ -332,139 +414,354 @@ def fetch_user_tasks(login):
                 comments_count, attachments_count = _extract_counts(card)
                 etag = card.get('ETag') or card.get('Etag') or card.get('etag')
 
-                result.append({
-                    'card_id': card['id'], 'title': card['title'], 'description': card.get('description', ''),
-                    'board_id': board_id, 'board_title': board_title,
-                    'stack_id': stack_id, 'stack_title': stack_title,
-                    'prev_stack_id': prev_stack_id, 'prev_stack_title': prev_stack_title,
-                    'next_stack_id': next_stack_id, 'next_stack_title': next_stack_title,
-                    'duedate': duedate_dt, 'done': done_dt, 'assigned_logins': assigned,
-                    'comments_count': comments_count, 'attachments_count': attachments_count,
-                    'etag': etag
-                })
+                result.append(Card(
+                    card_id=card['id'], title=card['title'], description=card.get('description', ''),
+                    board_id=board_id, board_title=board_title,
+                    stack_id=stack_id, stack_title=stack_title,
+                    prev_stack_id=prev_stack_id, prev_stack_title=prev_stack_title,
+                    next_stack_id=next_stack_id, next_stack_title=next_stack_title,
+                    duedate=duedate_dt, done=done_dt, assigned_logins=assigned,
+                    comments_count=comments_count, attachments_count=attachments_count,
+                    etag=etag,
+                ))
 
     return result
 
 
-def fetch_all_tasks():
+# Кэш между циклами опроса: список досок и колонки досок (не больше
+# DECK_BOARD_CACHE_BOARDS) вместе с ETag ответа и lastModified доски,
+# при которых они были получены. Доски, пропавшие из списка, удаляются из кэша.
+_boards_list_cache: dict = {'etag': None, 'boards': None}
+_board_cache: dict = {}
+_board_cache_lock = threading.Lock()
+
+# Вердикты «колонка действительно пустая»: stack_id -> ETag (или lastModified)
+# колонки, при котором догрузка через /stacks/{id} вернула пустой список.
+_empty_stacks: dict = {}
+_stack_stats = {'refetched': 0, 'skipped': 0}
+_stack_lock = threading.Lock()
+
+
+def _stack_version(stack: dict) -> Optional[str]:
+    version = stack.get('ETag') or stack.get('etag') or stack.get('lastModified')
+    return str(version) if version is not None else None
+
+
+def _resolve_stack_cards(board_id: int, stack: dict) -> list:
+    """
+    Возвращает карточки колонки из ответа /stacks?details=true.
+
+    Deck не отдаёт ключ 'cards' у пустых колонок, поэтому без него нельзя
+    отличить пустую колонку от неполного ответа — раньше такие колонки
+    всегда догружались отдельным запросом. Теперь догрузка делается один раз:
+    если она вернула пустой список, это запоминается вместе с ETag колонки,
+    и пока ETag не изменился, колонка считается пустой без запроса.
     """
-    Получает все задачи со всех досок из Nextcloud.
-    Используется в scheduler.
+    cards = stack.get('cards')
+    if cards:
+        return cards
+
+    stack_id = stack['id']
+    version = _stack_version(stack)
+    with _stack_lock:
+        if version is not None and _empty_stacks.get(stack_id) == version:
+            _stack_stats['skipped'] += 1
+            return []
+
+    sd = nc_get(
+        f"{BASE_URL}/boards/{board_id}/stacks/{stack_id}?details=true",
+        headers=HEADERS,
+    )
+    sd.raise_for_status()
+    cards = sd.json().get('cards') or []
+
+    with _stack_lock:
+        _stack_stats['refetched'] += 1
+        if not cards and version is not None:
+            _empty_stacks[stack_id] = version
+        else:
+            _empty_stacks.pop(stack_id, None)
+    return cards
+
+
+def get_stack_fetch_stats() -> dict:
     """
-    while True:
-        logger.debug("CLOUD: получаю все карточки")
-        result = []
-        try:
-            boards_resp = requests.get(
-                f"{BASE_URL}/boards",
-                headers=HEADERS,
-                auth=HTTPBasicAuth(USERNAME, PASSWORD),
-            )
-            boards_resp.raise_for_status()
-            boards = boards_resp.json()
+    Счётчики догрузки колонок без карточек с момента запуска:
+    refetched — сделано запросов /stacks/{id}, skipped — запросов не понадобилось.
+    """
+    with _stack_lock:
+        return dict(_stack_stats)
 
-            for board in boards:
-                if board.get('archived', False): #вот тут насчет баги, чтобы комменты были отображались для и архивных тасков
-                    continue
 
-                board_id = board['id']
-                board_title = board['title']
-
-                stacks_resp = requests.get(
-                    f"{BASE_URL}/boards/{board_id}/stacks?details=true",
-                    headers=HEADERS,
-                    auth=HTTPBasicAuth(USERNAME, PASSWORD),
-                )
-                stacks_resp.raise_for_status()
-                stacks = sorted(stacks_resp.json(), key=lambda s: s['order'])
-
-                for idx, stack in enumerate(stacks):
-                    stack_id = stack['id']
-                    stack_title = stack['title']
-
-                    cards = stack.get('cards') or []
-                    if not cards:
-                        sd = requests.get(
-                            f"{BASE_URL}/boards/{board_id}/stacks/{stack_id}?details=true",
-                            headers=HEADERS,
-                            auth=HTTPBasicAuth(USERNAME, PASSWORD),
-                        )
-                        sd.raise_for_status()
-                        cards = sd.json().get('cards', [])
-
-                    for card in cards:
-                        duedate_raw = card.get('duedate') or card.get('dueDate')
-                        duedate_dt = _parse_due_utc_naive(duedate_raw, card_id=card.get('id'))
-
-                        assigned_logins = [
-                            u['participant']['uid']
-                            for u in (card.get('assignedUsers') or [])
-                        ]
-
-                        prev_stack_id = stacks[idx - 1]['id'] if idx > 0 else None
-                        prev_stack_title = stacks[idx - 1]['title'] if idx > 0 else None
-                        next_stack_id = stacks[idx + 1]['id'] if idx < len(stacks) - 1 else None
-                        next_stack_title = stacks[idx + 1]['title'] if idx < len(stacks) - 1 else None
-
-                        comments_count, attachments_count = _extract_counts(card)
-                        done_raw = card.get('done')
-                        done = _parse_done_utc_naive(done_raw, card_id=card.get('id'))
-                        etag = card.get('ETag') or card.get('Etag') or card.get('etag')
-                        old_etag, old_comments_count, old_attachments_count = get_etag_count(card['id'])
-                        lastModified = (
-                                datetime.now() - datetime.fromtimestamp(card['lastModified'])
-                        ).total_seconds()
-                        attachments_data = get_task_attachments(card['id'])
-                        comments_data = get_task_comments(card['id'])
-
-                        if old_etag != etag:
-                            if old_comments_count != comments_count:
-                                comments_data = get_comments(card['id'])
-
-                            if old_attachments_count != attachments_count:
-                                attachments_data = _get_list_attachments(board_id, stack_id, card['id'])
-
-                        labels = [
-                            l.get('title', '')
-                            for l in (card.get('labels') or [])
-                            if l.get('title')
-                        ]
-
-                        result.append({
-                            'card_id': card['id'],
-                            'title': card['title'],
-                            'description': card.get('description', ''),
-                            'board_id': board_id,
-                            'board_title': board_title,
-                            'stack_id': stack_id,
-                            'stack_title': stack_title,
-                            'prev_stack_id': prev_stack_id,
-                            'prev_stack_title': prev_stack_title,
-                            'next_stack_id': next_stack_id,
-                            'next_stack_title': next_stack_title,
-                            'duedate': duedate_dt,
-                            'done': done,
-                            'assigned_logins': assigned_logins,
-                            'comments_count': comments_count,
-                            'attachments_count': attachments_count,
-                            'etag': etag,
-                            'lastModified': int(lastModified),
-                            'labels': labels,
-                            'attachments_data': attachments_data,
-                            'comments_data': comments_data
-                        })
-
-        except (RequestException, ConnectionError, Timeout,
-                http.client.RemoteDisconnected, ConnectionResetError,
-                socket.gaierror, ConnectionAbortedError) as e:
-            logger.warning(
-                f"CLOUD: соединение сброшено/недоступно: {e}. "
-                f"Повтор через {POLL_INTERVAL} секунд."
-            )
-            time.sleep(POLL_INTERVAL)
-            continue
+def _get_boards() -> list:
+    """
+    Возвращает список досок. Если сервер ответил 304 на If-None-Match,
+    используется список из предыдущего цикла.
+    """
+    headers = dict(HEADERS)
+    if _boards_list_cache['etag'] and _boards_list_cache['boards'] is not None:
+        headers['If-None-Match'] = _boards_list_cache['etag']
+
+    boards_resp = nc_get(f"{BASE_URL}/boards", headers=headers)
+    if boards_resp.status_code == 304:
+        return _boards_list_cache['boards']
+
+    boards_resp.raise_for_status()
+    boards = boards_resp.json()
+    _boards_list_cache['etag'] = boards_resp.headers.get('ETag')
+    _boards_list_cache['boards'] = boards
+    return boards
+
+
+def _fetch_board_stacks(board: dict) -> Tuple[dict, list, float, bool]:
+    """
+    Загружает колонки доски вместе с карточками.
+    Возвращает (доска, отсортированные колонки, время загрузки в секундах,
+    взяты ли колонки из кэша).
+
+    Доска не запрашивается, если её lastModified не изменился с прошлой
+    загрузки (но не дольше DECK_BOARD_CACHE_TTL секунд). Иначе запрос идёт
+    с If-None-Match, и на 304 используются колонки из кэша.
+    """
+    t0 = time.monotonic()
+    board_id = board['id']
+    last_modified = board.get('lastModified')
+    cached = _board_cache.get(board_id)
+
+    if (cached is not None and last_modified is not None
+            and cached['last_modified'] == last_modified
+            and t0 - cached['fetched_at'] < DECK_BOARD_CACHE_TTL):
+        return board, cached['stacks'], 0.0, True
+
+    headers = dict(HEADERS)
+    if cached is not None and cached['etag']:
+        headers['If-None-Match'] = cached['etag']
+
+    stacks_resp = nc_get(
+        f"{BASE_URL}/boards/{board_id}/stacks?details=true",
+        headers=headers,
+    )
+    if stacks_resp.status_code == 304 and cached is not None:
+        cached['last_modified'] = last_modified
+        cached['fetched_at'] = t0
+        return board, cached['stacks'], time.monotonic() - t0, True
+
+    stacks_resp.raise_for_status()
+    stacks = sorted(stacks_resp.json(), key=lambda s: s['order'])
+
+    for stack in stacks:
+        stack['cards'] = _resolve_stack_cards(board_id, stack)
+
+    update_topology(board_id, stacks, stacks_resp.headers.get('ETag'))
+    with _board_cache_lock:
+        # Кэш полон — новые доски не кэшируются, пока не освободится место
+        if board_id in _board_cache or len(_board_cache) < DECK_BOARD_CACHE_BOARDS:
+            _board_cache[board_id] = {
+                'etag': stacks_resp.headers.get('ETag'),
+                'last_modified': last_modified,
+                'fetched_at': t0,
+                'stacks': stacks,
+            }
+    return board, stacks, time.monotonic() - t0, False
+
+
+def _prune_board_cache(board_ids) -> None:
+    """Удаляет из кэша колонки досок, которых больше нет в списке (архивные, удалённые)."""
+    active = set(board_ids)
+    with _board_cache_lock:
+        for board_id in [b for b in _board_cache if b not in active]:
+            del _board_cache[board_id]
+
+
+def _build_board_cards(board: dict, stacks: list, snapshot: dict) -> list:
+    """
+    Собирает карточки доски (Card).
+    snapshot — сохранённое состояние карточек из get_previous_state_snapshot().
+    Комментарии и вложения не загружаются: вместо них возвращаются
+    данные из снимка, а в need_comments/need_attachments помечается,
+    что их нужно догрузить из API.
+    """
+    board_id = board['id']
+    board_title = board['title']
+    result = []
+
+    for idx, stack in enumerate(stacks):
+        stack_id = stack['id']
+        stack_title = stack['title']
+
+        prev_stack_id = stacks[idx - 1]['id'] if idx > 0 else None
+        prev_stack_title = stacks[idx - 1]['title'] if idx > 0 else None
+        next_stack_id = stacks[idx + 1]['id'] if idx < len(stacks) - 1 else None
+        next_stack_title = stacks[idx + 1]['title'] if idx < len(stacks) - 1 else None
+
+        for card in stack.get('cards') or []:
+            duedate_raw = card.get('duedate') or card.get('dueDate')
+            duedate_dt = _parse_due_utc_naive(duedate_raw, card_id=card.get('id'))
+
+            assigned_logins = [
+                u['participant']['uid']
+                for u in (card.get('assignedUsers') or [])
+            ]
+
+            comments_count, attachments_count = _extract_counts(card)
+            done_raw = card.get('done')
+            done = _parse_done_utc_naive(done_raw, card_id=card.get('id'))
+            etag = card.get('ETag') or card.get('Etag') or card.get('etag')
+            state = snapshot.get(card['id'])
+            if state is None:
+                old_etag, old_comments_count, old_attachments_count = None, None, None
+                attachments_data, comments_data = set(), set()
+            else:
+                old_etag = state['etag']
+                old_comments_count = state['comments_count']
+                old_attachments_count = state['attachments_count']
+                attachments_data = set(state['attachments'])
+                comments_data = set(state['comments'])
+            last_modified = (
+                    datetime.now() - datetime.fromtimestamp(card['lastModified'])
+            ).total_seconds()
+
+            need_comments = old_etag != etag and old_comments_count != comments_count
+            need_attachments = old_etag != etag and old_attachments_count != attachments_count
+
+            labels = [
+                l.get('title', '')
+                for l in (card.get('labels') or [])
+                if l.get('title')
+            ]
+
+            result.append(Card(
+                card_id=card['id'],
+                title=card['title'],
+                description=card.get('description', ''),
+                board_id=board_id,
+                board_title=board_title,
+                stack_id=stack_id,
+                stack_title=stack_title,
+                prev_stack_id=prev_stack_id,
+                prev_stack_title=prev_stack_title,
+                next_stack_id=next_stack_id,
+                next_stack_title=next_stack_title,
+                duedate=duedate_dt,
+                done=done,
+                assigned_logins=assigned_logins,
+                comments_count=comments_count,
+                attachments_count=attachments_count,
+                etag=etag,
+                last_modified=int(last_modified),
+                labels=labels,
+                attachments_data=attachments_data,
+                comments_data=comments_data,
+                need_comments=need_comments,
+                need_attachments=need_attachments,
+            ))
+
+    return result
+
+
+def _load_card_details(pool: ThreadPoolExecutor, cards: list) -> None:
+    """
+    Параллельно догружает комментарии и вложения карточек,
+    у которых изменились счётчики. Результаты записываются в сами карточки.
+    """
+    jobs = []
+    for card in cards:
+        if card.need_comments:
+            jobs.append((card, 'comments_data', pool.submit(get_comments, card.card_id)))
+        if card.need_attachments:
+            jobs.append((card, 'attachments_data', pool.submit(
+                _get_list_attachments, card.board_id, card.stack_id, card.card_id
+            )))
+
+    for card, name, future in jobs:
+        setattr(card, name, future.result())
+
+
+def iter_board_tasks():
+    """
+    Генератор: отдаёт карточки по доскам по мере загрузки — тройки
+    (доска, карточки Card, снимок их сохранённого состояния). Снимок
+    (get_previous_state_snapshot) загружается для каждой доски отдельно —
+    только её карточки; комментарии и вложения изменившихся карточек догружаются.
+
+    Одновременно загружается не больше FETCH_WORKERS досок, поэтому в памяти
+    держатся только они и доска, которую сейчас обрабатывает потребитель.
+    Доска, которую не удалось загрузить, пропускается до следующего цикла.
+    Сетевая ошибка при получении списка досок (или если не загрузилась
+    ни одна доска) пробрасывается наружу.
+    """
+    logger.debug("CLOUD: получаю все карточки")
+    t0 = time.monotonic()
+    boards = [
+        b for b in _get_boards()
+        if not b.get('archived', False)  # вот тут насчет баги, чтобы комменты были отображались для и архивных тасков
+    ]
+    _prune_board_cache(b['id'] for b in boards)
+    total_cards = 0
+    loaded = 0
+    from_cache = 0
+    stack_stats_before = get_stack_fetch_stats()
+    latencies = []
+    queue = iter(boards)
+
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="deck-fetch") as pool:
+        pending = {}
+        for board in queue:
+            pending[pool.submit(_fetch_board_stacks, board)] = board
+            if len(pending) >= FETCH_WORKERS:
+                break
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                board = pending.pop(future)
+                next_board = next(queue, None)
+                if next_board is not None:
+                    pending[pool.submit(_fetch_board_stacks, next_board)] = next_board
+
+                try:
+                    _, stacks, elapsed, cached = future.result()
+                    board_snapshot = get_previous_state_snapshot(
+                        card['id'] for stack in stacks for card in stack.get('cards') or []
+                    )
+                    cards = _build_board_cards(board, stacks, board_snapshot)
+                    _load_card_details(pool, cards)
+                except (RequestException, http.client.RemoteDisconnected, ConnectionResetError,
+                        socket.gaierror, ConnectionAbortedError) as e:
+                    logger.warning(
+                        f"CLOUD: доска «{board.get('title')}» ({board['id']}) недоступна: {e}. "
+                        f"Пропускаю до следующего цикла."
+                    )
+                    continue
 
-        return result
+                loaded += 1
+                total_cards += len(cards)
+                if cached:
+                    from_cache += 1
+                    logger.debug(f"CLOUD: доска «{board['title']}» ({board['id']}) не изменилась")
+                else:
+                    latencies.append((elapsed, board))
+                    logger.debug(f"CLOUD: доска «{board['title']}» ({board['id']}) "
+                                 f"загружена за {elapsed:.2f}s")
+
+                yield board, cards, board_snapshot
+
+    if boards and not loaded:
+        raise ConnectionError("не удалось загрузить ни одной доски")
+
+    summary = (
+        f"CLOUD: {total_cards} карточек с {loaded}/{len(boards)} досок "
+        f"за {time.monotonic() - t0:.2f}s, без изменений: {from_cache}"
+    )
+    stack_stats = get_stack_fetch_stats()
+    refetched = stack_stats['refetched'] - stack_stats_before['refetched']
+    skipped = stack_stats['skipped'] - stack_stats_before['skipped']
+    if refetched or skipped:
+        summary += f", догружено колонок: {refetched}, пустых без запроса: {skipped}"
+    if latencies:
+        slowest_sec, slowest = max(latencies, key=lambda x: x[0])
+        summary += f" (дольше всех «{slowest['title']}» ({slowest['id']}) — {slowest_sec:.2f}s)"
+    logger.info(summary)
 
 
 def archive_card(board_id, stack_id, card_id):
@@ -474,10 +771,9 @@ def archive_card(board_id, stack_id, card_id):
     """
     url = f"{BASE_URL}/boards/{board_id}/stacks/{stack_id}/cards/{card_id}/archive"
     try:
-        resp = requests.put(
+        resp = nc_put(
             url,
             headers=HEADERS,
-            auth=HTTPBasicAuth(USERNAME, PASSWORD),
         )
         if resp.status_code in (200, 204):
             logger.info(
@@ -0,0 +1,96 @@
+import threading
+from typing import Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from source.config import (
+    USERNAME, PASSWORD,
+    NC_CONNECT_TIMEOUT, NC_READ_TIMEOUT, NC_POOL_SIZE, NC_RETRIES,
+)
+
+# Учётные данные сервисного пользователя — используются по умолчанию
+SERVICE_AUTH = (USERNAME, PASSWORD)
+
+_sessions: dict = {}
+_lock = threading.Lock()
+
+
+class _NextcloudSession(requests.Session):
+    """
+    requests.Session с таймаутом по умолчанию.
+    Явно переданный timeout имеет приоритет.
+    """
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", (NC_CONNECT_TIMEOUT, NC_READ_TIMEOUT))
+        return super().request(method, url, **kwargs)
+
+
+def _build_session(auth: Optional[Tuple[str, str]]) -> requests.Session:
+    """
+    Создаёт сессию с пулом keep-alive соединений:
+    - не больше NC_POOL_SIZE соединений на хост (лишние запросы ждут свободное)
+    - повтор с экспоненциальной паузой для идемпотентных методов (GET/PUT/DELETE),
+      POST не повторяется
+    - gzip-сжатие ответов
+    """
+    retry = Retry(
+        total=NC_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        raise_on_status=False,
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=NC_POOL_SIZE,
+        pool_block=True,
+        max_retries=retry,
+    )
+
+    session = _NextcloudSession()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive",
+    })
+    if auth is not None:
+        session.auth = auth
+    return session
+
+
+def nc_session(auth: Optional[Tuple[str, str]] = SERVICE_AUTH) -> requests.Session:
+    """
+    Возвращает общую сессию для набора учётных данных.
+    auth=None — сессия без авторизации (например, для Login Flow v2).
+    """
+    key = tuple(auth) if auth is not None else None
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _build_session(key)
+            _sessions[key] = session
+        return session
+
+
+def nc_get(url: str, auth: Optional[Tuple[str, str]] = SERVICE_AUTH, **kwargs) -> requests.Response:
+    """GET-запрос к Nextcloud через общую сессию."""
+    return nc_session(auth).get(url, **kwargs)
+
+
+def nc_post(url: str, auth: Optional[Tuple[str, str]] = SERVICE_AUTH, **kwargs) -> requests.Response:
+    """POST-запрос к Nextcloud через общую сессию (без автоматических повторов)."""
+    return nc_session(auth).post(url, **kwargs)
+
+
+def nc_put(url: str, auth: Optional[Tuple[str, str]] = SERVICE_AUTH, **kwargs) -> requests.Response:
+    """PUT-запрос к Nextcloud через общую сессию."""
+    return nc_session(auth).put(url, **kwargs)
@@ -0,0 +1,330 @@
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional
+
+import requests
+from telebot.apihelper import ApiException
+from telebot.types import InlineKeyboardMarkup
+
+from source.app_logging import logger
+from source.config import (
+    OUTBOX_WORKERS, OUTBOX_BATCH, OUTBOX_POLL_INTERVAL, OUTBOX_MAX_ATTEMPTS, CARD_MESSAGE_EDIT_HOURS,
+    CARD_MESSAGE_EDIT_HOURS_PRIVATE, FORUM_CHAT_ID, OUTBOX_LOG_INFLIGHT, OUTBOX_LOG_MAX_PENDING, STATS_LOG_MINUTES,
+)
+from source.connections.sender import (
+    deliver_message, deliver_edit, retry_after_of, get_sender_stats, FairQueue, SenderBusy,
+)
+from source.db.repos.card_messages import get_card_message, save_card_message
+from source.db.repos.outbox import (
+    claim_outbox_batch, claim_outbox_by_thread, mark_outbox_delivered, mark_outbox_failed, reset_inflight_outbox,
+    count_pending, get_pending, replace_pending, outbox_message, defer_outbox,
+)
+
+_wakeup = threading.Event()
+_queues: list = []
+_inflight = 0
+_log_inflight = 0
+# Сообщения лога в работе по топикам: { message_thread_id: сколько }
+_log_threads = Counter()
+_inflight_lock = threading.Lock()
+_started = False
+
+# Как часто (сек) проверять размер очереди лога и сколько заголовков показывать в сводке
+_COMPACT_EVERY = 5.0
+_SUMMARY_LINES = 20
+
+_stats = Counter()
+
+
+def wake_outbox() -> None:
+    """Будит диспетчер outbox (вызывается после фиксации транзакции с новыми сообщениями)."""
+    _wakeup.set()
+
+
+def _retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(5 * 2 ** (attempts - 1), 300))
+
+
+def _is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, SenderBusy)):
+        return True
+    if isinstance(exc, ApiException):
+        code = getattr(exc, "error_code", None)
+        if code is None:
+            code = getattr(getattr(exc, "result", None), "status_code", None)
+        return code == 429 or (code is not None and code >= 500)
+    return False
+
+
+def _deliver_card_message(chat_id: int, card_id: int, text: str, options: dict) -> None:
+    """
+    Сообщение об изменениях карточки: редактирует прошлое сообщение о ней в этом чате,
+    если оно моложе CARD_MESSAGE_EDIT_HOURS (в личке — CARD_MESSAGE_EDIT_HOURS_PRIVATE),
+    иначе отправляет новое и запоминает его.
+    """
+    edit_hours = CARD_MESSAGE_EDIT_HOURS if chat_id == FORUM_CHAT_ID else CARD_MESSAGE_EDIT_HOURS_PRIVATE
+    previous = get_card_message(chat_id, card_id) if edit_hours else None
+    if previous is not None:
+        message_id, sent_at = previous
+        if datetime.utcnow() - sent_at < timedelta(hours=edit_hours):
+            try:
+                deliver_edit(chat_id, message_id, text, **options)
+                return
+            except ApiException as e:
+                if _is_retryable(e):
+                    raise
+                if "message is not modified" in str(e):
+                    return
+                # Сообщение удалили или его больше нельзя редактировать
+                logger.info(f"OUTBOX: сообщение {message_id} о карточке {card_id} в chat_id={chat_id} "
+                            f"не отредактировано ({e}) — отправляю новое")
+
+    sent = deliver_message(chat_id, text, **options)
+    if sent is not None and edit_hours:
+        save_card_message(chat_id, card_id, sent.message_id)
+
+
+def _deliver(message: dict) -> Optional[datetime]:
+    """Отправляет сообщение из outbox. Возвращает время повтора, если отправка отложена."""
+    options = dict(message["options"])
+    if options.get("reply_markup"):
+        options["reply_markup"] = InlineKeyboardMarkup.de_json(options["reply_markup"])
+    card_id = options.pop("card_id", None)
+    # Уведомления из outbox не должны задерживать ответы на команды (полоса interactive)
+    options["lane"] = "log" if message["chat_id"] == FORUM_CHAT_ID else "personal"
+
+    try:
+        if card_id is not None:
+            _deliver_card_message(message["chat_id"], card_id, message["text"], options)
+        else:
+            deliver_message(message["chat_id"], message["text"], **options)
+    except Exception as e:
+        attempts = message["attempts"]
+        if _is_retryable(e) and attempts < OUTBOX_MAX_ATTEMPTS:
+            delay = max(_retry_delay(attempts), timedelta(seconds=retry_after_of(e) or 0))
+            retry_at = datetime.utcnow() + delay
+            logger.warning(
+                f"OUTBOX: сообщение {message['id']} в chat_id={message['chat_id']} не отправлено "
+                f"(попытка {attempts}): {e}. Повтор в {retry_at:%H:%M:%S} UTC"
+            )
+        else:
+            retry_at = None
+            logger.error(
+                f"OUTBOX: сообщение {message['id']} в chat_id={message['chat_id']} не доставлено: {e}"
+            )
+        mark_outbox_failed(message["id"], str(e), retry_at)
+        return retry_at
+
+    mark_outbox_delivered(message["id"])
+    return None
+
+
+def _log_summary(thread_id, messages: list) -> dict:
+    """Одно сообщение лога вместо нескольких: сколько каких событий и их заголовки."""
+    kinds = Counter(m["text"].split(" ", 1)[0] for m in messages)
+    heads = [m["text"].split("\n", 1)[0].rstrip(":") for m in messages]
+    text = (
+        f"🧾 *Сводка*: {len(messages)} событий объединены в одно сообщение "
+        f"({', '.join(f'{kind} {n}' for kind, n in kinds.most_common())}):\n"
+        + "\n".join(heads[:_SUMMARY_LINES])
+    )
+    if len(heads) > _SUMMARY_LINES:
+        text += f"\n…и ещё {len(heads) - _SUMMARY_LINES}"
+    return outbox_message(FORUM_CHAT_ID, text, message_thread_id=thread_id)
+
+
+def _compact_log_backlog() -> None:
+    """
+    Политика переполнения лога в форум-чат. Если ждут отправки больше
+    OUTBOX_LOG_MAX_PENDING сообщений:
+    1. отбрасываются устаревшие «Изменения в карточке» — если по той же карточке
+       ждёт более новое сообщение (оно всё равно отредактирует старое);
+    2. всё, что сверх половины лимита, объединяется в сводку — одну на топик (доску).
+    Первые сообщения очереди уходят как есть, порядок сводок — после них.
+    """
+    depth = count_pending(FORUM_CHAT_ID)
+    _stats["log_depth"] = depth
+    _stats["log_depth_max"] = max(_stats["log_depth_max"], depth)
+    if depth <= OUTBOX_LOG_MAX_PENDING:
+        return
+
+    pending = get_pending(FORUM_CHAT_ID)
+    latest = {}
+    for m in pending:
+        card_id = m["options"].get("card_id")
+        if card_id is not None:
+            latest[card_id] = m["id"]
+    superseded = {
+        m["id"] for m in pending
+        if m["options"].get("card_id") is not None and latest[m["options"]["card_id"]] != m["id"]
+    }
+    rest = [m for m in pending if m["id"] not in superseded]
+
+    by_thread = {}
+    if len(rest) > OUTBOX_LOG_MAX_PENDING:
+        for m in rest[OUTBOX_LOG_MAX_PENDING // 2:]:
+            by_thread.setdefault(m["options"].get("message_thread_id"), []).append(m)
+    merged = [group for group in by_thread.values() if len(group) > 1]
+    merged_ids = [m["id"] for group in merged for m in group]
+
+    removed = replace_pending(
+        list(superseded) + merged_ids,
+        [_log_summary(group[0]["options"].get("message_thread_id"), group) for group in merged],
+    )
+    _stats["log_dropped"] += len(superseded)
+    _stats["log_merged"] += len(merged_ids)
+    _stats["log_summaries"] += len(merged)
+    _stats["log_depth"] = depth - removed + len(merged)
+    logger.warning(
+        f"OUTBOX: в лог ждут отправки {depth} сообщений (лимит {OUTBOX_LOG_MAX_PENDING}): "
+        f"отброшено устаревших — {len(superseded)}, объединено — {len(merged_ids)} в {len(merged)} сводок"
+    )
+
+
+def get_outbox_stats() -> dict:
+    """
+    Метрики outbox: сообщения в работе (всего и в лог), очередь лога
+    (log_depth — при последней проверке, log_depth_max — максимум),
+    отброшенные устаревшие (log_dropped), объединённые (log_merged) и сводки (log_summaries).
+    """
+    with _inflight_lock:
+        stats = dict(_stats)
+        stats["inflight"] = _inflight
+        stats["log_inflight"] = _log_inflight
+    return stats
+
+
+def _log_stats() -> None:
+    """Сводка метрик отправки в лог (раз в STATS_LOG_MINUTES минут)."""
+    sender = get_sender_stats()
+    limiter = sender["limiter"]
+    outbox = get_outbox_stats()
+    rates = ", ".join(f"{name} {rate}/с" for name, rate in sender["rates"].items())
+    parts = [
+        f"отправлено {sender.get('sent', 0)}, 429 — {sender.get('throttled', 0)} "
+        f"(глобальных пауз {sender.get('global_pauses', 0)}), повторов {sender.get('retried', 0)}, "
+        f"не доставлено {sender.get('dropped', 0)}",
+        f"частота в чат: {rates}",
+        f"лимитер: чатов {limiter['buckets']}, вытеснено {limiter['evicted']}, "
+        f"~{limiter['memory_bytes'] // 1024} КБ",
+        f"в работе {outbox['inflight']} (лог {outbox['log_inflight']}), очередь лога "
+        f"{outbox.get('log_depth', 0)} (макс. {outbox.get('log_depth_max', 0)}), отброшено "
+        f"{outbox.get('log_dropped', 0)}, объединено {outbox.get('log_merged', 0)} "
+        f"в {outbox.get('log_summaries', 0)} сводок",
+    ]
+    logger.info(f"OUTBOX: {'; '.join(parts)}")
+
+
+def _worker_loop(q: FairQueue) -> None:
+    global _inflight, _log_inflight
+    # Чаты (топики), где сообщение отложено до повтора: { (chat_id, thread_id): (id, retry_at) }.
+    # Взятые следующие сообщения туда откладываются за ним, чтобы не обогнать его
+    held = {}
+    while True:
+        message = q.get()
+        key = (message["chat_id"], message["options"].get("message_thread_id"))
+        try:
+            blocker = held.get(key)
+            if blocker is not None and blocker[0] == message["id"]:
+                del held[key]
+                blocker = None
+            if blocker is not None and blocker[0] < message["id"]:
+                defer_outbox(message["id"], blocker[1])
+            else:
+                retry_at = _deliver(message)
+                if retry_at is not None:
+                    held[key] = (message["id"], retry_at)
+        except Exception as e:
+            # Сбой БД при отметке: сообщение останется в sending и вернётся в очередь при рестарте
+            logger.error(f"OUTBOX: ошибка обработки сообщения {message.get('id')} — {e}")
+            logger.debug(traceback.format_exc())
+        finally:
+            with _inflight_lock:
+                _inflight -= 1
+                if message["chat_id"] == FORUM_CHAT_ID:
+                    _log_inflight -= 1
+                    thread_id = message["options"].get("message_thread_id")
+                    _log_threads[thread_id] -= 1
+                    if _log_threads[thread_id] <= 0:
+                        del _log_threads[thread_id]
+            _wakeup.set()
+
+
+def _dispatch_loop() -> None:
+    """
+    Забирает готовые сообщения из outbox и раздаёт их воркерам.
+    Сообщения одного чата всегда попадают к одному воркеру, поэтому
+    порядок отправки в чат (и в топик форума) сохраняется, а между топиками
+    и чатами воркер чередует сообщения по кругу. Если сообщение отложено до повтора,
+    следующие в тот же чат (топик) не забираются из outbox, а уже взятые
+    откладываются воркером до того же времени — они не обгоняют его.
+    Лог в форум-чат (~20 сообщений/мин) занимает не больше OUTBOX_LOG_INFLIGHT мест,
+    чтобы его очередь не задерживала личные уведомления и напоминания; эти места
+    делятся между топиками по кругу (claim_outbox_by_thread), чтобы шумная доска
+    не занимала их все.
+    """
+    global _inflight, _log_inflight
+    compacted_at = 0.0
+    logged_at = time.monotonic()
+    while True:
+        _wakeup.wait(OUTBOX_POLL_INTERVAL)
+        _wakeup.clear()
+        try:
+            if STATS_LOG_MINUTES and time.monotonic() - logged_at >= STATS_LOG_MINUTES * 60:
+                logged_at = time.monotonic()
+                _log_stats()
+
+            with _inflight_lock:
+                free = OUTBOX_BATCH - _inflight
+                log_free = min(free, OUTBOX_LOG_INFLIGHT - _log_inflight)
+                thread_load = dict(_log_threads)
+            if free <= 0:
+                continue
+
+            if FORUM_CHAT_ID and time.monotonic() - compacted_at >= _COMPACT_EVERY:
+                compacted_at = time.monotonic()
+                _compact_log_backlog()
+
+            batch = claim_outbox_batch(free, exclude_chat_id=FORUM_CHAT_ID or None)
+            log_limit = min(free - len(batch), log_free) if FORUM_CHAT_ID else 0
+            log_batch = claim_outbox_by_thread(FORUM_CHAT_ID, log_limit, thread_load) if log_limit > 0 else []
+            for message in batch + log_batch:
+                with _inflight_lock:
+                    _inflight += 1
+                    if message["chat_id"] == FORUM_CHAT_ID:
+                        _log_inflight += 1
+                        _log_threads[message["options"].get("message_thread_id")] += 1
+                key = (message["chat_id"], message["options"].get("message_thread_id"))
+                _queues[message["chat_id"] % len(_queues)].put(key, message)
+
+            if len(batch) == free or (log_limit > 0 and len(log_batch) == log_limit):
+                # Возможно, в outbox есть ещё — не ждём следующего тика
+                _wakeup.set()
+        except Exception as e:
+            logger.error(f"OUTBOX: ошибка выборки сообщений — {e}")
+            logger.debug(traceback.format_exc())
+
+
+def start_outbox_workers() -> None:
+    """
+    Запускает диспетчер и OUTBOX_WORKERS воркеров отправки.
+    Сообщения, взятые в работу до перезапуска, возвращаются в очередь.
+    """
+    global _started
+    if _started:
+        return
+    _started = True
+
+    restored = reset_inflight_outbox()
+    if restored:
+        logger.info(f"OUTBOX: {restored} недоставленных сообщений возвращено в очередь")
+
+    for i in range(OUTBOX_WORKERS):
+        q = FairQueue()
+        _queues.append(q)
+        threading.Thread(target=_worker_loop, args=(q,), name=f"outbox-{i}", daemon=True).start()
+    threading.Thread(target=_dispatch_loop, name="outbox-dispatch", daemon=True).start()
+    logger.info(f"OUTBOX: запущено воркеров отправки: {OUTBOX_WORKERS}")
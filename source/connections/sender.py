@@ -1,11 +1,16 @@
 import time
 import html
 import re
-from collections import deque, defaultdict
+import sys
+import threading
+from collections import deque, Counter, OrderedDict
+from contextlib import contextmanager
 import requests
-from telebot.apihelper import ApiException
+from telebot.apihelper import ApiException, ApiTelegramException
 from source.connections.bot_factory import bot
 from source.app_logging import logger
+from source.config import TG_MAX_RETRIES, TG_PRIVATE_RATE, TG_GROUP_RATE, TG_FORUM_RATE, FORUM_CHAT_ID, \
+    TG_LIMITER_MAX_CHATS, TG_MESSAGE_LIMIT, TG_LANE_WEIGHTS, TG_LANE_QUEUE
 
 
 def _fmt_duration(seconds: float) -> str:
@@ -15,26 +20,377 @@ def _fmt_duration(seconds: float) -> str:
     return f"{m}m {s}s"
 
 
-class TokenBucket:
-    def __init__(self, max_calls: int, period: float):
-        self.max_calls = max_calls
-        self.period = period
-        self.calls = deque()
+class GcraLimiter:
+    """
+    Лимитер по алгоритму GCRA (virtual scheduling): на каждый ключ (чат)
+    хранится одно число — TAT, теоретическое время следующей отправки.
+
+    Ключи хранятся в порядке последнего обращения (LRU). Ключ, у которого TAT
+    уже в прошлом, ничем не отличается от отсутствующего и удаляется при
+    следующем обращении к лимитеру; сверх max_keys вытесняются самые давние.
+    """
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self.evicted = 0
+        self._tat: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def reserve(self, key, interval: float, burst: int = 1) -> float:
+        """
+        Занимает ближайший слот для ключа: не чаще одного раза в interval секунд,
+        с запасом на burst сообщений подряд. Возвращает, сколько секунд ждать до слота.
+        """
+        tolerance = interval * (burst - 1)
+        with self._lock:
+            now = time.monotonic()
+            tat = max(self._tat.pop(key, now), now)
+            at = max(now, tat - tolerance)
+            self._tat[key] = tat + interval
+            self._evict(now)
+            return at - now
+
+    def defer(self, key, seconds: float) -> None:
+        """Не выдавать слоты ключу ближайшие seconds секунд (пауза после 429)."""
+        with self._lock:
+            now = time.monotonic()
+            self._tat[key] = max(self._tat.pop(key, now), now + seconds)
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        tat = self._tat
+        while tat:
+            key, oldest = next(iter(tat.items()))
+            if oldest > now and len(tat) <= self.max_keys:
+                break
+            del tat[key]
+            if oldest > now:
+                self.evicted += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._tat)
+            memory = sys.getsizeof(self._tat) + size * (2 * sys.getsizeof(0.0))
+            return {"buckets": size, "evicted": self.evicted, "memory_bytes": memory}
+
+
+class AdaptiveRate:
+    """
+    Безопасная частота отправки в один чат (сообщений/с) для класса чатов (AIMD):
+    каждая успешная отправка немного повышает частоту (до ceiling),
+    каждый 429 — вдвое снижает (не ниже floor).
+    """
+
+    def __init__(self, ceiling: float, floor: float, step: float):
+        self.ceiling = ceiling
+        self.floor = floor
+        self.step = step
+        self.rate = ceiling
+        self._lock = threading.Lock()
+
+    @property
+    def interval(self) -> float:
+        """Минимальный интервал между сообщениями в один чат, секунд."""
+        return 1.0 / self.rate
+
+    def succeeded(self) -> None:
+        with self._lock:
+            self.rate = min(self.ceiling, self.rate + self.step)
+
+    def throttled(self) -> None:
+        with self._lock:
+            self.rate = max(self.floor, self.rate / 2)
+
+
+class SenderBusy(Exception):
+    """Очередь полосы приоритета переполнена — сообщение стоит отправить позже."""
+
+
+class _Ticket:
+    __slots__ = ("granted",)
+
+    def __init__(self):
+        self.granted = False
+
+
+class PriorityGate:
+    """
+    Общий лимит бота (rate сообщений/с, до burst подряд) с полосами приоритета.
+
+    Ожидающие слот стоят в очереди своей полосы (FIFO, не больше max_waiting);
+    свободный слот достаётся голове одной из непустых полос по взвешенному
+    round-robin (smooth WRR): при весах 8:3:1 и занятых полосах интерактивные
+    ответы получают 8 слотов из 12, но и фоновые полосы не голодают.
+    """
+
+    def __init__(self, rate: float, burst: int, weights: dict, max_waiting: int):
+        self.rate = rate
+        self.burst = burst
+        self.weights = dict(weights)
+        self.max_waiting = max_waiting
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._queues = {lane: deque() for lane in self.weights}
+        self._credit = {lane: 0 for lane in self.weights}
+        self._granted = Counter()
+        self._max_wait = {lane: 0.0 for lane in self.weights}
+        self._cond = threading.Condition()
+
+    def acquire(self, lane: str) -> float:
+        """Ждёт слот в общем лимите для полосы lane. Возвращает время ожидания, секунд."""
+        started = time.monotonic()
+        ticket = _Ticket()
+        with self._cond:
+            queue = self._queues[lane]
+            if len(queue) >= self.max_waiting:
+                raise SenderBusy(f"очередь полосы {lane} переполнена ({len(queue)})")
+            queue.append(ticket)
+            while True:
+                delay = self._dispatch(time.monotonic())
+                if ticket.granted:
+                    break
+                self._cond.wait(delay)
+        waited = time.monotonic() - started
+        with self._cond:
+            self._max_wait[lane] = max(self._max_wait[lane], waited)
+        return waited
+
+    def defer(self, seconds: float) -> None:
+        """Не выдавать слоты ближайшие seconds секунд (глобальный 429)."""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+    def _dispatch(self, now: float) -> float | None:
+        """
+        Раздаёт накопившиеся слоты головам полос (под self._cond).
+        Возвращает, сколько ждать до следующего слота (None — пока некого обслуживать).
+        """
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if now < self._paused_until:
+            return self._paused_until - now
+        woke = False
+        while self._tokens >= 1:
+            lane = self._next_lane()
+            if lane is None:
+                break
+            self._queues[lane].popleft().granted = True
+            self._granted[lane] += 1
+            self._tokens -= 1
+            woke = True
+        if woke:
+            self._cond.notify_all()
+        if not any(self._queues.values()):
+            return None
+        return (1 - self._tokens) / self.rate
+
+    def _next_lane(self) -> str | None:
+        busy = [lane for lane, queue in self._queues.items() if queue]
+        if not busy:
+            return None
+        if len(busy) == 1:
+            return busy[0]
+        total = 0
+        for lane in busy:
+            self._credit[lane] += self.weights[lane]
+            total += self.weights[lane]
+        best = max(busy, key=self._credit.__getitem__)
+        self._credit[best] -= total
+        return best
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                lane: {
+                    "waiting": len(self._queues[lane]),
+                    "granted": self._granted[lane],
+                    "max_wait": round(self._max_wait[lane], 3),
+                }
+                for lane in self.weights
+            }
+
+
+_limiter = GcraLimiter(max_keys=TG_LIMITER_MAX_CHATS)
+
+# Общий лимит ~30/s на весь бот. Полосы: ответы на команды и кнопки,
+# личные уведомления из outbox, логи в форум-чат
+LANES = ("interactive", "personal", "log")
+_gate = PriorityGate(
+    rate=30,
+    burst=30,
+    weights=dict(zip(LANES, TG_LANE_WEIGHTS + (1,) * len(LANES))),
+    max_waiting=TG_LANE_QUEUE,
+)
+
+# Частота по классам чатов: личные чаты (~1/s), группы (~20/min)
+# и форум-чат с логами (FORUM_CHAT_ID, все топики делят лимит группы)
+_rates = {
+    "private": AdaptiveRate(ceiling=TG_PRIVATE_RATE, floor=1 / 60, step=0.02),
+    "group": AdaptiveRate(ceiling=TG_GROUP_RATE / 60, floor=1 / 300, step=0.005),
+    "forum": AdaptiveRate(ceiling=TG_FORUM_RATE / 60, floor=1 / 300, step=0.005),
+}
+
+_recent_429 = deque()  # (time, chat_id) за последние секунды — для распознавания глобального лимита
+_recent_lock = threading.Lock()
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(name: str, n: int = 1) -> None:
+    with _stats_lock:
+        _stats[name] += n
+
+
+def _chat_class(chat_id: int) -> str:
+    if chat_id > 0:
+        return "private"
+    if chat_id == FORUM_CHAT_ID:
+        return "forum"
+    return "group"
+
+
+class FairQueue:
+    """
+    Очередь с round-robin по ключам (например, (chat_id, message_thread_id)):
+    get() по очереди отдаёт по одному элементу каждого ключа, поэтому шумный
+    топик не задерживает сообщения других топиков. Внутри ключа порядок FIFO.
+    """
+
+    def __init__(self):
+        self._lanes: dict = {}
+        self._order = deque()
+        self._cond = threading.Condition()
+
+    def put(self, key, item) -> None:
+        with self._cond:
+            lane = self._lanes.get(key)
+            if lane is None:
+                lane = self._lanes[key] = deque()
+                self._order.append(key)
+            lane.append(item)
+            self._cond.notify()
+
+    def get(self):
+        with self._cond:
+            while not self._order:
+                self._cond.wait()
+            key = self._order.popleft()
+            lane = self._lanes[key]
+            item = lane.popleft()
+            if lane:
+                self._order.append(key)
+            else:
+                del self._lanes[key]
+            return item
+
+    def qsize(self) -> int:
+        with self._cond:
+            return sum(len(lane) for lane in self._lanes.values())
+
+
+def retry_after_of(exc: BaseException) -> float | None:
+    """Возвращает retry_after (сек) из ответа Telegram 429, иначе None."""
+    if not isinstance(exc, ApiTelegramException) or exc.error_code != 429:
+        return None
+    params = (exc.result_json or {}).get("parameters") or {}
+    try:
+        return float(params.get("retry_after", 1))
+    except (TypeError, ValueError):
+        return 1.0
 
-    def wait(self):
-        now = time.time()
-        while self.calls and self.calls[0] <= now - self.period:
-            self.calls.popleft()
-        if len(self.calls) >= self.max_calls:
-            sleep_time = self.period - (now - self.calls[0])
-            if sleep_time > 0:
-                logger.debug(f"Пауза {_fmt_duration(sleep_time)} (лимит {self.max_calls}/{int(self.period)}s)")
-                time.sleep(sleep_time)
-        self.calls.append(time.time())
+
+def _on_throttled(chat_id: int, retry_after: float) -> None:
+    """
+    Ставит чат на паузу на retry_after секунд и снижает частоту его класса.
+    Если за это же окно 429 получили и другие чаты — лимит общий,
+    и на паузу встаёт весь бот.
+    """
+    now = time.monotonic()
+    with _recent_lock:
+        while _recent_429 and _recent_429[0][0] < now - max(retry_after, 1.0):
+            _recent_429.popleft()
+        _recent_429.append((now, chat_id))
+        is_global = len({c for _, c in _recent_429}) > 1
+
+    _limiter.defer(chat_id, retry_after)
+    if is_global:
+        _gate.defer(retry_after)
+
+    _rates[_chat_class(chat_id)].throttled()
+    _count("throttled")
+    if is_global:
+        _count("global_pauses")
+    logger.warning(
+        f"Telegram 429 для chat_id={chat_id}: пауза {_fmt_duration(retry_after)}"
+        f"{' для всего бота' if is_global else ''}, "
+        f"частота класса {_chat_class(chat_id)} — {_rates[_chat_class(chat_id)].rate:.2f}/s"
+    )
+
+
+def _default_lane(chat_id: int) -> str:
+    """Полоса для прямых вызовов: логи в форум-чат — log, остальное — ответы пользователям."""
+    return "log" if chat_id == FORUM_CHAT_ID else "interactive"
 
 
-_global = TokenBucket(max_calls=30, period=1.0)  # ~30/s суммарно
-_per_chat = defaultdict(lambda: TokenBucket(max_calls=1, period=1.0))  # ~1/s в чат
+def _wait_turn(chat_id: int, lane: str) -> None:
+    """Ждёт слот в чате (с учётом паузы после 429), затем — в общем лимите в своей полосе."""
+    delay = _limiter.reserve(chat_id, _rates[_chat_class(chat_id)].interval)
+    if delay > 0:
+        logger.debug(f"Пауза {_fmt_duration(delay)} (chat_id={chat_id}, лимит чата)")
+        time.sleep(delay)
+    waited = _gate.acquire(lane)
+    if waited > 0.5:
+        logger.debug(f"Пауза {_fmt_duration(waited)} (chat_id={chat_id}, общий лимит, полоса {lane})")
+
+
+def _call_limited(chat_id: int, call, lane: str | None = None):
+    """
+    Выполняет запрос к Telegram с учётом лимитов (lane — полоса приоритета
+    в общем лимите, по умолчанию _default_lane).
+    На 429 ждёт retry_after и повторяет (до TG_MAX_RETRIES раз), после чего
+    пробрасывает исключение — например, чтобы outbox отложил сообщение.
+    SenderBusy — очередь полосы переполнена.
+    """
+    lane = lane or _default_lane(chat_id)
+    attempt = 0
+    while True:
+        _wait_turn(chat_id, lane)
+        try:
+            result = call()
+        except ApiTelegramException as e:
+            retry_after = retry_after_of(e)
+            if retry_after is None:
+                raise
+            _on_throttled(chat_id, retry_after)
+            if attempt >= TG_MAX_RETRIES:
+                raise
+            attempt += 1
+            _count("retried")
+            continue
+        _rates[_chat_class(chat_id)].succeeded()
+        _count("sent")
+        return result
+
+
+def get_sender_stats() -> dict:
+    """
+    Счётчики отправки с момента запуска:
+    sent, throttled (получено 429), retried (повторы после 429),
+    dropped (не доставлено через send_/edit_message_limited), global_pauses,
+    split (сообщения, отправленные частями),
+    текущая частота (сообщений/с в один чат) по классам чатов,
+    состояние лимитера (число чатов, вытеснено, память)
+    и полосы приоритета (ждут слота, получили слотов, максимальное ожидание).
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["rates"] = {name: round(rate.rate, 3) for name, rate in _rates.items()}
+    stats["limiter"] = _limiter.stats()
+    stats["lanes"] = _gate.stats()
+    return stats
 
 _bold_pat = re.compile(r'\*(.+?)\*')  # *bold* -> <b>…</b>
 _code_pat = re.compile(r'`(.+?)`')  # `code` -> <code>…</code>
@@ -45,6 +401,21 @@ _quote_pat = re.compile(r'\\\\\\(.+?)///', re.IGNORECASE | re.DOTALL)
 _pre_pat = re.compile(r'```(.+?)```', re.IGNORECASE | re.DOTALL)
 _mention_pat = re.compile(r'\[([^\]]+)\]\((tg://user\?id=\d+)\)', re.IGNORECASE)
 
+# Готовые ссылки на время разметки заменяются метками из символов частной
+# области Unicode: они не встречаются в тексте и не задевают ни одно правило
+_ANCHOR_REF = "\ue000{}\ue001"
+_anchor_ref_pat = re.compile("\ue000(\\d+)\ue001")
+
+# Правила разметки по порядку применения: (маркер, шаблон, замена).
+# Правило пропускается без сканирования текста, если маркера в тексте нет.
+_MARKUP_RULES = (
+    ("\\\\\\", _quote_pat, lambda m: f"<blockquote expandable>{m.group(1)}</blockquote>"),
+    ("```", _pre_pat, lambda m: f"<pre>{m.group(1)}</pre>"),
+    ("*", _bold_pat, lambda m: f"<b>{m.group(1)}</b>"),
+    ("`", _code_pat, lambda m: f"<code>{m.group(1)}</code>"),
+    ("~", _strike_pat, lambda m: f"<s>{m.group(1)}</s>"),
+)
+
 def _auto_html(text: str | None) -> str:
     """
        *жирный*  -> <b>жирный</b>
@@ -57,61 +428,246 @@ def _auto_html(text: str | None) -> str:
     """
     if not text:
         return ""
-    raw = str(text)
+    s = str(text)
     anchors = []
-    def _stash(m):
-        anchors.append(m.group(0))
-        return f"__ANCHOR_{len(anchors) - 1}__"
-    stashed = _a_tag_pat.sub(_stash, raw)
-
-    s = html.escape(stashed, quote=False)
-
-    s = _mention_pat.sub(lambda m: f'<a href="{m.group(2)}">{m.group(1)}</a>', s)
-
-    s = _quote_pat.sub(lambda m: f"<blockquote expandable>{m.group(1)}</blockquote>", s)
-    s = _pre_pat.sub(lambda m: f"<pre>{m.group(1)}</pre>", s)
-    s = _bold_pat.sub(lambda m: f"<b>{m.group(1)}</b>", s)
-    s = _code_pat.sub(lambda m: f"<code>{m.group(1)}</code>", s)
-    s = _strike_pat.sub(lambda m: f"<s>{m.group(1)}</s>", s)
-    for i, tag in enumerate(anchors):
-        s = s.replace(f"__ANCHOR_{i}__", tag)
-    s = _italic_pat.sub(lambda m: f"<i>{m.group(1)}</i>", s)
+    if "<" in s:
+        def _stash(m):
+            anchors.append(m.group(0))
+            return _ANCHOR_REF.format(len(anchors) - 1)
+        s = _a_tag_pat.sub(_stash, s)
+
+    s = html.escape(s, quote=False)
+
+    if "](" in s:
+        s = _mention_pat.sub(lambda m: f'<a href="{m.group(2)}">{m.group(1)}</a>', s)
+    for marker, pattern, repl in _MARKUP_RULES:
+        if marker in s:
+            s = pattern.sub(repl, s)
+    if anchors:
+        # Один проход по тексту вместо str.replace на каждую ссылку
+        s = _anchor_ref_pat.sub(lambda m: anchors[int(m.group(1))], s)
+    if "_" in s:
+        s = _italic_pat.sub(lambda m: f"<i>{m.group(1)}</i>", s)
     return s
 
-def send_message_limited(chat_id: int, text: str, **kwargs):
-    _global.wait()
-    _per_chat[chat_id].wait()
+_html_token_pat = re.compile(r'<[^>]*>|&#?\w+;|\n| +|[^<&\n ]+|&')
+_tag_pat = re.compile(r'<(/?)([a-zA-Z][\w-]*)')
+
+
+def _utf16_len(s: str) -> int:
+    """Длина так, как её считает Telegram (в кодовых единицах UTF-16)."""
+    return len(s.encode("utf-16-le")) // 2
+
+
+def _split_html(text: str, limit: int = TG_MESSAGE_LIMIT) -> list[str]:
+    """
+    Делит HTML-текст на части не длиннее limit видимых символов (без тегов,
+    HTML-сущность — один символ).
+
+    Место разреза выбирается так: перевод строки вне тегов (между блоками),
+    иначе перевод строки внутри тега (например, в длинной цитате), иначе пробел —
+    из тех, что не дают части короче половины лимита. Если такого нет, следующее
+    слово режется посреди, и часть заполняется до лимита; внутри тега или
+    сущности текст не режется никогда. Части без видимого текста пропускаются.
+    Теги, открытые на месте разреза, закрываются в конце части
+    и открываются заново в начале следующей.
+    """
+    if _utf16_len(text) <= limit:
+        return [text]
 
+    tokens = deque(_html_token_pat.findall(text))
+    chunks = []
+    while tokens:
+        chunk: list[str] = []
+        stack: list[tuple[str, str]] = []
+        size = 0
+        # Лучшее место разреза каждого приоритета: (индекс в chunk, открытые теги, длина части)
+        cuts: dict[int, tuple] = {}
+        while tokens:
+            tok = tokens[0]
+            if tok[0] == "<":
+                m = _tag_pat.match(tok)
+                if m and m.group(1):
+                    name = m.group(2).lower()
+                    for k in range(len(stack) - 1, -1, -1):
+                        if stack[k][0] == name:
+                            del stack[k]
+                            break
+                elif m:
+                    stack.append((m.group(2).lower(), tok))
+                chunk.append(tokens.popleft())
+                continue
+            width = 1 if tok[0] == "&" and len(tok) > 1 else _utf16_len(tok)
+            if size + width > limit:
+                break
+            chunk.append(tokens.popleft())
+            size += width
+            if tok == "\n":
+                cuts[0 if not stack else 1] = (len(chunk), tuple(stack), size)
+            elif tok[0] == " ":
+                cuts[2] = (len(chunk), tuple(stack), size)
+        else:
+            if any(tok[0] != "<" and tok.strip() for tok in chunk):
+                chunks.append("".join(chunk))
+            break
+
+        cut = next((cuts[p] for p in (0, 1, 2) if p in cuts and cuts[p][2] >= limit // 2), None)
+        if cut is None:
+            # Следующее «слово» длиннее половины лимита — режем его по символам,
+            # дополняя часть до лимита (сущность не режется)
+            word = tokens[0]
+            if word[0] != "&" or len(word) == 1:
+                head, taken = [], 0
+                for ch in word:
+                    if size + taken + _utf16_len(ch) > limit:
+                        break
+                    taken += _utf16_len(ch)
+                    head.append(ch)
+                if head:
+                    tokens[0] = word[len(head):]
+                    chunk.append("".join(head))
+                    size += taken
+            cut = (len(chunk), tuple(stack), size)
+
+        idx, open_tags, _ = cut
+        rest = chunk[idx:]
+        # Часть из одних тегов и пробелов Telegram отклоняет («message text is empty») — её не отправляем
+        if any(tok[0] != "<" and tok.strip() for tok in chunk[:idx]):
+            chunks.append("".join(chunk[:idx]) + "".join(f"</{name}>" for name, _ in reversed(open_tags)))
+        tokens.extendleft(reversed([tag for _, tag in open_tags] + rest))
+    return chunks
+
+
+_unit_locks: dict = {}
+_unit_guard = threading.Lock()
+
+
+@contextmanager
+def _chat_unit(chat_id: int):
+    """
+    Отправка в чат как одно целое: части длинного сообщения не перемежаются
+    с другими сообщениями в этот же чат. Блокировка живёт, пока ею пользуются.
+    """
+    with _unit_guard:
+        entry = _unit_locks.setdefault(chat_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _unit_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                _unit_locks.pop(chat_id, None)
+
+
+def _send_chunks(chat_id: int, chunks: list[str], kwargs: dict, lane: str | None = None):
+    """
+    Отправляет части по очереди через лимитер; клавиатура — у последней части,
+    ответ на сообщение (reply_to_message_id) — у первой. Возвращает первое сообщение.
+    """
+    markup = kwargs.pop("reply_markup", None)
+    first = None
+    for i, chunk in enumerate(chunks):
+        options = dict(kwargs)
+        if i == len(chunks) - 1 and markup is not None:
+            options["reply_markup"] = markup
+        if i > 0:
+            options.pop("reply_to_message_id", None)
+            options.pop("reply_parameters", None)
+        message = _call_limited(chat_id, lambda: bot.send_message(chat_id, chunk, **options), lane)
+        if first is None:
+            first = message
+    return first
+
+
+def deliver_message(chat_id: int, text: str, split: bool = True, lane: str | None = None, **kwargs):
+    """
+    Отправляет сообщение с учётом лимитов (lane — полоса приоритета, см. PriorityGate).
+    В отличие от send_message_limited, ошибки сети и Telegram API пробрасываются.
+    Текст длиннее TG_MESSAGE_LIMIT уходит несколькими сообщениями подряд (split=False —
+    одним, как есть); если оборвалась не первая часть, при повторе outbox
+    отправит сообщение целиком.
+    """
     safe_text = _auto_html(text)
     kwargs.pop("parse_mode", None)
     kwargs["parse_mode"] = "HTML"
+    chunks = _split_html(safe_text) if split else [safe_text]
+    if len(chunks) > 1:
+        _count("split")
+        logger.info(f"Сообщение в chat_id={chat_id} длиннее лимита — отправляю частями: {len(chunks)}")
+    with _chat_unit(chat_id):
+        return _send_chunks(chat_id, chunks, kwargs, lane)
+
+
+def send_message_limited(chat_id: int, text: str, **kwargs):
     try:
-        return bot.send_message(chat_id, safe_text, **kwargs)
+        return deliver_message(chat_id, text, **kwargs)
     except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        _count("dropped")
         logger.warning(f"Не смог отправить сообщение в chat_id={chat_id}: сеть недоступна "
                        f"({'таймаут' if isinstance(e, requests.exceptions.Timeout) else 'нет соединения'}).")
         return None
     except ApiException as e:
+        _count("dropped")
         logger.warning(f"Ошибка Telegram API при отправке в chat_id={chat_id}: {e}")
         return None
+    except SenderBusy as e:
+        _count("dropped")
+        logger.warning(f"Не отправил сообщение в chat_id={chat_id}: {e}")
+        return None
 
 
-def edit_message_limited(chat_id: int, message_id: int, text: str, **kwargs):
-    _global.wait()
-    _per_chat[chat_id].wait()
-
+def deliver_edit(chat_id: int, message_id: int, text: str, split: bool = True, lane: str | None = None,
+                 **kwargs):
+    """
+    Редактирует сообщение с учётом лимитов; ошибки сети и Telegram API пробрасываются.
+    Если новый текст длиннее TG_MESSAGE_LIMIT, в сообщение попадает первая часть,
+    остальные отправляются следом новыми сообщениями (в топик message_thread_id,
+    если передан); клавиатура — у последней.
+    """
     safe_text = _auto_html(text)
     kwargs.pop("parse_mode", None)
     kwargs["parse_mode"] = "HTML"
+    thread_id = kwargs.pop("message_thread_id", None)
+    chunks = _split_html(safe_text) if split else [safe_text]
+    head_kwargs = dict(kwargs)
+    if len(chunks) > 1:
+        _count("split")
+        head_kwargs.pop("reply_markup", None)
+        logger.info(f"Сообщение {message_id} в chat_id={chat_id} длиннее лимита — "
+                    f"продолжение уйдёт частями: {len(chunks) - 1}")
+    with _chat_unit(chat_id):
+        result = _call_limited(
+            chat_id,
+            lambda: bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=chunks[0],
+                                          **head_kwargs),
+            lane,
+        )
+        if len(chunks) > 1:
+            if thread_id is not None:
+                kwargs["message_thread_id"] = thread_id
+            _send_chunks(chat_id, chunks[1:], kwargs, lane)
+        return result
+
+
+def edit_message_limited(chat_id: int, message_id: int, text: str, split: bool = True, **kwargs):
+    """То же, что deliver_edit, но ошибки только логируются (возвращает None)."""
     try:
-        return bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=safe_text, **kwargs)
+        return deliver_edit(chat_id, message_id, text, split=split, **kwargs)
     except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        _count("dropped")
         logger.warning(f"Не смог отправить сообщение в chat_id={chat_id}: сеть недоступна "
                        f"({'таймаут' if isinstance(e, requests.exceptions.Timeout) else 'нет соединения'}).")
         return None
     except ApiException as e:
+        _count("dropped")
         logger.warning(f"Ошибка Telegram API при отправке в chat_id={chat_id}: {e}")
         return None
+    except SenderBusy as e:
+        _count("dropped")
+        logger.warning(f"Не отправил сообщение в chat_id={chat_id}: {e}")
+        return None
 #
 # def send_bulk_text(chat_id: int, lines: list[str], header: str | None = None,
 #                    footer: str | None = None, **kwargs):
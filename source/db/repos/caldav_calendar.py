@@ -3,6 +3,7 @@ from typing import Optional, Set
 from sqlalchemy import select, delete
 
 from source.db.db import get_session
+from source.db.repos.outbox import add_outbox_messages
 from source.migrations.models import CalDavSendData
 
 
@@ -36,9 +37,15 @@ def get_id_by_name(name: str) -> Optional[int]:
         return event.id if event else None
 
 
-def save_event_sends(name: str, tg_id: int, cooldown: int, event_name: str, url: str) -> None:
-    """Сохраняет новое событие (игнорирует дубликаты)."""
+def save_event_sends(name: str, tg_id: int, cooldown: int, event_name: str, url: str,
+                     message: Optional[dict] = None) -> None:
+    """
+    Сохраняет новое событие (игнорирует дубликаты).
+    message — уведомление (outbox_message()), которое ставится в outbox в той же транзакции.
+    """
     with get_session() as session:
+        if message is not None:
+            add_outbox_messages(session, [message])
         # Проверяем существование
         stmt = select(CalDavSendData).where(CalDavSendData.event_name == event_name, CalDavSendData.tg_id == tg_id, CalDavSendData.cooldown == cooldown)
         existing = session.execute(stmt).scalar_one_or_none()
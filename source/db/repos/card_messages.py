@@ -0,0 +1,30 @@
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects.mysql import insert
+
+from source.db.db import get_session
+from source.migrations.models import CardMessage
+
+
+def get_card_message(chat_id: int, card_id: int) -> Optional[Tuple[int, datetime]]:
+    """Возвращает (message_id, sent_at) последнего сообщения о карточке в чате или None."""
+    with get_session() as session:
+        row = session.execute(
+            select(CardMessage.message_id, CardMessage.sent_at)
+            .where(CardMessage.chat_id == chat_id, CardMessage.card_id == card_id)
+        ).first()
+        return (row.message_id, row.sent_at) if row else None
+
+
+def save_card_message(chat_id: int, card_id: int, message_id: int, sent_at: Optional[datetime] = None) -> None:
+    """Запоминает новое сообщение о карточке в чате (sent_at — UTC)."""
+    sent_at = sent_at or datetime.utcnow()
+    with get_session() as session:
+        stmt = insert(CardMessage).values(
+            chat_id=int(chat_id), card_id=int(card_id), message_id=int(message_id), sent_at=sent_at,
+        )
+        session.execute(stmt.on_duplicate_key_update(
+            message_id=stmt.inserted.message_id, sent_at=stmt.inserted.sent_at,
+        ))
@@ -1,67 +1,98 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Dict, Tuple, Optional
+from typing import Dict, Tuple, Optional, Iterable, List, NamedTuple
 
-from sqlalchemy import select, delete, func
+from sqlalchemy import select, delete, func, or_
+from sqlalchemy.dialects.mysql import insert
 
 from source.db.db import get_session
-from source.migrations.models import DeadlineReminder
+from source.db.repos.outbox import add_outbox_messages
+from source.migrations.models import DeadlineReminder, Task, TaskAssignee
 
 
-def get_last_sent_map() -> Dict[Tuple[int, str], Tuple[str, datetime]]:
+_BATCH_SIZE = 500
+
+
+class DeadlineCandidate(NamedTuple):
+    """Пара (карточка, исполнитель) с дедлайном и последним отправленным напоминанием."""
+    card_id: int
+    login: str
+    title: str
+    board_id: int
+    duedate: datetime
+    last_stage: Optional[str]
+    last_sent_at: Optional[datetime]
+
+
+def get_deadline_candidates(horizon: datetime, card_ids: Optional[Iterable[int]] = None) -> List[DeadlineCandidate]:
     """
-    Возвращает словарь { (card_id, login): (stage, sent_at) }
-    для последнего напоминания каждой пары (card_id, login).
+    Пары (карточка, исполнитель), которым может понадобиться напоминание:
+    карточка не выполнена и не в архиве, дедлайн не позже horizon (naive UTC;
+    просроченные — тоже, для повторов). Последнее напоминание пары
+    присоединяется тем же запросом (на пару хранится одна запись, см. mark_sent_batch).
+    card_ids — только эти карточки.
     """
     with get_session() as session:
-        # Подзапрос: максимальный sent_at для каждой пары (card_id, login)
-        subq = (
+        stmt = (
             select(
-                DeadlineReminder.card_id,
-                DeadlineReminder.login,
-                func.max(DeadlineReminder.sent_at).label("last_ts")
+                Task.card_id, TaskAssignee.nc_login, Task.title, Task.board_id, Task.duedate,
+                DeadlineReminder.stage, DeadlineReminder.sent_at,
             )
-            .group_by(DeadlineReminder.card_id, DeadlineReminder.login)
-            .subquery()
-        )
-
-        # Основной запрос: джойним с подзапросом
-        stmt = (
-            select(DeadlineReminder)
-            .join(
-                subq,
-                (DeadlineReminder.card_id == subq.c.card_id) &
-                (DeadlineReminder.login == subq.c.login) &
-                (DeadlineReminder.sent_at == subq.c.last_ts)
+            .join(TaskAssignee, TaskAssignee.card_id == Task.card_id)
+            .outerjoin(
+                DeadlineReminder,
+                (DeadlineReminder.card_id == Task.card_id) & (DeadlineReminder.login == TaskAssignee.nc_login),
+            )
+            .where(
+                Task.done.is_(None),
+                Task.duedate.is_not(None),
+                Task.duedate <= horizon,
+                or_(Task.prev_stack_id.is_not(None), Task.next_stack_id.is_not(None)),
             )
         )
+        if card_ids is not None:
+            stmt = stmt.where(Task.card_id.in_(list(card_ids)))
+        return [DeadlineCandidate(*row) for row in session.execute(stmt)]
 
-        result = session.execute(stmt).scalars().all()
-
-        return {
-            (int(r.card_id), str(r.login)): (str(r.stage), r.sent_at)
-            for r in result
-        }
 
+def mark_sent_batch(digests: Iterable[Tuple[str, Iterable[Tuple[int, str]], dict]]) -> int:
+    """
+    Отмечает отправку дайджестов напоминаний [(login, [(card_id, stage), ...], message), ...]
+    и ставит их сообщения в outbox одной транзакцией: записи пар (card_id, login)
+    пишутся многострочным INSERT ... ON DUPLICATE KEY UPDATE (по _BATCH_SIZE строк) —
+    прежняя запись пары заменяется новым этапом и временем. Возвращает число отмеченных пар.
+    """
+    stages: Dict[Tuple[int, str], str] = {}
+    messages = []
+    for login, entries, message in digests:
+        for card_id, stage in entries:
+            stages[(int(card_id), str(login))] = stage
+        messages.append(message)
 
-def mark_sent(card_id: int, login: str, stage: str) -> None:
-    """Отмечает отправку напоминания (удаляет старые записи для пользователя)."""
+    pairs = sorted(stages)
     with get_session() as session:
-        # Удаляем предыдущие записи для этой пары
-        stmt = delete(DeadlineReminder).where(
-            DeadlineReminder.card_id == card_id,
-            DeadlineReminder.login == login
-        )
-        session.execute(stmt)
-
-        # Добавляем новую запись
-        reminder = DeadlineReminder(card_id=card_id, login=login, stage=stage)
-        session.add(reminder)
+        for i in range(0, len(pairs), _BATCH_SIZE):
+            stmt = insert(DeadlineReminder).values([
+                {"card_id": card_id, "login": login, "stage": stages[(card_id, login)]}
+                for card_id, login in pairs[i:i + _BATCH_SIZE]
+            ])
+            session.execute(stmt.on_duplicate_key_update(
+                stage=stmt.inserted.stage, sent_at=func.current_timestamp(),
+            ))
+        add_outbox_messages(session, messages)
+    return len(pairs)
 
 
-def reset_sent_for_card(card_id: int) -> None:
-    """Сбрасывает все напоминания для карточки."""
+def reset_sent_for_cards(card_ids: Iterable[int]) -> int:
+    """Сбрасывает все напоминания для карточек одним запросом. Возвращает число удалённых записей."""
+    ids = sorted({int(card_id) for card_id in card_ids})
+    if not ids:
+        return 0
     with get_session() as session:
-        stmt = delete(DeadlineReminder).where(DeadlineReminder.card_id == card_id)
-        session.execute(stmt)
+        removed = 0
+        for i in range(0, len(ids), _BATCH_SIZE):
+            removed += session.execute(
+                delete(DeadlineReminder).where(DeadlineReminder.card_id.in_(ids[i:i + _BATCH_SIZE]))
+            ).rowcount or 0
+        return removed
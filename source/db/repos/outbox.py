@@ -0,0 +1,232 @@
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import select, update, delete, or_, func, exists
+from sqlalchemy.orm import aliased
+
+from source.db.db import get_session
+from source.migrations.models import OutboxMessage
+
+
+def outbox_message(chat_id: int, text: str, **kwargs) -> Dict[str, Any]:
+    """
+    Готовит строку outbox для send_message_limited(chat_id, text, **kwargs).
+    reply_markup сохраняется в JSON (InlineKeyboardMarkup.to_json()).
+    card_id — сообщение об изменениях карточки: воркер отредактирует прошлое
+    сообщение о ней в этом чате вместо отправки нового (см. outbox._deliver_card_message).
+    """
+    options = {k: v for k, v in kwargs.items() if v is not None}
+    markup = options.get("reply_markup")
+    if markup is not None and not isinstance(markup, str):
+        options["reply_markup"] = markup.to_json()
+    return {
+        "chat_id": int(chat_id),
+        "text": str(text),
+        "options": json.dumps(options, ensure_ascii=False) if options else None,
+    }
+
+
+def add_outbox_messages(session, messages: Iterable[Dict[str, Any]]) -> int:
+    """Добавляет сообщения в outbox в рамках переданной сессии. Возвращает их число."""
+    count = 0
+    for message in messages:
+        session.add(OutboxMessage(status="pending", attempts=0, **message))
+        count += 1
+    return count
+
+
+def _claimed(row) -> Dict[str, Any]:
+    return {
+        "id": row.id,
+        "chat_id": row.chat_id,
+        "text": row.text,
+        "options": json.loads(row.options) if row.options else {},
+        "attempts": (row.attempts or 0) + 1,
+    }
+
+
+def _mark_sending(session, claimed: List[Dict[str, Any]]) -> None:
+    if claimed:
+        session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_([m["id"] for m in claimed]))
+            .values(status="sending", attempts=OutboxMessage.attempts + 1)
+        )
+
+
+def _ready():
+    now = datetime.utcnow()
+    return (
+        OutboxMessage.status == "pending",
+        or_(OutboxMessage.next_attempt_at.is_(None), OutboxMessage.next_attempt_at <= now),
+    )
+
+
+def claim_outbox_batch(limit: int, exclude_chat_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Забирает до limit готовых к отправке сообщений (в порядке постановки)
+    и помечает их как sending. exclude_chat_id — кроме этого чата.
+    Чаты, где более раннее сообщение ждёт повтора, пропускаются,
+    чтобы следующие сообщения не обогнали его.
+    """
+    if limit <= 0:
+        return []
+    with get_session() as session:
+        older = aliased(OutboxMessage)
+        waiting = exists().where(
+            older.chat_id == OutboxMessage.chat_id,
+            older.id < OutboxMessage.id,
+            older.status == "pending",
+            older.next_attempt_at > datetime.utcnow(),
+        )
+        stmt = select(OutboxMessage).where(*_ready(), ~waiting).order_by(OutboxMessage.id).limit(limit)
+        if exclude_chat_id is not None:
+            stmt = stmt.where(OutboxMessage.chat_id != exclude_chat_id)
+        claimed = [_claimed(r) for r in session.execute(stmt).scalars()]
+        _mark_sending(session, claimed)
+        return claimed
+
+
+def claim_outbox_by_thread(chat_id: int, limit: int, thread_load: Dict[Any, int],
+                           scan: int = 1000) -> List[Dict[str, Any]]:
+    """
+    Забирает до limit готовых сообщений в чат по кругу между топиками (message_thread_id):
+    каждый раз — старейшее сообщение топика, у которого меньше всего сообщений в работе
+    (thread_load: { message_thread_id: сколько уже в работе }), при равенстве — топика
+    с самым старым сообщением. Внутри топика порядок постановки сохраняется:
+    сообщения после отложенного до повтора не берутся, пока оно не уйдёт.
+    Просматриваются первые scan ожидающих сообщений чата.
+    """
+    if limit <= 0:
+        return []
+    with get_session() as session:
+        now = datetime.utcnow()
+        rows = session.execute(
+            select(OutboxMessage.id, OutboxMessage.options, OutboxMessage.next_attempt_at)
+            .where(OutboxMessage.status == "pending", OutboxMessage.chat_id == chat_id)
+            .order_by(OutboxMessage.id)
+            .limit(scan)
+        )
+        threads: Dict[Any, List[int]] = {}
+        blocked = set()
+        for r in rows:
+            thread_id = json.loads(r.options).get("message_thread_id") if r.options else None
+            if thread_id in blocked:
+                continue
+            if r.next_attempt_at is not None and r.next_attempt_at > now:
+                blocked.add(thread_id)
+                continue
+            threads.setdefault(thread_id, []).append(r.id)
+
+        load = dict(thread_load)
+        heads = {thread_id: 0 for thread_id in threads}
+        ids = []
+        while len(ids) < limit and heads:
+            thread_id = min(heads, key=lambda t: (load.get(t, 0), threads[t][heads[t]]))
+            ids.append(threads[thread_id][heads[thread_id]])
+            load[thread_id] = load.get(thread_id, 0) + 1
+            heads[thread_id] += 1
+            if heads[thread_id] == len(threads[thread_id]):
+                del heads[thread_id]
+        if not ids:
+            return []
+
+        claimed = [
+            _claimed(r) for r in session.execute(
+                select(OutboxMessage).where(OutboxMessage.id.in_(ids)).order_by(OutboxMessage.id)
+            ).scalars()
+        ]
+        _mark_sending(session, claimed)
+        return claimed
+
+
+def count_pending(chat_id: int) -> int:
+    """Сколько сообщений в чат ждут отправки."""
+    with get_session() as session:
+        return session.scalar(
+            select(func.count())
+            .select_from(OutboxMessage)
+            .where(OutboxMessage.status == "pending", OutboxMessage.chat_id == chat_id)
+        ) or 0
+
+
+def get_pending(chat_id: int) -> List[Dict[str, Any]]:
+    """Ожидающие отправки сообщения в чат в порядке постановки: id, text, options."""
+    with get_session() as session:
+        rows = session.execute(
+            select(OutboxMessage.id, OutboxMessage.text, OutboxMessage.options)
+            .where(OutboxMessage.status == "pending", OutboxMessage.chat_id == chat_id)
+            .order_by(OutboxMessage.id)
+        )
+        return [
+            {"id": r.id, "text": r.text, "options": json.loads(r.options) if r.options else {}}
+            for r in rows
+        ]
+
+
+def replace_pending(message_ids: Iterable[int], messages: Iterable[Dict[str, Any]]) -> int:
+    """
+    Одной транзакцией удаляет ещё не взятые в работу сообщения message_ids
+    и ставит вместо них messages. Возвращает число удалённых.
+    """
+    ids = list(message_ids)
+    with get_session() as session:
+        removed = 0
+        if ids:
+            removed = session.execute(
+                delete(OutboxMessage)
+                .where(OutboxMessage.id.in_(ids), OutboxMessage.status == "pending")
+            ).rowcount or 0
+        add_outbox_messages(session, messages)
+        return removed
+
+
+def mark_outbox_delivered(message_id: int) -> None:
+    """Удаляет доставленное сообщение из outbox."""
+    with get_session() as session:
+        session.execute(delete(OutboxMessage).where(OutboxMessage.id == message_id))
+
+
+def mark_outbox_failed(message_id: int, error: str, retry_at: Optional[datetime] = None) -> None:
+    """
+    Отмечает неудачную попытку отправки.
+    retry_at — когда повторить; None — больше не пытаться (status=failed).
+    """
+    with get_session() as session:
+        session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id == message_id)
+            .values(
+                status="pending" if retry_at is not None else "failed",
+                next_attempt_at=retry_at,
+                last_error=(error or "")[:2000],
+            )
+        )
+
+
+def defer_outbox(message_id: int, retry_at: datetime) -> None:
+    """
+    Возвращает взятое сообщение в очередь до retry_at, не засчитывая попытку:
+    оно ждёт повтора более раннего сообщения в тот же чат (топик).
+    """
+    with get_session() as session:
+        session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id == message_id)
+            .values(status="pending", next_attempt_at=retry_at, attempts=OutboxMessage.attempts - 1)
+        )
+
+
+def reset_inflight_outbox() -> int:
+    """
+    Возвращает в очередь сообщения, которые были взяты воркерами,
+    но не доставлены до остановки бота. Вызывается при старте.
+    """
+    with get_session() as session:
+        result = session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.status == "sending")
+            .values(status="pending")
+        )
+        return result.rowcount or 0
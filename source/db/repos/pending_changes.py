@@ -0,0 +1,36 @@
+from datetime import datetime
+from typing import Iterable, List, Tuple
+
+from sqlalchemy import select, delete
+
+from source.cards import Card
+from source.db.db import get_session
+from source.migrations.models import PendingCardChange
+
+
+def get_pending_changes() -> List[Tuple[Card, datetime, datetime, int]]:
+    """
+    Изменения карточек, ждавшие окна объединения до перезапуска:
+    [(состояние до первого изменения, first_at UTC, last_at UTC, polls), ...].
+    """
+    with get_session() as session:
+        return [
+            (
+                Card(
+                    card_id=row.card_id, title=row.title, description=row.description,
+                    board_id=row.board_id, board_title="", stack_id=row.stack_id,
+                    stack_title=row.stack_title, duedate=row.duedate,
+                ),
+                row.first_at, row.last_at, row.polls,
+            )
+            for row in session.execute(select(PendingCardChange)).scalars()
+        ]
+
+
+def delete_pending_changes(card_ids: Iterable[int]) -> None:
+    """Удаляет сохранённые изменения карточек (уведомление больше не нужно)."""
+    ids = sorted(card_ids)
+    if not ids:
+        return
+    with get_session() as session:
+        session.execute(delete(PendingCardChange).where(PendingCardChange.card_id.in_(ids)))
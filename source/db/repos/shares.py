@@ -0,0 +1,27 @@
+from typing import Dict, Iterable
+
+from sqlalchemy import select
+from sqlalchemy.dialects.mysql import insert
+
+from source.db.db import get_session
+from source.migrations.models import AttachmentShare
+
+
+def get_share_urls(file_ids: Iterable[int]) -> Dict[int, str]:
+    """Возвращает { file_id: url } для вложений, у которых уже есть публичная ссылка."""
+    ids = [int(i) for i in file_ids if i is not None]
+    if not ids:
+        return {}
+    with get_session() as session:
+        stmt = select(AttachmentShare.file_id, AttachmentShare.url).where(AttachmentShare.file_id.in_(ids))
+        return {row.file_id: row.url for row in session.execute(stmt)}
+
+
+def save_share_urls(urls: Dict[int, str]) -> None:
+    """Сохраняет публичные ссылки на вложения { file_id: url } одним запросом."""
+    rows = [{"file_id": int(file_id), "url": url} for file_id, url in urls.items() if file_id is not None and url]
+    if not rows:
+        return
+    with get_session() as session:
+        stmt = insert(AttachmentShare).values(rows)
+        session.execute(stmt.on_duplicate_key_update(url=stmt.inserted.url))
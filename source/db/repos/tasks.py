@@ -1,13 +1,15 @@
-from datetime import datetime
-from typing import Optional, Dict, Set, List, Tuple, Any
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
-from sqlalchemy import select, delete
-from sqlalchemy.orm import joinedload
+from sqlalchemy import select, delete, tuple_
+from sqlalchemy.dialects.mysql import insert
 
+from source.cards import Card
 from source.db.db import get_session
+from source.db.repos.outbox import add_outbox_messages
 from source.migrations.models import (
     Task, TaskAssignee, TaskStat, TaskLabel,
-    TaskAttachment, TaskComment, DeadlineReminder
+    TaskAttachment, TaskComment, DeadlineReminder, PendingCardChange
 )
 
 
@@ -20,161 +22,26 @@ def get_tasks_from_db(tg_id: int) -> Set[int]:
         return set(result)
 
 
-def save_task_to_db(
-    card_id: int, title: str, description: str,
-    board_id: int, board_title: str,
-    stack_id: int, stack_title: str,
-    prev_stack_id: Optional[int], prev_stack_title: Optional[str],
-    next_stack_id: Optional[int], next_stack_title: Optional[str],
-    duedate: Optional[datetime], done: Optional[datetime], etag: Optional[str]
-) -> None:
-    """Сохраняет или обновляет задачу."""
-    with get_session() as session:
-        task = session.get(Task, card_id)
-        if task:
-            task.title = title
-            task.description = description
-            task.board_id = board_id
-            task.board_title = board_title
-            task.stack_id = stack_id
-            task.stack_title = stack_title
-            task.prev_stack_id = prev_stack_id
-            task.prev_stack_title = prev_stack_title
-            task.next_stack_id = next_stack_id
-            task.next_stack_title = next_stack_title
-            task.duedate = duedate
-            task.done = done
-            task.etag = etag
-        else:
-            task = Task(
-                card_id=card_id, title=title, description=description,
-                board_id=board_id, board_title=board_title,
-                stack_id=stack_id, stack_title=stack_title,
-                prev_stack_id=prev_stack_id, prev_stack_title=prev_stack_title,
-                next_stack_id=next_stack_id, next_stack_title=next_stack_title,
-                duedate=duedate, done=done, etag=etag
-            )
-            session.add(task)
-
-
-def update_task_in_db(
-    card_id: int, title: str, description: str,
-    board_id: int, board_title: str,
-    stack_id: int, stack_title: str,
-    prev_stack_id: Optional[int], prev_stack_title: Optional[str],
-    next_stack_id: Optional[int], next_stack_title: Optional[str],
-    duedate: Optional[datetime], done: Optional[datetime], etag: Optional[str]
-) -> None:
-    """Обновляет задачу."""
-    with get_session() as session:
-        task = session.get(Task, card_id)
-        if task:
-            task.title = title
-            task.description = description
-            task.board_id = board_id
-            task.board_title = board_title
-            task.stack_id = stack_id
-            task.stack_title = stack_title
-            task.prev_stack_id = prev_stack_id
-            task.prev_stack_title = prev_stack_title
-            task.next_stack_id = next_stack_id
-            task.next_stack_title = next_stack_title
-            task.duedate = duedate
-            task.done = done
-            task.etag = etag
-
-
-def save_task_assignee(card_id: int, nc_login: str) -> None:
-    """Добавляет назначенного пользователя к задаче."""
-    with get_session() as session:
-        stmt = select(TaskAssignee).where(
-            TaskAssignee.card_id == card_id,
-            TaskAssignee.nc_login == nc_login
-        )
-        existing = session.execute(stmt).scalar_one_or_none()
-        if not existing:
-            assignee = TaskAssignee(card_id=card_id, nc_login=nc_login)
-            session.add(assignee)
-
-
-def delete_task_assignee(card_id: int, nc_login: str) -> None:
-    """Удаляет назначенного пользователя."""
-    with get_session() as session:
-        stmt = delete(TaskAssignee).where(
-            TaskAssignee.card_id == card_id,
-            TaskAssignee.nc_login == nc_login
-        )
-        session.execute(stmt)
+def _by_card_ids(session, stmt, column, card_ids: Optional[List[int]]):
+    """Строки stmt — все или только для card_ids (IN-запросами по _BATCH_SIZE)."""
+    if card_ids is None:
+        yield from session.execute(stmt)
+        return
+    for chunk in _chunks(card_ids):
+        yield from session.execute(stmt.where(column.in_(chunk)))
 
 
-def get_task_assignees(card_id: int) -> Set[str]:
-    """Возвращает set логинов назначенных пользователей."""
+def get_saved_tasks(card_ids: Optional[Iterable[int]] = None) -> Dict[int, Card]:
+    """Возвращает словарь { card_id: Card } для всех задач или только для card_ids."""
+    ids = sorted(set(card_ids)) if card_ids is not None else None
     with get_session() as session:
-        stmt = select(TaskAssignee.nc_login).where(TaskAssignee.card_id == card_id)
-        result = session.execute(stmt).scalars().all()
-        return set(result)
-
-
-def get_saved_tasks() -> Dict[int, Dict[str, Any]]:
-    """Возвращает словарь { card_id: task_dict } для всех задач."""
-    with get_session() as session:
-        stmt = select(Task)
-        tasks = session.execute(stmt).scalars().all()
         return {
-            t.card_id: {
-                'card_id': t.card_id,
-                'title': t.title,
-                'description': t.description,
-                'board_id': t.board_id,
-                'board_title': t.board_title,
-                'stack_id': t.stack_id,
-                'stack_title': t.stack_title,
-                'prev_stack_id': t.prev_stack_id,
-                'prev_stack_title': t.prev_stack_title,
-                'next_stack_id': t.next_stack_id,
-                'next_stack_title': t.next_stack_title,
-                'duedate': t.duedate,
-                'done': t.done,
-                'etag': t.etag,
-            }
-            for t in tasks
+            row.Task.card_id: Card.from_task(row.Task)
+            for row in _by_card_ids(session, select(Task), Task.card_id, ids)
         }
 
 
-def get_saved_tasks_for_deadlines() -> List[Dict[str, Any]]:
-    """Возвращает задачи с назначенными пользователями для проверки дедлайнов."""
-    with get_session() as session:
-        stmt = (
-            select(Task)
-            .join(TaskAssignee)
-            .options(joinedload(Task.assignees))
-        )
-        tasks = session.execute(stmt).unique().scalars().all()
-
-        result = []
-        for t in tasks:
-            task_dict = {
-                'card_id': t.card_id,
-                'title': t.title,
-                'description': t.description,
-                'board_id': t.board_id,
-                'board_title': t.board_title,
-                'stack_id': t.stack_id,
-                'stack_title': t.stack_title,
-                'prev_stack_id': t.prev_stack_id,
-                'prev_stack_title': t.prev_stack_title,
-                'next_stack_id': t.next_stack_id,
-                'next_stack_title': t.next_stack_title,
-                'duedate': t.duedate,
-                'done': t.done,
-                'etag': t.etag,
-                'assigned_logins': [a.nc_login for a in t.assignees],
-            }
-            result.append(task_dict)
-        return result
-
-
-def get_tasks_from_users(login: str) -> List[Dict[str, Any]]:
+def get_tasks_from_users(login: str) -> List[Card]:
     """Возвращает задачи конкретного пользователя."""
     with get_session() as session:
         stmt = (
@@ -183,40 +50,7 @@ def get_tasks_from_users(login: str) -> List[Dict[str, Any]]:
             .where(TaskAssignee.nc_login == login)
         )
         tasks = session.execute(stmt).scalars().all()
-
-        return [
-            {
-                'card_id': t.card_id,
-                'title': t.title,
-                'description': t.description,
-                'board_id': t.board_id,
-                'board_title': t.board_title,
-                'stack_id': t.stack_id,
-                'stack_title': t.stack_title,
-                'prev_stack_id': t.prev_stack_id,
-                'prev_stack_title': t.prev_stack_title,
-                'next_stack_id': t.next_stack_id,
-                'next_stack_title': t.next_stack_title,
-                'duedate': t.duedate,
-                'done': t.done,
-                'etag': t.etag,
-            }
-            for t in tasks
-        ]
-
-
-def get_task_stats_map() -> Dict[int, Dict[str, int]]:
-    """Возвращает словарь { card_id: {comments_count, attachments_count} }."""
-    with get_session() as session:
-        stmt = select(TaskStat)
-        stats = session.execute(stmt).scalars().all()
-        return {
-            s.card_id: {
-                "comments_count": s.comments_count,
-                "attachments_count": s.attachments_count
-            }
-            for s in stats
-        }
+        return [Card.from_task(t) for t in tasks]
 
 
 def get_task_stat(card_id: int) -> List[int]:
@@ -244,123 +78,200 @@ def upsert_task_stats(card_id: int, comments_count: int, attachments_count: int)
             session.add(stat)
 
 
-def save_task_label(card_id: int, label: str) -> None:
-    """Добавляет метку к задаче."""
+def save_task_comment(card_id: int, comment_id: int) -> None:
+    """Добавляет комментарий к задаче."""
     with get_session() as session:
-        stmt = select(TaskLabel).where(
-            TaskLabel.card_id == card_id,
-            TaskLabel.label == label
+        stmt = select(TaskComment).where(
+            TaskComment.card_id == card_id,
+            TaskComment.comment_id == comment_id
         )
         existing = session.execute(stmt).scalar_one_or_none()
         if not existing:
-            task_label = TaskLabel(card_id=card_id, label=label)
-            session.add(task_label)
+            comment = TaskComment(card_id=card_id, comment_id=comment_id)
+            session.add(comment)
 
 
-def delete_task_label(card_id: int, label: str) -> None:
-    """Удаляет метку задачи."""
+def get_previous_state_snapshot(card_ids: Optional[Iterable[int]] = None) -> Dict[int, Dict[str, Any]]:
+    """
+    Возвращает снимок сохранённого состояния всех карточек (или только card_ids —
+    например, карточек одной доски):
+    { card_id: {etag, comments_count, attachments_count,
+                attachments, comments, labels, assignees} }
+
+    Каждая таблица (tasks, task_stats, вложения, комментарии, метки, исполнители)
+    читается одним запросом на пачку card_ids, а не запросом на каждую карточку.
+    Для карточки без строки в task_stats счётчики равны None.
+    """
+    ids = sorted(set(card_ids)) if card_ids is not None else None
     with get_session() as session:
-        stmt = delete(TaskLabel).where(
-            TaskLabel.card_id == card_id,
-            TaskLabel.label == label
-        )
-        session.execute(stmt)
+        snapshot = {
+            row.card_id: {
+                'etag': row.etag,
+                'comments_count': None,
+                'attachments_count': None,
+                'attachments': set(),
+                'comments': set(),
+                'labels': set(),
+                'assignees': set(),
+            }
+            for row in _by_card_ids(session, select(Task.card_id, Task.etag), Task.card_id, ids)
+        }
 
+        stmt = select(TaskStat.card_id, TaskStat.comments_count, TaskStat.attachments_count)
+        for row in _by_card_ids(session, stmt, TaskStat.card_id, ids):
+            state = snapshot.get(row.card_id)
+            if state is not None:
+                state['comments_count'] = row.comments_count
+                state['attachments_count'] = row.attachments_count
 
-def get_task_labels(card_id: int) -> Set[str]:
-    """Возвращает set меток задачи."""
-    with get_session() as session:
-        stmt = select(TaskLabel.label).where(TaskLabel.card_id == card_id)
-        result = session.execute(stmt).scalars().all()
-        return set(result)
+        stmt = select(TaskAttachment.card_id, TaskAttachment.file_id)
+        for row in _by_card_ids(session, stmt, TaskAttachment.card_id, ids):
+            snapshot.setdefault(row.card_id, _empty_state())['attachments'].add(row.file_id)
 
+        stmt = select(TaskComment.card_id, TaskComment.comment_id)
+        for row in _by_card_ids(session, stmt, TaskComment.card_id, ids):
+            snapshot.setdefault(row.card_id, _empty_state())['comments'].add(row.comment_id)
 
-def save_task_attachment(card_id: int, file_id: int) -> None:
-    """Добавляет вложение к задаче."""
-    with get_session() as session:
-        stmt = select(TaskAttachment).where(
-            TaskAttachment.card_id == card_id,
-            TaskAttachment.file_id == file_id
-        )
-        existing = session.execute(stmt).scalar_one_or_none()
-        if not existing:
-            attachment = TaskAttachment(card_id=card_id, file_id=file_id)
-            session.add(attachment)
+        stmt = select(TaskLabel.card_id, TaskLabel.label)
+        for row in _by_card_ids(session, stmt, TaskLabel.card_id, ids):
+            snapshot.setdefault(row.card_id, _empty_state())['labels'].add(row.label)
 
+        stmt = select(TaskAssignee.card_id, TaskAssignee.nc_login)
+        for row in _by_card_ids(session, stmt, TaskAssignee.card_id, ids):
+            snapshot.setdefault(row.card_id, _empty_state())['assignees'].add(row.nc_login)
 
-def delete_task_attachment(card_id: int, file_id: int) -> None:
-    """Удаляет вложение задачи."""
-    with get_session() as session:
-        stmt = delete(TaskAttachment).where(
-            TaskAttachment.card_id == card_id,
-            TaskAttachment.file_id == file_id
-        )
-        session.execute(stmt)
+        return snapshot
 
 
-def get_task_attachments(card_id: int) -> Set[int]:
-    """Возвращает set file_id вложений задачи."""
-    with get_session() as session:
-        stmt = select(TaskAttachment.file_id).where(TaskAttachment.card_id == card_id)
-        result = session.execute(stmt).scalars().all()
-        return set(result)
+def _empty_state() -> Dict[str, Any]:
+    """Состояние карточки, которой нет в БД."""
+    return {
+        'etag': None,
+        'comments_count': None,
+        'attachments_count': None,
+        'attachments': set(),
+        'comments': set(),
+        'labels': set(),
+        'assignees': set(),
+    }
 
 
-def save_task_comment(card_id: int, comment_id: int) -> None:
-    """Добавляет комментарий к задаче."""
-    with get_session() as session:
-        stmt = select(TaskComment).where(
-            TaskComment.card_id == card_id,
-            TaskComment.comment_id == comment_id
-        )
-        existing = session.execute(stmt).scalar_one_or_none()
-        if not existing:
-            comment = TaskComment(card_id=card_id, comment_id=comment_id)
-            session.add(comment)
+# Максимум строк в одном INSERT/DELETE, чтобы не упираться в max_allowed_packet
+_BATCH_SIZE = 500
 
 
-def delete_task_comment(card_id: int, comment_id: int) -> None:
-    """Удаляет комментарий задачи."""
-    with get_session() as session:
-        stmt = delete(TaskComment).where(
-            TaskComment.card_id == card_id,
-            TaskComment.comment_id == comment_id
+@dataclass
+class TaskChangeSet:
+    """
+    Изменения карточек за цикл опроса, накопленные в памяти.
+    Применяются одной транзакцией через apply_task_changes().
+    messages — уведомления (строки outbox_message()), которые ставятся
+    в outbox в той же транзакции.
+    """
+    tasks: Dict[int, Dict[str, Any]] = field(default_factory=dict)
+    stats: Dict[int, Tuple[int, int]] = field(default_factory=dict)
+    labels_add: Set[Tuple[int, str]] = field(default_factory=set)
+    labels_del: Set[Tuple[int, str]] = field(default_factory=set)
+    assignees_add: Set[Tuple[int, str]] = field(default_factory=set)
+    assignees_del: Set[Tuple[int, str]] = field(default_factory=set)
+    attachments_add: Set[Tuple[int, int]] = field(default_factory=set)
+    attachments_del: Set[Tuple[int, int]] = field(default_factory=set)
+    comments_add: Set[Tuple[int, int]] = field(default_factory=set)
+    comments_del: Set[Tuple[int, int]] = field(default_factory=set)
+    deleted_cards: Set[int] = field(default_factory=set)
+    messages: List[Dict[str, Any]] = field(default_factory=list)
+    # Изменения, ждущие окна объединения (ChangeCoalescer): строки pending_card_changes
+    pending_changes: Dict[int, Dict[str, Any]] = field(default_factory=dict)
+    # Карточки, чьи объединённые изменения уведомлены этим набором
+    coalesced: Set[int] = field(default_factory=set)
+
+    def deadline_cards(self) -> Set[int]:
+        """Карточки, у которых могли измениться дедлайн, исполнители или статус."""
+        return (
+            set(self.tasks)
+            | {card_id for card_id, _ in self.assignees_add}
+            | {card_id for card_id, _ in self.assignees_del}
+            | self.deleted_cards
         )
+
+    def is_empty(self) -> bool:
+        return not any((
+            self.tasks, self.stats,
+            self.labels_add, self.labels_del,
+            self.assignees_add, self.assignees_del,
+            self.attachments_add, self.attachments_del,
+            self.comments_add, self.comments_del,
+            self.deleted_cards, self.messages,
+            self.pending_changes, self.coalesced,
+        ))
+
+
+def _chunks(items: List[Any]):
+    for i in range(0, len(items), _BATCH_SIZE):
+        yield items[i:i + _BATCH_SIZE]
+
+
+def _upsert(session, model, rows: List[Dict[str, Any]], keys: Tuple[str, ...]) -> None:
+    """Многострочный INSERT ... ON DUPLICATE KEY UPDATE по всем неключевым колонкам."""
+    for chunk in _chunks(rows):
+        stmt = insert(model).values(chunk)
+        update_cols = [c for c in chunk[0] if c not in keys] or list(keys[:1])
+        stmt = stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in update_cols})
         session.execute(stmt)
 
 
-def get_task_comments(card_id: int) -> Set[int]:
-    """Возвращает set comment_id комментариев задачи."""
-    with get_session() as session:
-        stmt = select(TaskComment.comment_id).where(TaskComment.card_id == card_id)
-        result = session.execute(stmt).scalars().all()
-        return set(result)
+def _delete_pairs(session, columns, pairs: Set[Tuple[Any, Any]]) -> None:
+    """DELETE ... WHERE (card_id, x) IN (...)."""
+    for chunk in _chunks(sorted(pairs)):
+        session.execute(delete(columns[0].class_).where(tuple_(*columns).in_(chunk)))
 
 
-def delete_task_full(card_id: int) -> None:
+def apply_task_changes(changes: TaskChangeSet) -> None:
     """
-    Полностью удаляет карточку и все связанные записи из БД.
-    Используется после архивации на стороне Nextcloud.
+    Применяет накопленные изменения одной транзакцией:
+    многострочные upsert-ы, удаления по парам (card_id, x), постановка
+    уведомлений в outbox и сохранение изменений, ждущих окна объединения.
+    Пустой набор изменений не открывает сессию.
     """
-    with get_session() as session:
-        # Удаляем связанные записи
-        session.execute(delete(DeadlineReminder).where(DeadlineReminder.card_id == card_id))
-        session.execute(delete(TaskLabel).where(TaskLabel.card_id == card_id))
-        session.execute(delete(TaskComment).where(TaskComment.card_id == card_id))
-        session.execute(delete(TaskAttachment).where(TaskAttachment.card_id == card_id))
-        session.execute(delete(TaskAssignee).where(TaskAssignee.card_id == card_id))
-        session.execute(delete(TaskStat).where(TaskStat.card_id == card_id))
-        session.execute(delete(Task).where(Task.card_id == card_id))
-
-
-def get_etag_count(card_id: int) -> Tuple[Optional[str], Optional[int], Optional[int]]:
-    """Возвращает (etag, comments_count, attachments_count) для задачи."""
-    with get_session() as session:
-        task = session.get(Task, card_id)
-        if not task:
-            return None, None, None
+    if changes.is_empty():
+        return
 
-        stat = session.get(TaskStat, card_id)
-        if stat:
-            return task.etag, stat.comments_count, stat.attachments_count
-        return task.etag, None, None
+    with get_session() as session:
+        if changes.tasks:
+            _upsert(session, Task, list(changes.tasks.values()), ("card_id",))
+        if changes.stats:
+            rows = [
+                {"card_id": card_id, "comments_count": c, "attachments_count": a}
+                for card_id, (c, a) in changes.stats.items()
+            ]
+            _upsert(session, TaskStat, rows, ("card_id",))
+
+        _delete_pairs(session, (TaskLabel.card_id, TaskLabel.label), changes.labels_del)
+        _delete_pairs(session, (TaskAssignee.card_id, TaskAssignee.nc_login), changes.assignees_del)
+        _delete_pairs(session, (TaskAttachment.card_id, TaskAttachment.file_id), changes.attachments_del)
+        _delete_pairs(session, (TaskComment.card_id, TaskComment.comment_id), changes.comments_del)
+
+        for model, col, pairs in (
+            (TaskLabel, "label", changes.labels_add),
+            (TaskAssignee, "nc_login", changes.assignees_add),
+            (TaskAttachment, "file_id", changes.attachments_add),
+            (TaskComment, "comment_id", changes.comments_add),
+        ):
+            if pairs:
+                rows = [{"card_id": card_id, col: value} for card_id, value in sorted(pairs)]
+                _upsert(session, model, rows, ("card_id", col))
+
+        if changes.pending_changes:
+            _upsert(session, PendingCardChange, list(changes.pending_changes.values()), ("card_id",))
+
+        if changes.coalesced:
+            for chunk in _chunks(sorted(changes.coalesced)):
+                session.execute(delete(PendingCardChange).where(PendingCardChange.card_id.in_(chunk)))
+
+        if changes.deleted_cards:
+            ids = sorted(changes.deleted_cards)
+            for model in (PendingCardChange, DeadlineReminder, TaskLabel, TaskComment, TaskAttachment, TaskAssignee, TaskStat, Task):
+                for chunk in _chunks(ids):
+                    session.execute(delete(model).where(model.card_id.in_(chunk)))
+
+        add_outbox_messages(session, changes.messages)
@@ -102,6 +102,16 @@ def get_user_map() -> Dict[str, int]:
         return {row.nc_login: row.tg_id for row in result}
 
 
+def get_user_settings() -> Dict[str, Tuple[int, Optional[int]]]:
+    """
+    Возвращает словарь { nc_login: (tg_id, nc_time_zone) }.
+    Используется для расписания напоминаний в часовом поясе пользователя.
+    """
+    with get_session() as session:
+        stmt = select(User.tg_id, User.nc_login, User.nc_time_zone)
+        return {row.nc_login: (row.tg_id, row.nc_time_zone) for row in session.execute(stmt)}
+
+
 def get_users() -> List[Dict[str, str]]:
     """
     Возвращает список словарей { username: nc_login, password: nc_token }.
@@ -0,0 +1,79 @@
+"""
+Колоночный (NumPy) расчёт таймеров напоминаний о дедлайнах для всех пар
+(карточка, исполнитель) сразу — то же, что _next_fire + _choose_stage + _release_at
+из deadlines.py, но сравнениями над массивами. Время — epoch-секунды (float),
+часовые пояса — фиксированные сдвиги в секундах (как users.nc_time_zone).
+"""
+import numpy as np
+
+DAY = 86400.0
+HOUR = 3600.0
+
+# Коды этапов. Порядок совпадает с порядком строк ("due" < "post_repeat" < "pre_24h"),
+# чтобы при равном времени выбирался тот же этап, что и min() по кортежам в _next_fire
+STAGES = ("due", "post_repeat", "pre_24h")
+DUE, POST_REPEAT, PRE_24H = range(3)
+
+# Ранг последнего отправленного этапа (как _last_fixed_rank): нет — -1, pre_24h — 0, due и post_repeat — 1
+RANK = {None: -1, "pre_24h": 0, "due": 1, "post_repeat": 1}
+
+
+def _local_day_start(t, offset):
+    """Начало местных суток (epoch-секунды, UTC) для моментов t в поясе со сдвигом offset."""
+    return np.floor((t + offset) / DAY) * DAY - offset
+
+
+def _in_quiet(t, offset, quiet_start: int, quiet_end: int):
+    hour = np.floor(np.mod(t + offset, DAY) / HOUR)
+    if quiet_start > quiet_end:
+        return (hour >= quiet_start) | (hour < quiet_end)
+    return (hour >= quiet_start) & (hour < quiet_end)
+
+
+def next_fires(due, offset, last_rank, last_repeat, last_sent, now: float, repeat: float | None,
+               quiet_start: int, quiet_end: int):
+    """
+    Время и этап следующего таймера каждой пары.
+
+    due, offset, last_sent — float-массивы (last_sent = NaN, если напоминаний не было);
+    last_rank — int-массив рангов (RANK); last_repeat — bool, последний этап post_repeat;
+    repeat — DEADLINE_REPEAT_DAYS в секундах или None.
+    Возвращает (fire_at, stage, valid): время срабатывания с учётом тихих часов,
+    код этапа и маску пар, которым таймер нужен.
+    """
+    n = len(due)
+    inf = np.full(n, np.inf)
+
+    pre = _local_day_start(due - DAY, offset) + 10 * HOUR
+    cand_pre = np.where(last_rank < 0, pre, inf)
+    cand_due = np.where(last_rank < 1, due, inf)
+    if repeat is not None:
+        rep = due + repeat
+        after_last = np.where(last_repeat & ~np.isnan(last_sent), last_sent + repeat, -np.inf)
+        cand_rep = np.maximum(rep, after_last)
+    else:
+        cand_rep = inf
+
+    cands = np.stack((cand_due, cand_rep, cand_pre))
+    stage = np.argmin(cands, axis=0)
+    fire = cands[stage, np.arange(n)]
+    valid = np.isfinite(fire)
+
+    # Уже наступившее время годится, только если сейчас действительно есть что отправить
+    if repeat is not None:
+        zone = now >= due + repeat
+        repeat_ready = ~last_repeat | (~np.isnan(last_sent) & (now - last_sent >= repeat))
+    else:
+        zone = np.zeros(n, dtype=bool)
+        repeat_ready = zone
+    fixed_ready = ((last_rank < 0) & (now >= pre)) | ((last_rank < 1) & (now >= due))
+    ready = np.where(zone, repeat_ready, fixed_ready)
+    valid &= (fire > now) | ready
+
+    # Тихие часы получателя: переносим на их окончание
+    at = np.maximum(np.where(valid, fire, now), now)
+    quiet = _in_quiet(at, offset, quiet_start, quiet_end)
+    end = _local_day_start(at, offset) + (quiet_end % 24) * HOUR
+    end = np.where(end <= at, end + DAY, end)
+    fire_at = np.where(quiet, end, at)
+    return fire_at, stage, valid
@@ -0,0 +1,122 @@
+import heapq
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+class DeadlineTimers:
+    """
+    Таймеры напоминаний о дедлайнах: min-heap записей
+    (fire_at, card_id, login, stage) — когда пересчитать пару (карточка, пользователь).
+
+    Записи карточки заменяются целиком (schedule/remove): у карточки есть версия,
+    устаревшие записи остаются в куче и пропускаются при извлечении, а когда их
+    становится больше живых — куча перестраивается.
+    Поток поллера отмечает изменившиеся карточки (mark_dirty) и будит ожидающий
+    поток напоминаний; сам пересчёт делает поток напоминаний.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, str, str, int]] = []
+        self._version: Dict[int, int] = {}
+        self._live: Dict[int, int] = {}
+        self._live_total = 0
+        self._dirty: Set[int] = set()
+        self._rebuild = False
+        self._cond = threading.Condition()
+
+    def schedule(self, card_id: int, entries: Iterable[Tuple[float, str, str]]) -> None:
+        """Заменяет записи карточки на entries: [(fire_at, login, stage), ...], fire_at — epoch-секунды."""
+        with self._cond:
+            version = self._version.get(card_id, 0) + 1
+            self._version[card_id] = version
+            count = 0
+            for fire_at, login, stage in entries:
+                heapq.heappush(self._heap, (fire_at, card_id, login, stage, version))
+                count += 1
+            self._live_total += count - self._live.get(card_id, 0)
+            if count:
+                self._live[card_id] = count
+            else:
+                self._live.pop(card_id, None)
+            self._compact()
+            self._cond.notify_all()
+
+    def remove(self, card_id: int) -> None:
+        """Убирает все записи карточки."""
+        self.schedule(card_id, ())
+
+    def clear(self) -> None:
+        with self._cond:
+            self._heap.clear()
+            self._version.clear()
+            self._live.clear()
+            self._live_total = 0
+
+    def pop_due(self, now: float) -> List[Tuple[int, str, str]]:
+        """Извлекает наступившие записи: [(card_id, login, stage), ...]."""
+        due = []
+        with self._cond:
+            heap = self._heap
+            while heap and heap[0][0] <= now:
+                _, card_id, login, stage, version = heapq.heappop(heap)
+                if self._version.get(card_id) != version:
+                    continue
+                due.append((card_id, login, stage))
+                self._live_total -= 1
+                left = self._live.get(card_id, 0) - 1
+                if left > 0:
+                    self._live[card_id] = left
+                else:
+                    self._live.pop(card_id, None)
+        return due
+
+    def next_fire_at(self) -> Optional[float]:
+        """Время ближайшей живой записи (epoch-секунды) или None."""
+        with self._cond:
+            heap = self._heap
+            while heap and self._version.get(heap[0][1]) != heap[0][4]:
+                heapq.heappop(heap)
+            return heap[0][0] if heap else None
+
+    def mark_dirty(self, card_ids: Iterable[int]) -> None:
+        """Отмечает карточки, у которых мог измениться дедлайн, исполнители или статус."""
+        with self._cond:
+            before = len(self._dirty)
+            self._dirty.update(card_ids)
+            if len(self._dirty) != before:
+                self._cond.notify_all()
+
+    def take_dirty(self) -> Set[int]:
+        with self._cond:
+            dirty, self._dirty = self._dirty, set()
+            return dirty
+
+    def request_rebuild(self) -> None:
+        """Просит поток напоминаний пересобрать все таймеры (например, сменился часовой пояс пользователя)."""
+        with self._cond:
+            self._rebuild = True
+            self._cond.notify_all()
+
+    def take_rebuild(self) -> bool:
+        with self._cond:
+            requested, self._rebuild = self._rebuild, False
+            return requested
+
+    def wait(self, until: Optional[float]) -> None:
+        """Спит до until (epoch-секунды; None — без срока), mark_dirty или request_rebuild."""
+        with self._cond:
+            while not self._dirty and not self._rebuild:
+                timeout = None if until is None else until - time.time()
+                if timeout is not None and timeout <= 0:
+                    return
+                self._cond.wait(timeout)
+
+    def _compact(self) -> None:
+        if len(self._heap) > 2 * self._live_total + 64:
+            self._heap = [e for e in self._heap if self._version.get(e[1]) == e[4]]
+            heapq.heapify(self._heap)
+
+    def __len__(self) -> int:
+        with self._cond:
+            return self._live_total
@@ -2,20 +2,25 @@ from __future__ import annotations
 
 import time
 import traceback
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timedelta, timezone, tzinfo
 from zoneinfo import ZoneInfo
 
+import numpy as np
+
 from source.app_logging import logger
-from source.connections.nextcloud_api import fetch_all_tasks
-from source.db.repos.users import get_user_map
-from source.db.repos.tasks import get_saved_tasks, get_saved_tasks_for_deadlines
-from source.db.repos.deadlines import get_last_sent_map, mark_sent, reset_sent_for_card
-from source.connections.sender import send_message_limited
+from source.db.repos.users import get_user_settings
+from source.db.repos.deadlines import get_deadline_candidates, mark_sent_batch, reset_sent_for_cards
+from source.db.repos.outbox import outbox_message
+from source.connections.outbox import wake_outbox
 from source.links import card_url
+from source.cards import Card
+from source.deadline_timers import DeadlineTimers
+from source.deadline_columns import RANK, STAGES, next_fires
 
-from source.config import DEADLINES_INTERVAL, TIMEZONE, QUIET_HOURS, DEADLINE_REPEAT_DAYS, EXCLUDED_CARD_IDS
-
-DEADLINES_INTERVAL = int(DEADLINES_INTERVAL)
+from source.config import (
+    DEADLINES_RESYNC_INTERVAL, DEADLINES_VECTORIZED, TIMEZONE, TIMEZONES, QUIET_HOURS, DEADLINE_REPEAT_DAYS,
+    EXCLUDED_CARD_IDS,
+)
 
 try:
     TEAM_TZ = ZoneInfo(TIMEZONE)
@@ -44,7 +49,7 @@ QUIET_START, QUIET_END = _parse_quiet(QUIET_HOURS)
 
 def _in_quiet_hours(now_local: datetime) -> bool:
     """
-    Проверяет, попадает ли текущее время в тихие часы.
+    Проверяет, попадает ли местное время получателя в тихие часы.
     """
     h = now_local.hour
     if QUIET_START > QUIET_END:
@@ -52,33 +57,51 @@ def _in_quiet_hours(now_local: datetime) -> bool:
     return QUIET_START <= h < QUIET_END
 
 
-def _at_team_10(utc_dt: datetime) -> datetime:
+def _quiet_end(now_utc: datetime, tz: tzinfo = TEAM_TZ) -> datetime:
+    """
+    Ближайшее окончание тихих часов (QUIET_END:00 в часовом поясе tz) после now_utc.
+    """
+    local = now_utc.astimezone(tz)
+    end = local.replace(hour=QUIET_END % 24, minute=0, second=0, microsecond=0)
+    if end <= local:
+        end += timedelta(days=1)
+    return end.astimezone(timezone.utc)
+
+
+def _release_at(at_utc: datetime, tz: tzinfo = TEAM_TZ) -> datetime:
+    """Время отправки напоминания, назначенного на at_utc: если это тихие часы получателя — их окончание."""
+    if _in_quiet_hours(at_utc.astimezone(tz)):
+        return _quiet_end(at_utc, tz)
+    return at_utc
+
+
+def _at_local_10(utc_dt: datetime, tz: tzinfo = TEAM_TZ) -> datetime:
     """
-    Переводит дату в 10:00 по часовому поясу команды.
+    Переводит дату в 10:00 в часовом поясе tz (получателя).
     Используется для фиксированных напоминаний.
     """
-    local = utc_dt.astimezone(TEAM_TZ)
+    local = utc_dt.astimezone(tz)
     local10 = local.replace(hour=10, minute=0, second=0, microsecond=0)
     return local10.astimezone(timezone.utc)
 
 
-def _fixed_schedule(due_utc: datetime) -> dict[str, datetime]:
+def _fixed_schedule(due_utc: datetime, tz: tzinfo = TEAM_TZ) -> dict[str, datetime]:
     """
-    Формирует расписание напоминаний:
-    - за 24 часа
+    Формирует расписание напоминаний в часовом поясе получателя:
+    - за 24 часа (в 10:00 накануне)
     - в момент дедлайна
     """
     return {
-        "pre_24h": _at_team_10(due_utc - timedelta(days=1)),
+        "pre_24h": _at_local_10(due_utc - timedelta(days=1), tz),
         "due": due_utc,
     }
 
 
-def _fmt_due_local(due_utc: datetime) -> str:
+def _fmt_due_local(due_utc: datetime, tz: tzinfo = TEAM_TZ) -> str:
     """
-    Форматирует дедлайн в локальное время команды.
+    Форматирует дедлайн в местное время получателя.
     """
-    return due_utc.astimezone(TEAM_TZ).strftime("%Y-%m-%d %H:%M")
+    return due_utc.astimezone(tz).strftime("%Y-%m-%d %H:%M")
 
 
 def _fmt_delta(now: datetime, due: datetime) -> str:
@@ -95,16 +118,16 @@ def _fmt_delta(now: datetime, due: datetime) -> str:
     return f"-{s}" if neg else s
 
 
-def _line_for_stage(stage: str, item: dict, now_utc: datetime) -> str:
+def _line_for_stage(stage: str, item: Card, now_utc: datetime, tz: tzinfo = TEAM_TZ) -> str:
     """
     Формирует строку уведомления для конкретного этапа напоминания.
     """
-    cid = item["card_id"]
-    title = item["title"]
-    due = item["duedate"]
-    link = f'<a href="{card_url(item["board_id"], cid)}">{cid}</a>'
+    cid = item.card_id
+    title = item.title
+    due = item.duedate
+    link = f'<a href="{card_url(item.board_id, cid)}">{cid}</a>'
     rel = _fmt_delta(now_utc, due)
-    due_s = _fmt_due_local(due)
+    due_s = _fmt_due_local(due, tz)
 
     prefix = {
         "pre_24h": "🌝 Завтра",
@@ -135,156 +158,417 @@ def _sent_at_to_utc(sent_at: datetime) -> datetime:
     return sent_at.astimezone(timezone.utc)
 
 
-def poll_deadlines():
+FIXED = ["pre_24h", "due"]
+FIXED_RANK = {s: i for i, s in enumerate(FIXED)}
+DUE_RANK = FIXED_RANK["due"]
+
+_timers = DeadlineTimers()
+# Состояние потока напоминаний: активные карточки и последнее напоминание
+# каждой пары { (card_id, login): (stage, sent_at UTC) } — копия deadline_reminders
+_cards: dict[int, Card] = {}
+_last_sent: dict[tuple[int, str], tuple[str, datetime]] = {}
+# Зарегистрированные пользователи: { nc_login: (tg_id, часовой пояс) }
+_users: dict[str, tuple[int, tzinfo]] = {}
+# Карточки, чьи напоминания сброшены в памяти, но ещё не в БД (см. _flush_resets)
+_pending_resets: set[int] = set()
+# Через сколько повторить напоминания, которые не удалось поставить в outbox
+_RETRY_DELAY = timedelta(seconds=30)
+
+
+def notify_deadline_changes(card_ids) -> None:
     """
-    Фоновый цикл проверки дедлайнов:
-    - проверяет задачи с дедлайнами
-    - определяет, какие уведомления нужно отправить
-    - отправляет их пользователям
-    - записывает факт отправки в БД
+    Сообщает потоку напоминаний, что у карточек могли измениться дедлайн,
+    исполнители или статус (вызывается поллером после фиксации изменений).
     """
-    logger.info(f"DEADLINES: Запускается фоновый опрос, частота {DEADLINES_INTERVAL} секунд!")
+    _timers.mark_dirty(card_ids)
 
-    FIXED = ["pre_24h", "due"]
-    FIXED_RANK = {s: i for i, s in enumerate(FIXED)}
-    DUE_RANK = FIXED_RANK["due"]
 
-    while True:
-        try:
-            logger.info("DEADLINES: Начинается плановая проверка дедлайнов")
+def notify_users_changed() -> None:
+    """Пользователь сменил часовой пояс или зарегистрировался — таймеры пересобираются."""
+    _timers.request_rebuild()
+
+
+def _load_users() -> None:
+    _users.clear()
+    for login, (tg_id, offset) in get_user_settings().items():
+        _users[login] = (tg_id, TIMEZONES.get(offset, TEAM_TZ) if offset is not None else TEAM_TZ)
+
+
+def _repeat_delta() -> timedelta | None:
+    repeat_days = int(DEADLINE_REPEAT_DAYS)
+    return timedelta(days=repeat_days) if repeat_days > 0 else None
+
+
+def _last_fixed_rank(last_stage: str | None) -> int:
+    if last_stage in FIXED_RANK:
+        return FIXED_RANK[last_stage]
+    if last_stage == "post_repeat":
+        return DUE_RANK
+    return -1
+
+
+def _horizon(now_utc: datetime) -> datetime:
+    """
+    До какого дедлайна (naive UTC) загружать карточки: первое напоминание
+    (10:00 накануне) наступает не раньше чем за 2 дня до дедлайна, а более
+    далёкие карточки подхватит следующая пересборка.
+    """
+    return _to_utc_naive(now_utc + timedelta(seconds=DEADLINES_RESYNC_INTERVAL, days=2))
+
+
+def _load(now_utc: datetime, card_ids: set[int] | None = None) -> dict[int, Card]:
+    """
+    Загружает карточки-кандидаты (get_deadline_candidates) и обновляет
+    для них последние отправленные напоминания в _last_sent.
+    """
+    cards: dict[int, Card] = {}
+    for row in get_deadline_candidates(_horizon(now_utc), card_ids):
+        item = cards.get(row.card_id)
+        if item is None:
+            item = cards[row.card_id] = Card(
+                card_id=row.card_id, title=row.title, description="",
+                board_id=row.board_id, board_title="", stack_id=0, stack_title="",
+                duedate=row.duedate,
+            )
+        item.assigned_logins.append(row.login)
+        if row.last_stage is not None:
+            sent_at = _sent_at_to_utc(row.last_sent_at)
+            last = _last_sent.get((row.card_id, row.login))
+            if last is None or last[1] < sent_at:
+                _last_sent[(row.card_id, row.login)] = (row.last_stage, sent_at)
+    return cards
 
-            now_utc = datetime.utcnow().replace(tzinfo=timezone.utc)
-            now_local = now_utc.astimezone(TEAM_TZ)
 
-            if _in_quiet_hours(now_local):
-                logger.info("DEADLINES: тихие часы, пропуск.")
-                time.sleep(DEADLINES_INTERVAL)
+def _choose_stage(due: datetime, last: tuple[str, datetime] | None, now_utc: datetime,
+                  tz: tzinfo = TEAM_TZ) -> str | None:
+    """
+    Какое напоминание отправить паре (карточка, пользователь) сейчас:
+    - после просрочки на DEADLINE_REPEAT_DAYS — post_repeat, не чаще раза в DEADLINE_REPEAT_DAYS;
+    - иначе самый поздний из наступивших этапов расписания, который ещё не отправлялся.
+    """
+    last_stage, last_sent_utc = last if last else (None, None)
+    repeat_delta = _repeat_delta()
+    fixed_sched = _fixed_schedule(due, tz)
+    repeat_zone = (repeat_delta is not None) and (now_utc >= (fixed_sched["due"] + repeat_delta))
+
+    if repeat_zone:
+        if last_stage != "post_repeat":
+            return "post_repeat"
+        if last_sent_utc is not None and now_utc - last_sent_utc >= repeat_delta:
+            return "post_repeat"
+        return None
+
+    last_rank = _last_fixed_rank(last_stage)
+    candidates = [s for s, ts in fixed_sched.items() if FIXED_RANK[s] > last_rank and now_utc >= ts]
+    if candidates:
+        return max(candidates, key=lambda s: FIXED_RANK[s])
+    return None
+
+
+def _next_fire(due: datetime, last: tuple[str, datetime] | None,
+               tz: tzinfo = TEAM_TZ) -> tuple[datetime, str] | None:
+    """Когда паре в следующий раз может понадобиться напоминание, и какое (без учёта тихих часов)."""
+    last_stage, last_sent_utc = last if last else (None, None)
+    last_rank = _last_fixed_rank(last_stage)
+    candidates = [(ts, s) for s, ts in _fixed_schedule(due, tz).items() if FIXED_RANK[s] > last_rank]
+    repeat_delta = _repeat_delta()
+    if repeat_delta is not None:
+        at = due + repeat_delta
+        if last_stage == "post_repeat" and last_sent_utc is not None:
+            at = max(at, last_sent_utc + repeat_delta)
+        candidates.append((at, "post_repeat"))
+    return min(candidates) if candidates else None
+
+
+def _schedule_card(item: Card, now_utc: datetime) -> None:
+    """
+    Пересчитывает таймеры карточки для зарегистрированных исполнителей: время
+    срабатывания считается в часовом поясе получателя и переносится на конец
+    его тихих часов. Если дедлайн перенесён в будущее после напоминания
+    «срок наступил» — отправленные напоминания сбрасываются.
+    """
+    card_id = item.card_id
+    if item.duedate and item.duedate.tzinfo is None:
+        item.duedate = item.duedate.replace(tzinfo=timezone.utc)
+    if not item.duedate or not item.assigned_logins or not _should_notify(card_id):
+        _cards.pop(card_id, None)
+        _timers.remove(card_id)
+        return
+
+    _cards[card_id] = item
+    due = item.duedate
+    logins = set(item.assigned_logins)
+    if now_utc < due and any(
+            _last_fixed_rank(_last_sent.get((card_id, login), (None,))[0]) >= DUE_RANK for login in logins):
+        _pending_resets.add(card_id)
+        for key in [k for k in _last_sent if k[0] == card_id]:
+            del _last_sent[key]
+
+    entries = []
+    for login in logins:
+        if login not in _users:
+            continue
+        tz = _users[login][1]
+        last = _last_sent.get((card_id, login))
+        nxt = _next_fire(due, last, tz)
+        if nxt is None:
+            continue
+        fire_at, stage = nxt
+        if fire_at <= now_utc and _choose_stage(due, last, now_utc, tz) is None:
+            continue
+        entries.append((_release_at(max(fire_at, now_utc), tz).timestamp(), login, stage))
+    _timers.schedule(card_id, entries)
+
+
+def _fixed_offset(tz: tzinfo, now_utc: datetime) -> float | None:
+    """Сдвиг пояса от UTC в секундах или None, если пояс переходит на летнее время."""
+    offset = now_utc.astimezone(tz).utcoffset()
+    if (now_utc + timedelta(days=183)).astimezone(tz).utcoffset() != offset:
+        return None
+    return offset.total_seconds()
+
+
+def _schedule_cards_columnar(items, now_utc: datetime) -> bool:
+    """
+    То же, что _schedule_card для каждой карточки, но время срабатывания всех пар
+    (карточка, исполнитель) считается одним проходом над массивами (deadline_columns).
+    Возвращает False, если у кого-то из получателей пояс с летним временем —
+    тогда таймеры строятся поштучно.
+    """
+    offsets = {}
+    for login, (_, tz) in _users.items():
+        offsets[login] = _fixed_offset(tz, now_utc)
+        if offsets[login] is None:
+            return False
+
+    active = []
+    for item in items:
+        if item.duedate and item.duedate.tzinfo is None:
+            item.duedate = item.duedate.replace(tzinfo=timezone.utc)
+        if not item.duedate or not item.assigned_logins or not _should_notify(item.card_id):
+            _cards.pop(item.card_id, None)
+            _timers.remove(item.card_id)
+            continue
+        _cards[item.card_id] = item
+        active.append(item)
+
+    # Колонки пар, включая незарегистрированных исполнителей: их напоминания тоже учитываются при сбросе
+    card_idx, logins, due, offset, rank, repeat_last, sent = [], [], [], [], [], [], []
+    for i, item in enumerate(active):
+        due_ts = item.duedate.timestamp()
+        for login in set(item.assigned_logins):
+            stage, sent_at = _last_sent.get((item.card_id, login), (None, None))
+            card_idx.append(i)
+            logins.append(login)
+            due.append(due_ts)
+            offset.append(offsets.get(login, 0.0))
+            rank.append(RANK.get(stage, -1))
+            repeat_last.append(stage == "post_repeat")
+            sent.append(sent_at.timestamp() if sent_at is not None else float("nan"))
+
+    card_idx = np.array(card_idx, dtype=np.int64)
+    due = np.array(due, dtype=float)
+    rank = np.array(rank, dtype=np.int8)
+    repeat_last = np.array(repeat_last, dtype=bool)
+    sent = np.array(sent, dtype=float)
+    now = now_utc.timestamp()
+
+    # Дедлайн перенесён в будущее после «срок наступил» — сбрасываем напоминания всей карточки
+    reset = np.unique(card_idx[(now < due) & (rank >= DUE_RANK)])
+    if len(reset):
+        in_reset = np.isin(card_idx, reset)
+        rank[in_reset] = -1
+        repeat_last[in_reset] = False
+        sent[in_reset] = float("nan")
+        reset_ids = {active[i].card_id for i in reset.tolist()}
+        _pending_resets.update(reset_ids)
+        for key in [k for k in _last_sent if k[0] in reset_ids]:
+            del _last_sent[key]
+
+    repeat = _repeat_delta()
+    fire_at, stage, valid = next_fires(
+        due, np.array(offset, dtype=float), rank, repeat_last, sent, now,
+        repeat.total_seconds() if repeat is not None else None, QUIET_START, QUIET_END,
+    )
+    valid &= np.array([login in _users for login in logins], dtype=bool)
+
+    entries: dict[int, list[tuple[float, str, str]]] = {}
+    for j in np.flatnonzero(valid).tolist():
+        entries.setdefault(int(card_idx[j]), []).append(
+            (float(fire_at[j]), logins[j], STAGES[stage[j]])
+        )
+    for i, item in enumerate(active):
+        _timers.schedule(item.card_id, entries.get(i, ()))
+    return True
+
+
+def _flush_resets() -> None:
+    """Сбрасывает в БД напоминания карточек из _pending_resets одним запросом (каждая — один раз за цикл)."""
+    if not _pending_resets:
+        return
+    card_ids = sorted(_pending_resets)
+    try:
+        reset_sent_for_cards(card_ids)
+    except Exception as e:
+        logger.error(f"DEADLINES: не удалось сбросить напоминания карточек {card_ids}: {e}")
+        return
+    _pending_resets.clear()
+    logger.info(f"DEADLINES: дедлайн перенесён, напоминания сброшены: {card_ids}")
+
+
+def _rebuild(now_utc: datetime) -> None:
+    """Полная загрузка карточек-кандидатов и отправленных напоминаний из БД и пересборка таймеров."""
+    t0 = time.time()
+    _cards.clear()
+    _last_sent.clear()
+    _timers.clear()
+    _load_users()
+    cards = _load(now_utc)
+    if not (DEADLINES_VECTORIZED and _schedule_cards_columnar(cards.values(), now_utc)):
+        for item in cards.values():
+            _schedule_card(item, now_utc)
+    next_at = _timers.next_fire_at()
+    next_s = f"{datetime.fromtimestamp(next_at, TEAM_TZ):%Y-%m-%d %H:%M}" if next_at else "—"
+    logger.info(
+        f"DEADLINES: таймеры пересобраны за {time.time() - t0:.2f}s: cards={len(cards)} active_due={len(_cards)} "
+        f"timers={len(_timers)} next={next_s}"
+    )
+
+
+def _patch(card_ids: set[int], now_utc: datetime) -> None:
+    """Перечитывает из БД только изменившиеся карточки и пересчитывает их таймеры."""
+    for key in [k for k in _last_sent if k[0] in card_ids]:
+        del _last_sent[key]
+    _load_users()
+    found = _load(now_utc, card_ids)
+    for card_id in card_ids:
+        item = found.get(card_id)
+        if item is None:
+            # Выполнена, удалена, без исполнителей или дедлайн за горизонтом загрузки
+            _cards.pop(card_id, None)
+            _timers.remove(card_id)
+            continue
+        _schedule_card(item, now_utc)
+    logger.debug(f"DEADLINES: таймеры обновлены для карточек {sorted(card_ids)}, всего {len(_timers)}")
+
+
+def _collect_due(now_utc: datetime) -> tuple[dict[str, list[tuple[str, str, int]]], set[int]]:
+    """
+    Напоминания по наступившим таймерам: { login: [(stage, строка, card_id), ...] }
+    и карточки, где кому-то из получателей напоминание отложено (тихие часы).
+    """
+    per_user: dict[str, list[tuple[str, str, int]]] = {}
+    deferred: set[int] = set()
+    card_ids = {card_id for card_id, _, _ in _timers.pop_due(now_utc.timestamp())}
+    for card_id in card_ids:
+        item = _cards.get(card_id)
+        if item is None:
+            continue
+        for login in set(item.assigned_logins):
+            if login not in _users:
+                continue
+            tz = _users[login][1]
+            chosen_stage = _choose_stage(item.duedate, _last_sent.get((card_id, login)), now_utc, tz)
+            if not chosen_stage:
                 continue
+            if _in_quiet_hours(now_utc.astimezone(tz)):
+                deferred.add(card_id)
+                continue
+            per_user.setdefault(login, []).append(
+                (chosen_stage, _line_for_stage(chosen_stage, item, now_utc, tz), card_id)
+            )
+    return per_user, deferred
 
-            repeat_days = int(DEADLINE_REPEAT_DAYS)
-            repeat_delta = timedelta(days=repeat_days) if repeat_days > 0 else None
-
-            login_map = get_user_map()
-
-            t0 = time.time()
-            cards = get_saved_tasks_for_deadlines()
-            fetch_sec = time.time() - t0
-
-            for c in cards:
-                if c.get("duedate") and c["duedate"].tzinfo is None:
-                    c["duedate"] = c["duedate"].replace(tzinfo=timezone.utc)
-
-            last_map = get_last_sent_map()
-            per_user: dict[str, list[tuple[str, str, int]]] = {}
-
-            with_due = 0
-            active_due = 0
-
-            for item in cards:
-                due = item.get("duedate")
-                if not due:
-                    continue
-                with_due += 1
-
-                if (item.get("done") is not None) or (
-                        (item.get("done") is None) and (item.get("prev_stack_id") is None) and (
-                        item.get("next_stack_id") is None)):
-                    continue
-
-                assigned = set(item.get("assigned_logins") or [])
-                if not assigned:
-                    continue
-
-                active_due += 1
-
-                fixed_sched = _fixed_schedule(due)
-                due_time = fixed_sched["due"]
-                repeat_zone = (repeat_delta is not None) and (now_utc >= (due_time + repeat_delta))
-
-                for login in assigned:
-                    last = last_map.get((item["card_id"], login))
-                    last_stage = last[0] if last else None
-                    last_sent_at = last[1] if last else None
-                    last_sent_utc = _sent_at_to_utc(last_sent_at) if last_sent_at else None
-
-                    last_fixed_rank = -1
-                    if last_stage in FIXED_RANK:
-                        last_fixed_rank = FIXED_RANK[last_stage]
-                    elif last_stage == "post_repeat":
-                        last_fixed_rank = DUE_RANK
-
-                    if now_utc < due and last_fixed_rank >= DUE_RANK:
-                        try:
-                            reset_sent_for_card(item["card_id"])
-                        except Exception:
-                            pass
-                        last_stage = None
-                        last_fixed_rank = -1
-                        last_sent_utc = None
-                        last_sent_at = None
-
-                    chosen_stage = None
-
-                    if repeat_zone:
-                        if last_stage != "post_repeat":
-                            chosen_stage = "post_repeat"
-                        else:
-                            if repeat_delta is not None and last_sent_utc is not None and (
-                                    now_utc - last_sent_utc >= repeat_delta):
-                                chosen_stage = "post_repeat"
-                    else:
-                        candidates = [
-                            s for s, ts in fixed_sched.items()
-                            if FIXED_RANK[s] > last_fixed_rank and now_utc >= ts
-                        ]
-                        if candidates:
-                            chosen_stage = max(candidates, key=lambda s: FIXED_RANK[s])
-
-                    if not chosen_stage:
-                        continue
-
-                    per_user.setdefault(login, []).append(
-                        (chosen_stage, _line_for_stage(chosen_stage, item, now_utc), item["card_id"])
-                    )
 
+def poll_deadlines():
+    """
+    Фоновый поток напоминаний о дедлайнах:
+    - при старте (и раз в DEADLINES_RESYNC_INTERVAL) строит таймеры по всем карточкам из БД;
+    - изменения карточек получает от поллера (notify_deadline_changes) и пересчитывает только их;
+    - таймеры считаются в часовом поясе получателя, напоминания на его тихие часы
+      назначаются сразу на их окончание;
+    - спит до ближайшего таймера;
+    - ставит напоминания в outbox и записывает факт отправки в БД одной транзакцией.
+    """
+    logger.info(f"DEADLINES: Запускается поток напоминаний, полная пересборка раз в {DEADLINES_RESYNC_INTERVAL} секунд")
+
+    resync_at = 0.0
+    while True:
+        wake_at = None
+        try:
+            now_utc = datetime.utcnow().replace(tzinfo=timezone.utc)
+
+            rebuild = _timers.take_rebuild()
+            if rebuild or time.time() >= resync_at:
+                _timers.take_dirty()
+                _rebuild(now_utc)
+                resync_at = time.time() + DEADLINES_RESYNC_INTERVAL
+            else:
+                dirty = _timers.take_dirty()
+                if dirty:
+                    _patch(dirty, now_utc)
+            _flush_resets()
+
+            per_user, deferred = _collect_due(now_utc)
             total_items = sum(len(v) for v in per_user.values())
-            logger.info(
-                f"DEADLINES: fetch={fetch_sec:.2f}s cards={len(cards)} with_due={with_due} active_due={active_due} "
-                f"users_to_notify={len(per_user)} reminders={total_items}"
-            )
+            for card_id in deferred:
+                _schedule_card(_cards[card_id], now_utc)
+            next_at = _timers.next_fire_at()
+            wake_at = min(next_at, resync_at) if next_at is not None else resync_at
 
             if total_items == 0:
-                time.sleep(DEADLINES_INTERVAL)
                 continue
+            logger.info(
+                f"DEADLINES: active_due={len(_cards)} users_to_notify={len(per_user)} reminders={total_items}"
+            )
 
             priority = {
                 "due": 0,
                 "post_repeat": 1,
                 "pre_24h": 2,
             }
-            if _should_notify(item["card_id"]):
-                for login, entries in per_user.items():
-                    tg_id = login_map.get(login)
-                    if not tg_id:
-                        continue
-
-                    entries.sort(key=lambda x: (priority.get(x[0], 9), x[2]))
-                    body = "\n".join(e[1] for e in entries)
-
-                    ok = send_message_limited(tg_id, f"⏰ Напоминания о дедлайнах:\n{body}")
-                    if ok:
-                        for stage, _, card_id in entries:
-                            try:
-                                mark_sent(card_id, login, stage)
-                            except Exception as e:
-                                logger.error(
-                                    f"DEADLINES: не удалось отметить отправку ({card_id}, {login}, {stage}): {e}")
-                                logger.debug(traceback.format_exc())
-                    else:
-                        logger.warning(f"DEADLINES: уведомления {login} ({tg_id}) не доставлены, пропускаю mark_sent")
+            digests = []
+            for login, entries in per_user.items():
+                tg_id = _users[login][0]
+
+                entries.sort(key=lambda x: (priority.get(x[0], 9), x[2]))
+                body = "\n".join(e[1] for e in entries)
+                digests.append((
+                    login,
+                    [(card_id, stage) for stage, _, card_id in entries],
+                    outbox_message(tg_id, f"⏰ Напоминания о дедлайнах:\n{body}"),
+                ))
+
+            touched = set()
+            try:
+                mark_sent_batch(digests)
+            except Exception as e:
+                logger.error(
+                    f"DEADLINES: не удалось поставить напоминания ({len(digests)} дайджестов) в очередь: {e}. "
+                    f"Повтор через {_RETRY_DELAY.seconds}s"
+                )
+                logger.debug(traceback.format_exc())
+                # Таймеры этих карточек уже извлечены из кучи — ставим их снова
+                for card_id in {card_id for _, entries, _ in digests for card_id, _ in entries}:
+                    _schedule_card(_cards[card_id], now_utc + _RETRY_DELAY)
+                digests = []
+            for login, entries, _ in digests:
+                for card_id, stage in entries:
+                    _last_sent[(card_id, login)] = (stage, now_utc)
+                    touched.add(card_id)
+            if digests:
+                wake_outbox()
+
+            # Следующие этапы для отправленных карточек; неотправленные пересчитаются при пересборке
+            for card_id in touched:
+                _schedule_card(_cards[card_id], now_utc)
+            _flush_resets()
+            next_at = _timers.next_fire_at()
+            wake_at = min(next_at, resync_at) if next_at is not None else resync_at
 
         except Exception:
             logger.exception("DEADLINES: сбой цикла")
             logger.debug(traceback.format_exc())
-
-        time.sleep(DEADLINES_INTERVAL)
+            wake_at = time.time() + 5
+        finally:
+            _timers.wait(wake_at)
@@ -4,14 +4,15 @@ from source.app_logging import logger
 from source.connections.bot_factory import bot
 from source.connections.sender import send_message_limited
 from source.db.repos.users import get_login_by_tg_id, save_login_to_db, save_login_token, delete_login_token, get_token, get_nc_token, get_email_by_tg_id, save_timezone
-from source.db.repos.tasks import save_task_to_db, get_tasks_from_users, save_task_comment, get_task_stat, upsert_task_stats
+from source.db.repos.tasks import get_tasks_from_users, save_task_comment, get_task_stat, upsert_task_stats
 from source.db.repos.boards import save_board_topic
 from source.connections.nextcloud_api import fetch_user_tasks, get_board_title
 from source.config import COMMIT_HASH, WEB_APP_URL, OCS_BASE_URL, HEADERS
 
-from requests import post
+from source.connections.nextcloud_client import nc_post
 
 from source.nc_calendar import get_calendar
+from source.deadlines import notify_users_changed
 
 
 @bot.message_handler(commands=['start'])
@@ -41,7 +42,7 @@ def register_handler(message):
             'User-Agent': '@ITMOcraftBOT',
             'Accept': 'application/json'
         }
-        init_resp = post(WEB_APP_URL + "/index.php/login/v2", headers=headers)
+        init_resp = nc_post(WEB_APP_URL + "/index.php/login/v2", auth=None, headers=headers)
         init_resp.raise_for_status()
         init_resp = init_resp.json()
         login_url = init_resp['login']
@@ -83,26 +84,26 @@ def show_user_cards(message):
     tasks = get_tasks_from_users(login)
 
     for t in tasks:
-        if t.get('done') is not None:
+        if t.done is not None:
             continue
 
         kb = InlineKeyboardMarkup()
-        if t.get('prev_stack_id') is not None:
+        if t.prev_stack_id is not None:
             kb.add(InlineKeyboardButton(
-                text=f"⬅ {t.get('prev_stack_title')}",
-                callback_data=f"move:{t['board_id']}:{t['stack_id']}:{t['card_id']}:{t.get('prev_stack_id')}"
+                text=f"⬅ {t.prev_stack_title}",
+                callback_data=f"move:{t.board_id}:{t.stack_id}:{t.card_id}:{t.prev_stack_id}"
             ))
-        if t.get('next_stack_id') is not None:
+        if t.next_stack_id is not None:
             kb.add(InlineKeyboardButton(
-                text=f"➡ {t.get('next_stack_title')}",
-                callback_data=f"move:{t['board_id']}:{t['stack_id']}:{t['card_id']}:{t.get('next_stack_id')}"
+                text=f"➡ {t.next_stack_title}",
+                callback_data=f"move:{t.board_id}:{t.stack_id}:{t.card_id}:{t.next_stack_id}"
             ))
         msg = (
-            f"{t['title']}\n"
-            f"Board: {t['board_title']}\n"
-            f"Column: {t['stack_title']}\n"
-            f"Due: {t['duedate'] or '—'}\n"
-            f"{t['description'] or '—'}"
+            f"{t.title}\n"
+            f"Board: {t.board_title}\n"
+            f"Column: {t.stack_title}\n"
+            f"Due: {t.duedate or '—'}\n"
+            f"{t.description or '—'}"
         )
         send_message_limited(chat_id, msg, reply_markup=kb)
 
@@ -246,7 +247,7 @@ def reply_comments(message):
     username = get_login_by_tg_id(message.from_user.id)
     token = get_nc_token(message.from_user.id)
     header = {'OCS-APIRequest': 'true', 'Content-Type': 'application/json', 'Accept': 'application/json'}
-    comment = post(f"{OCS_BASE_URL}/deck/api/v1.0/cards/{card_id}/comments", headers=header, auth=(username, token), json={"message":message.text, "parentId": None})
+    comment = nc_post(f"{OCS_BASE_URL}/deck/api/v1.0/cards/{card_id}/comments", headers=header, auth=(username, token), json={"message":message.text, "parentId": None})
     if comment.status_code == 404:
         return
     comment.raise_for_status()
@@ -288,6 +289,7 @@ def timezone_handler(message):
         return
     try:
         save_timezone(user_id, int(command_data[1]))
+        notify_users_changed()
     except Exception as e:
         logger.error("TIMEZONE: ой")
 
@@ -1,17 +1,18 @@
 from source.config import FORUM_CHAT_ID
-from source.connections.sender import send_message_limited
+from source.db.repos.outbox import outbox_message
 from source.db.repos.boards import get_message_thread_id
 
 
-def send_log(text, board_id=None, reply_markup=None):
+def log_message(text, board_id=None, reply_markup=None, card_id=None) -> dict:
     """
-    Отправляет служебное сообщение в форум-чат.
-    Если указана доска — сообщение отправляется в соответствующий топик.
+    Служебное сообщение в форум-чат (в топик доски, если она указана),
+    подготовленное для outbox (см. TaskChangeSet.messages).
+    С card_id — редактируемое сообщение о карточке.
     """
-    message_thread_id = get_message_thread_id(board_id)
-    send_message_limited(
+    return outbox_message(
         FORUM_CHAT_ID,
         text,
-        message_thread_id=message_thread_id,
-        reply_markup=reply_markup
+        message_thread_id=get_message_thread_id(board_id),
+        reply_markup=reply_markup,
+        card_id=card_id,
     )
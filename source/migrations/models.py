@@ -2,7 +2,7 @@ from source.db.db import Base
 
 from sqlalchemy import (
     Column, Integer, BigInteger, String, Text,
-    DateTime, TIMESTAMP, ForeignKey, Boolean, UniqueConstraint
+    DateTime, TIMESTAMP, ForeignKey, Boolean, UniqueConstraint, Index
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -56,6 +56,11 @@ class Task(Base):
     attachments = relationship("TaskAttachment", back_populates="task", cascade="all, delete-orphan")
     comments = relationship("TaskComment", back_populates="task", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Кандидаты на напоминания: done IS NULL AND duedate <= ...
+        Index('ix_tasks_done_duedate', 'done', 'duedate'),
+    )
+
 
 class TaskAssignee(Base):
     __tablename__ = "task_assignees"
@@ -91,6 +96,11 @@ class DeadlineReminder(Base):
 
     task = relationship("Task", back_populates="reminders")
 
+    __table_args__ = (
+        # Одна запись на пару: повторная отметка обновляет её (mark_sent_batch)
+        UniqueConstraint('card_id', 'login', name='uq_deadline_reminders_pair'),
+    )
+
 class BoardLogTopic(Base):
     __tablename__ = "board_log_topics"
 
@@ -151,4 +161,70 @@ class CalDavSendData(Base):
 
     __table_args__ = (
         UniqueConstraint('event_name', 'tg_id', 'cooldown', name='_event_tg_uc'),
-    )
\ No newline at end of file
+    )
+
+
+class AttachmentShare(Base):
+    __tablename__ = "attachment_shares"
+
+    file_id = Column(BigInteger, primary_key=True)
+    url = Column(Text, nullable=False)
+
+    created_at = Column(
+        TIMESTAMP,
+        nullable=False,
+        server_default=func.current_timestamp()
+    )
+
+
+class OutboxMessage(Base):
+    __tablename__ = "outbox_messages"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    chat_id = Column(BigInteger, nullable=False)
+    text = Column(Text, nullable=False)
+    # JSON с параметрами send_message (message_thread_id, reply_markup, ...)
+    options = Column(Text, nullable=True)
+
+    # pending — ждёт отправки, sending — взято воркером, failed — не доставлено
+    status = Column(String(16), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+
+    created_at = Column(
+        TIMESTAMP,
+        nullable=False,
+        server_default=func.current_timestamp()
+    )
+
+    __table_args__ = (
+        Index('ix_outbox_status_id', 'status', 'id'),
+    )
+
+
+class PendingCardChange(Base):
+    __tablename__ = "pending_card_changes"
+
+    # Изменения карточки, ждущие окна объединения (ChangeCoalescer): состояние до первого изменения
+    card_id = Column(Integer, primary_key=True)
+    board_id = Column(Integer, nullable=False)
+    stack_id = Column(Integer, nullable=False)
+    stack_title = Column(String(100), nullable=False)
+    title = Column(String(255), nullable=False)
+    description = Column(Text, nullable=False)
+    duedate = Column(DateTime, nullable=True)
+    # Первое и последнее изменение в окне (UTC) и сколько опросов их увидели
+    first_at = Column(DateTime, nullable=False)
+    last_at = Column(DateTime, nullable=False)
+    polls = Column(Integer, nullable=False, default=1)
+
+
+class CardMessage(Base):
+    __tablename__ = "card_messages"
+
+    # Последнее сообщение об изменениях карточки в чате — его редактируем вместо нового
+    chat_id = Column(BigInteger, primary_key=True)
+    card_id = Column(Integer, primary_key=True)
+    message_id = Column(BigInteger, nullable=False)
+    sent_at = Column(DateTime, nullable=False)
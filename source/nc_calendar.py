@@ -1,6 +1,7 @@
-from source.config import WEB_CALDAV_URL, USERNAME, PASSWORD, COOLDOWN_TUESDAY, COOLDOWN_SUNDAY, COOLDOWN_DEFAULT, \
+from source.config import WEB_CALDAV_URL, USERNAME, COOLDOWN_TUESDAY, COOLDOWN_SUNDAY, COOLDOWN_DEFAULT, \
     POLL_INTERVAL, WEB_APP_URL, UPDATE_INTERVAL, TIMEZONE, CALDAV_USERNAME, CALDAV_PASSWORD, CALDAV_COOLDOWNS, TIMEZONES
-from source.connections.sender import send_message_limited
+from source.connections.outbox import wake_outbox
+from source.db.repos.outbox import outbox_message
 from source.db.repos.users import get_tg_id_by_email, save_email_by_username, get_timezone
 from source.app_logging import logger
 from source.db.repos.caldav_calendar import get_events_from_db, save_event_sends, delete_event_sends, get_id_by_name
@@ -13,7 +14,7 @@ from datetime import datetime, timedelta, timezone, time, date
 from time import sleep
 from zoneinfo import ZoneInfo
 
-import requests
+from source.connections.nextcloud_client import nc_get
 
 try:
     TEAM_TZ = ZoneInfo(TIMEZONE)
@@ -216,13 +217,12 @@ def sync_nextcloud_users():
         "Accept": "application/json"
     }
 
-    auth = (USERNAME, PASSWORD)
     while True:
         logger.info(f"NEXTCLOUD: Начинаю синхронизацию пользователей (частота {UPDATE_INTERVAL} дней)...")
         try:
 
             users_endpoint = f"{WEB_APP_URL}/ocs/v1.php/cloud/users?limit=1000"
-            response = requests.get(users_endpoint, headers=headers, auth=auth)
+            response = nc_get(users_endpoint, headers=headers)
 
             if response.status_code != 200:
                 logger.error(
@@ -238,7 +238,7 @@ def sync_nextcloud_users():
             updated_count = 0
             for uid in user_ids:
                 detail_endpoint = f"{WEB_APP_URL}/ocs/v1.php/cloud/users/{uid}"
-                detail_res = requests.get(detail_endpoint, headers=headers, auth=auth)
+                detail_res = nc_get(detail_endpoint, headers=headers)
                 detail_res.raise_for_status()
                 if detail_res.status_code == 200:
                     user_data = detail_res.json().get('ocs', {}).get('data', {})
@@ -771,8 +771,9 @@ def poll_events():
                                                 markup.row(btn_accept, btn_update, btn_decline)
                                             else:
                                                 markup.row(btn_update)
-                                        send_message_limited(teg_id, res, reply_markup=markup)
-                                        save_event_sends(name_for_send, teg_id, now_cooldown_send, event_uid, event_url)
+                                        save_event_sends(name_for_send, teg_id, now_cooldown_send, event_uid, event_url,
+                                                         message=outbox_message(teg_id, res, reply_markup=markup))
+                                        wake_outbox()
 
                 except Exception as e:
                     logger.exception(f"CALDAV: ой {e}")
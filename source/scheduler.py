@@ -6,21 +6,21 @@ from datetime import datetime, timezone, timedelta
 from collections import Counter
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 
-from source.config import POLL_INTERVAL, EXCLUDED_CARD_IDS, ARCHIVE_AFTER_DAYS, TIMEZONES
-from source.connections.sender import send_message_limited
-from source.connections.nextcloud_api import fetch_all_tasks, in_done_stack, archive_card, get_url_attachment
+from source.config import POLL_INTERVAL, EXCLUDED_CARD_IDS, ARCHIVE_AFTER_DAYS, TIMEZONES, CHANGE_COALESCE_WINDOW
+from source.cards import Card
+from source.change_coalescer import ChangeCoalescer
+from source.connections.outbox import wake_outbox
+from source.deadlines import notify_deadline_changes
+from source.connections.nextcloud_api import iter_board_tasks, in_done_stack, archive_card, get_url_attachments
 from source.db.repos.users import get_user_map, get_timezone
 from source.db.repos.tasks import (
-    get_saved_tasks, save_task_to_db, update_task_in_db,
-    get_task_assignees, save_task_assignee, delete_task_assignee,
-    get_task_stats_map, upsert_task_stats,
-    get_task_labels, save_task_label, delete_task_label,
-    get_task_attachments, save_task_attachment, delete_task_attachment,
-    get_task_comments, save_task_comment, delete_task_comment,
-    delete_task_full
+    get_saved_tasks,
+    TaskChangeSet, apply_task_changes,
 )
 from source.app_logging import logger, is_debug
-from source.logging_service import send_log
+from source.logging_service import log_message
+from source.db.repos.outbox import outbox_message
+from source.db.repos.pending_changes import get_pending_changes, delete_pending_changes
 from source.links import card_url
 
 def format_to_timezone(dt: datetime, tz: int) -> str:
@@ -125,352 +125,439 @@ def _to_hashtag(text: str) -> str | None:
     return f'#{clean_text}'
 
 
+# В режиме отладки уведомления об изменениях уходят сразу
+_coalescer = ChangeCoalescer(0 if is_debug() else CHANGE_COALESCE_WINDOW)
+
+
+def _pending_row(card_id: int, pending) -> dict:
+    """Строка pending_card_changes: изменения переживают перезапуск бота."""
+    first_age, last_age = _coalescer.age(pending)
+    now = datetime.utcnow()
+    baseline = pending.baseline
+    return {
+        "card_id": card_id,
+        "board_id": baseline.board_id,
+        "stack_id": baseline.stack_id,
+        "stack_title": baseline.stack_title,
+        "title": baseline.title,
+        "description": baseline.description or "",
+        "duedate": baseline.duedate,
+        "first_at": now - timedelta(seconds=first_age),
+        "last_at": now - timedelta(seconds=last_age),
+        "polls": pending.polls,
+    }
+
+
+def _restore_pending_changes() -> None:
+    """Поднимает изменения карточек, ждавшие окна объединения до перезапуска."""
+    now = datetime.utcnow()
+    rows = get_pending_changes()
+    for baseline, first_at, last_at, polls in rows:
+        _coalescer.restore(
+            baseline.card_id, baseline,
+            (now - first_at).total_seconds(), (now - last_at).total_seconds(), polls,
+        )
+    if rows:
+        logger.info(f"CLOUD: восстановлены отложенные уведомления об изменениях {len(rows)} карточек")
+
+
+def _format_due(value, tz: int) -> str:
+    """Дедлайн в указанном UTC-сдвиге или «—»."""
+    if not value:
+        return "—"
+    if isinstance(value, datetime):
+        return format_to_timezone(value, tz=tz)
+    return str(value)
+
+
+def _card_changes(old: Card, new: Card) -> list:
+    """
+    Различия двух состояний карточки для уведомления «Изменения в карточке».
+    Смена дедлайна — пара (было, стало): она форматируется в часовом поясе получателя.
+    """
+    MSK = timezone(timedelta(hours=3))
+    UTC = timezone.utc
+    card_changes = []
+    if old.stack_id != new.stack_id:
+        card_changes.append(f"Колонка: *{old.stack_title}* → *{new.stack_title}*")
+    od = old.duedate.replace(tzinfo=UTC).astimezone(MSK).strftime("%y-%m-%d %H:%M") if old.duedate else None
+    nd = new.duedate.replace(tzinfo=UTC).astimezone(MSK).strftime("%y-%m-%d %H:%M") if new.duedate else None
+    if od != nd:
+        card_changes.append((old.duedate, new.duedate))
+    if old.title != new.title:
+        card_changes.append(f"Заголовок: `{old.title}` → `{new.title}`")
+    if old.description != new.description:
+        text = change_description(old.description or "", new.description or "")
+        card_changes.append(f"Описание изменилось: \n{text}")
+    return card_changes
+
+
+def _render_changes(card_changes: list, tz: int) -> str:
+    return "\n".join(
+        f"Due: `{_format_due(change[0], tz)}` → `{_format_due(change[1], tz)}`"
+        if isinstance(change, tuple) else change
+        for change in card_changes
+    )
+
+
+def _queue_change_messages(item: Card, card_changes: list, tg_ids: list, changes: TaskChangeSet) -> None:
+    """Ставит уведомления «Изменения в карточке» назначенным и в лог доски."""
+    cid_link = f'<a href="{card_url(item.board_id, item.card_id)}">{item.card_id}</a>'
+    kb = InlineKeyboardMarkup()
+    kb.add(InlineKeyboardButton(text="Открыть на клауде", url=card_url(item.board_id, item.card_id)))
+    for tg_id in tg_ids:
+        changes.messages.append(outbox_message(
+            tg_id,
+            f"✏️ *Изменения в карточке* «{item.title}» (ID {cid_link}):\n"
+            + _render_changes(card_changes, get_timezone(tg_id)),
+            reply_markup=kb,
+            card_id=item.card_id,
+        ))
+    changes.messages.append(log_message(
+        f"✏️ *Изменения в карточке* «{item.title}»:\n" + _render_changes(card_changes, 3),
+        board_id=item.board_id,
+        reply_markup=kb,
+        card_id=item.card_id,
+    ))
+
+
+def _new_attachment_paths(cards, saved_tasks, snapshot) -> dict:
+    """Новые вложения карточек, о которых уйдёт уведомление: { file_id: path }."""
+    paths = {}
+    for item in cards:
+        saved = saved_tasks.get(item.card_id)
+        if not saved or (item.etag is not None and saved.etag == item.etag) or not _should_notify(item.card_id):
+            continue
+        state = snapshot.get(item.card_id) or {}
+        if int(item.attachments_count) == int(state.get('attachments_count') or 0):
+            continue
+        known = state.get('attachments') or set()
+        for att in item.attachments_data or []:
+            if att['file_id'] not in known:
+                paths[att['file_id']] = att['path']
+    return paths
+
+
+def _reconcile_cards(cards, saved_tasks, snapshot, login_map, changes: TaskChangeSet) -> bool:
+    """
+    Сравнивает карточки из Nextcloud с сохранённым состоянием.
+    Изменения БД и уведомления накапливаются в changes: уведомления попадают
+    в outbox в той же транзакции, что и изменения карточек.
+    Состояние карточек сохраняется сразу, а уведомления об изменениях полей
+    объединяются за окно CHANGE_COALESCE_WINDOW (см. ChangeCoalescer); ждущие
+    окна изменения сохраняются в той же транзакции (pending_card_changes).
+    Возвращает True, если найдены изменения.
+    """
+    archive_threshold = timedelta(days=ARCHIVE_AFTER_DAYS)
+    changes_flag = False
+    # Ссылки на новые вложения всех карточек — одним вызовом: недостающие создаются параллельно
+    share_urls = get_url_attachments(_new_attachment_paths(cards, saved_tasks, snapshot))
+
+    for item in cards:
+        card_changes = []
+        card_id = item.card_id
+
+        new_comments = int(item.comments_count)
+        new_attachments = int(item.attachments_count)
+
+        saved = saved_tasks.get(card_id)
+        state = snapshot.get(card_id) or {}
+
+        etag_new = item.etag
+        etag_old = saved.etag if saved else None
+        etag_same = bool(saved and (etag_new is not None) and (etag_old == etag_new))
+
+        need_mig_update = bool(
+            saved and (saved.prev_stack_id is None) and (saved.next_stack_id is None)
+        )
+
+        # === БД-операции выполняются ВСЕГДА, независимо от исключений ===
+        if not saved:
+            changes_flag = True
+            changes.tasks[card_id] = item.task_row()
+            changes.stats[card_id] = (new_comments, new_attachments)
+        elif not etag_same:
+            if item.done and item.next_stack_id is not None:
+                info = in_done_stack(item)
+                if info is not None:
+                    item.stack_title, item.stack_id = info
+                    item.prev_stack_id, item.next_stack_id = None, None
+                    item.prev_stack_title, item.next_stack_title = None, None
+            card_changes = _card_changes(saved, item)
+
+            if card_changes or (etag_old is None) or (etag_new is None) or need_mig_update:
+                changes_flag = True
+                changes.tasks[card_id] = item.task_row()
+            if card_changes:
+                # Уведомление уйдёт, когда окно объединения закроется (ниже)
+                changes.pending_changes[card_id] = _pending_row(card_id, _coalescer.record(card_id, saved))
+
+            old_comments_count = state.get('comments_count')
+            old_attachments_count = state.get('attachments_count')
+            inc_comments = new_comments - int(old_comments_count or 0)
+            inc_attachments = new_attachments - int(old_attachments_count or 0)
+
+            # === Уведомления о комментариях/вложениях ТОЛЬКО если не в исключениях ===
+            if _should_notify(card_id):
+
+                # РАБОТА С КОММЕНТАРИЯМИ И ВЛОЖЕНИЯМИ ТУТ
+                if inc_attachments != 0:
+                    attachments_data = item.attachments_data or []
+
+                    id_to_path_map = {att['file_id']: att['path'] for att in attachments_data}
+
+                    attachments_api = set(id_to_path_map.keys())
+                    attachments_db = state.get('attachments') or set()
+                    news_attachments = attachments_api - attachments_db
+                    old_attachments = attachments_db - attachments_api
+                    for file_id in old_attachments:
+                        changes.attachments_del.add((card_id, file_id))
+
+                    url_attachment = []
+                    count_media = 1
+                    for file_id in news_attachments:
+                        url = share_urls.get(file_id)
+                        if url is not None:
+                            url_attachment.append(f'<a href="{url}/preview">медиа {count_media}</a>')
+                            count_media += 1
+                        changes.attachments_add.add((card_id, file_id))
+
+                    url_text = ' | '.join(url_attachment)
+
+                if inc_comments != 0:
+                    comments_data = item.comments_data or []
+                    id_to_info_map = {comm['comment_id']: {'author': comm['author'], 'message': comm['message']} for comm in comments_data}
+                    comments_api = set(id_to_info_map.keys())
+                    comments_db = state.get('comments') or set()
+                    news_comments = comments_api - comments_db
+                    old_comments = comments_db - comments_api
+                    for comment_id in old_comments:
+                        changes.comments_del.add((card_id, comment_id))
+
+                    comment_text = '\\\\\\'
+                    list(news_comments).sort()
+                    for comment_id in news_comments:
+                        data = id_to_info_map.get(comment_id)
+                        if data is not None:
+                            comment_text += f"*{data.get('author')}:* {data.get('message')}\n"
+                        changes.comments_add.add((card_id, comment_id))
+
+                    if comment_text[-1] == '\n': comment_text = comment_text[:-1]
+                    comment_text += "///\n"
+
+                kb = InlineKeyboardMarkup()
+                kb.add(InlineKeyboardButton(text="Открыть на клауде", url=card_url(item.board_id, card_id)))
+                if inc_comments > 0:
+                    changes.messages.append(log_message(
+                        "💬 Новые комментарии:" + "\n"
+                                                  f"{inc_comments} в «{item.title}»\n{comment_text}",
+                        board_id=item.board_id,
+                        reply_markup=kb,
+                    ))
+                elif inc_comments < 0:
+                    changes.messages.append(log_message(
+                        "🗑 Удалены комментарии: " + "\n"
+                                                     f"{-inc_comments} в «{item.title}»",
+                        board_id=item.board_id,
+                        reply_markup=kb,
+                    ))
+
+                if inc_attachments > 0:
+                    changes.messages.append(log_message(
+                        "📎 Новые вложения:" + "\n"
+                                               f"{inc_attachments} в «{item.title}»\n{url_text}",
+                        board_id=item.board_id,
+                        reply_markup=kb,
+                    ))
+                elif inc_attachments < 0:
+                    changes.messages.append(log_message(
+                        "🗑 Удалены вложения: " + "\n"
+                                                  f" {-inc_attachments} в «{item.title}»",
+                        board_id=item.board_id,
+                        reply_markup=kb,
+                    ))
+
+            if (inc_comments != 0) or (inc_attachments != 0) or (old_comments_count is None):
+                changes.stats[card_id] = (new_comments, new_attachments)
+        elif need_mig_update:
+            row = item.task_row()
+            if row != saved.task_row():
+                changes.tasks[card_id] = row
+
+        # labels
+        labels_api = set(item.labels)
+        labels_db = state.get('labels') or set()
+        for label in labels_db - labels_api:
+            changes.labels_del.add((card_id, label))
+        for label in labels_api - labels_db:
+            changes.labels_add.add((card_id, label))
+
+        # === Работа с назначенными (БД) — всегда ===
+        assigned_logins_db = state.get('assignees') or set()
+        assigned_logins_api = set(item.assigned_logins)
+        new_assignees = assigned_logins_api - assigned_logins_db
+        old_assignees = assigned_logins_db - assigned_logins_api
+
+        for login in old_assignees:
+            changes.assignees_del.add((card_id, login))
+
+        for login in new_assignees:
+            changes.assignees_add.add((card_id, login))
+
+        tg_ids = [login_map[login] for login in assigned_logins_api if login in login_map]
+
+        # === Уведомления новым назначенным ТОЛЬКО если не в исключениях ===
+        if _should_notify(card_id):
+            for login in new_assignees:
+                tg_id = login_map.get(login)
+                if tg_id:
+                    kb = InlineKeyboardMarkup()
+                    prev_stack_id = item.prev_stack_id
+                    next_stack_id = item.next_stack_id
+                    if prev_stack_id is not None:
+                        kb.add(InlineKeyboardButton(
+                            text=f"⬅ {item.prev_stack_title}",
+                            callback_data=f"move:{item.board_id}:{item.stack_id}:{card_id}:{prev_stack_id}"
+                        ))
+                    if next_stack_id is not None:
+                        kb.add(InlineKeyboardButton(
+                            text=f"➡ {item.next_stack_title}",
+                            callback_data=f"move:{item.board_id}:{item.stack_id}:{card_id}:{next_stack_id}"
+                        ))
+
+                    duedat_str = _format_due(item.duedate, get_timezone(tg_id))
+
+                    user_msg = (
+                        f"🆕 Новая задача: *{item.title}*\n"
+                        f"Labels: {''.join(f'[{_to_hashtag(lab)}]' for lab in item.labels) or '—'}\n"
+                        f"Board: {item.board_title}\n"
+                        f"Column: {item.stack_title}\n"
+                        f"Due: {duedat_str}\n"
+                        f"Description: \n\\\\\\{item.description or '—'}///"
+                    )
+                    kb.add(
+                        InlineKeyboardButton(text="Открыть на клауде", url=card_url(item.board_id, card_id)))
+                    changes.messages.append(outbox_message(
+                        tg_id,
+                        user_msg,
+                        reply_markup=kb,
+                    ))
+
+        # === Уведомление о новой задаче в лог ТОЛЬКО если не в исключениях ===
+        if not saved and _should_notify(card_id):
+            kb = InlineKeyboardMarkup()
+            kb.add(InlineKeyboardButton(text="Открыть на клауде", url=card_url(item.board_id, card_id)))
+            changes.messages.append(log_message(
+                f"🆕 *Новая задача*: {item.title}\n"
+                f"Labels: {''.join(f'[{_to_hashtag(lab)}]' for lab in item.labels) or '—'}\n"
+                f"Board: {item.board_title}\n"
+                f"Column: {item.stack_title}\n"
+                f"Due: {item.duedate or '—'}\n"
+                f"Description: \n\\\\\\{item.description or '—'}///",
+                board_id=item.board_id,
+                reply_markup=kb,
+            ))
+
+        # === Уведомления об изменениях (итог за окно объединения) ТОЛЬКО если не в исключениях ===
+        # Забывается после фиксации транзакции доски (см. poll_new_tasks)
+        pending = _coalescer.due(card_id)
+        if pending is not None:
+            changes.coalesced.add(card_id)
+            changes.pending_changes.pop(card_id, None)
+        if pending is not None and _should_notify(card_id):
+            # Сравниваем с тем, что сохранено в БД: в неизменившейся карточке из API
+            # колонка «готово» ещё не поправлена
+            current = item if card_id in changes.tasks or saved is None else saved
+            net_changes = _card_changes(pending.baseline, current)
+            if net_changes:
+                _queue_change_messages(current, net_changes, tg_ids, changes)
+            if pending.polls > 1:
+                logger.info(
+                    f"CLOUD: изменения карточки {card_id} за {pending.polls} опроса(ов) объединены "
+                    f"в {'одно уведомление' if net_changes else 'ничего (итог совпал с исходным)'}"
+                )
+
+        # === Автоархивация: готова более ARCHIVE_AFTER_DAYS дней ===
+        done_ts = item.done
+        if done_ts is not None and ARCHIVE_AFTER_DAYS > 0:
+            done_utc = done_ts.replace(tzinfo=timezone.utc) if done_ts.tzinfo is None else done_ts
+            now_utc = datetime.now(timezone.utc)
+            if (now_utc - done_utc) > archive_threshold:
+                if archive_card(item.board_id, item.stack_id, card_id):
+                    days_done = (now_utc - done_utc).days
+                    logger.info(
+                        f"CLOUD: карточка «{item.title}» (ID {card_id}) "
+                        f"архивирована автоматически "
+                        f"(готова {days_done} дн.)"
+                    )
+                    changes.deleted_cards.add(card_id)
+
+    return changes_flag
+
+
 def poll_new_tasks():
     """
     Фоновый процесс:
     - получает все задачи из Nextcloud
     - сравнивает с БД
     - определяет новые и изменённые карточки
-    - отправляет уведомления (кроме исключённых)
+    - обрабатывает доски по мере загрузки, фиксируя изменения
+      каждой доски одной транзакцией
+    - ставит уведомления (кроме исключённых) в outbox — их отправляют
+      воркеры outbox, опрос не ждёт Telegram
     - обновляет статистику комментариев и вложений
     - архивирует карточки, готовые более ARCHIVE_AFTER_DAYS дней
     """
     logger.info(f"CLOUD: Запускается фоновый опрос задач, частота: {POLL_INTERVAL} секунд!")
-    MSK = timezone(timedelta(hours=3))
-    archive_threshold = timedelta(days=ARCHIVE_AFTER_DAYS)
+    restored = False
     while True:
         try:
+            if not restored:
+                _restore_pending_changes()
+                restored = True
             logger.info(f"CLOUD: Начинается плановое получение задач")
             changes_flag = False
+            seen_cards = set()
+            fetched_boards = set()
             login_map = get_user_map()
-            all_cards = fetch_all_tasks()
-            saved_tasks = get_saved_tasks()
-            stats_map = get_task_stats_map()
-
-            for item in all_cards:
-                changes = []
-                card_id = item.get('card_id')
-                board_id = item.get('board_id')
-                cid_link = f'<a href="{card_url(item.get("board_id"), card_id)}">{card_id}</a>'
-
-                new_comments = int(item.get('comments_count', 0))
-                new_attachments = int(item.get('attachments_count', 0))
-
-                saved = saved_tasks.get(card_id)
-
-                etag_new = item.get('etag')
-                etag_old = saved.get('etag') if saved else None
-                etag_same = bool(saved and (etag_new is not None) and (etag_old == etag_new))
 
-                need_mig_update = bool(
-                    saved and (saved.get('prev_stack_id') is None) and (saved.get('next_stack_id') is None)
-                )
-
-                if is_debug():
-                    need_cooldown = False
-                else:
-                    need_cooldown = item['lastModified'] < POLL_INTERVAL
-
-                if need_cooldown:
-                    continue
-
-                # === БД-операции выполняются ВСЕГДА, независимо от исключений ===
-                if not saved:
+            # Доски обрабатываются по мере загрузки: изменения каждой доски
+            # фиксируются сразу, и сбой на следующей доске их не отменяет.
+            # Сохранённое состояние загружается по доске — только её карточки
+            for board, cards, snapshot in iter_board_tasks():
+                changes = TaskChangeSet()
+                saved_tasks = get_saved_tasks(card.card_id for card in cards)
+                seen_cards.update(card.card_id for card in cards)
+                fetched_boards.add(board['id'])
+                if _reconcile_cards(cards, saved_tasks, snapshot, login_map, changes):
                     changes_flag = True
-                    save_task_to_db(
-                        card_id, item['title'], item['description'],
-                        item['board_id'], item['board_title'],
-                        item['stack_id'], item['stack_title'],
-                        item.get('prev_stack_id'), item.get('prev_stack_title'),
-                        item.get('next_stack_id'), item.get('next_stack_title'),
-                        item.get('duedate'), item.get('done'), etag_new
-                    )
-                    upsert_task_stats(card_id, new_comments, new_attachments)
-                    stats_map[card_id] = {
-                        "comments_count": new_comments,
-                        "attachments_count": new_attachments
-                    }
-                elif not etag_same:
-                    if item['done'] and item['next_stack_id'] is not None:
-                        info = in_done_stack(item)
-                        if info is not None:
-                            item['stack_title'], item['stack_id'] = info
-                            item['prev_stack_id'], item['next_stack_id'], item['prev_stack_title'], item[
-                                'next_stack_title'] = None, None, None, None
-                    if saved['stack_id'] != item['stack_id']:
-                        changes.append(f"Колонка: *{saved['stack_title']}* → *{item['stack_title']}*")
-                    UTC = timezone.utc
-                    od = saved['duedate'].replace(tzinfo=UTC).astimezone(MSK).strftime("%y-%m-%d %H:%M") if saved[
-                        'duedate'] else None
-                    nd = item['duedate'].replace(tzinfo=UTC).astimezone(MSK).strftime("%y-%m-%d %H:%M") if item[
-                        'duedate'] else None
-                    if od != nd:
-                        changes.append([saved['duedate'], item['duedate']])
-                    if saved['title'] != item['title']:
-                        changes.append(f"Заголовок: `{saved['title']}` → `{item['title']}`")
-                    if saved['description'] != item['description']:
-                        text = change_description(saved['description'], item['description'])
-                        changes.append(f"Описание изменилось: \n{text}")
-
-                    if changes or (etag_old is None) or (etag_new is None) or need_mig_update:
-                        changes_flag = True
-                        update_task_in_db(
-                            card_id, item['title'], item['description'],
-                            item['board_id'], item['board_title'],
-                            item['stack_id'], item['stack_title'],
-                            item.get('prev_stack_id'), item.get('prev_stack_title'),
-                            item.get('next_stack_id'), item.get('next_stack_title'),
-                            item.get('duedate'), item.get('done'), etag_new
-                        )
-
-                    old_stats = stats_map.get(card_id, {"comments_count": 0, "attachments_count": 0})
-                    inc_comments = new_comments - int(old_stats.get('comments_count', 0))
-                    inc_attachments = new_attachments - int(old_stats.get('attachments_count', 0))
-
-                    # === Уведомления о комментариях/вложениях ТОЛЬКО если не в исключениях ===
-                    if _should_notify(card_id):
-
-                        # РАБОТА С КОММЕНТАРИЯМИ И ВЛОЖЕНИЯМИ ТУТ
-                        if inc_attachments != 0:
-                            attachments_data = item.get('attachments_data') or []
-
-                            id_to_path_map = {att['file_id']: att['path'] for att in attachments_data}
-
-                            attachments_api = set(id_to_path_map.keys())
-                            attachments_db = get_task_attachments(card_id)
-                            news_attachments = attachments_api - attachments_db
-                            old_attachments = attachments_db - attachments_api
-                            for file_id in old_attachments:
-                                delete_task_attachment(card_id, file_id)
-
-                            url_attachment = []
-                            count_media = 1
-                            for file_id in news_attachments:
-                                url = get_url_attachment(id_to_path_map.get(file_id))
-                                if url is not None:
-                                    url_attachment.append(f'<a href="{url}/preview">медиа {count_media}</a>')
-                                    count_media += 1
-                                save_task_attachment(card_id, file_id)
-
-                            url_text = ' | '.join(url_attachment)
-
-                        if inc_comments != 0:
-                            comments_data = item.get('comments_data') or []
-                            id_to_info_map = {comm['comment_id']: {'author': comm['author'], 'message': comm['message']} for comm in comments_data}
-                            comments_api = set(id_to_info_map.keys())
-                            comments_db = get_task_comments(card_id)
-                            news_comments = comments_api - comments_db
-                            old_comments = comments_db - comments_api
-                            for comment_id in old_comments:
-                                delete_task_comment(card_id, comment_id)
-
-                            comment_text = '\\\\\\'
-                            list(news_comments).sort()
-                            for comment_id in news_comments:
-                                data = id_to_info_map.get(comment_id)
-                                if data is not None:
-                                    comment_text += f"*{data.get('author')}:* {data.get('message')}\n"
-                                save_task_comment(card_id, comment_id)
-
-                            if comment_text[-1] == '\n': comment_text = comment_text[:-1]
-                            comment_text += "///\n"
-
-                        kb = InlineKeyboardMarkup()
-                        kb.add(InlineKeyboardButton(text="Открыть на клауде", url=card_url(item["board_id"], card_id)))
-                        if inc_comments > 0:
-                            send_log(
-                                "💬 Новые комментарии:" + "\n"
-                                                          f"{inc_comments} в «{item['title']}»\n{comment_text}",
-                                board_id=item['board_id'],
-                                reply_markup=kb,
-                            )
-                        elif inc_comments < 0:
-                            send_log(
-                                "🗑 Удалены комментарии: " + "\n"
-                                                             f"{-inc_comments} в «{item['title']}»",
-                                board_id=item['board_id'],
-                                reply_markup=kb,
-                            )
-
-                        if inc_attachments > 0:
-                            send_log(
-                                "📎 Новые вложения:" + "\n"
-                                                       f"{inc_attachments} в «{item['title']}»\n{url_text}",
-                                board_id=item['board_id'],
-                                reply_markup=kb,
-                            )
-                        elif inc_attachments < 0:
-                            send_log(
-                                "🗑 Удалены вложения: " + "\n"
-                                                          f" {-inc_attachments} в «{item['title']}»",
-                                board_id=item['board_id'],
-                                reply_markup=kb,
-                            )
-
-                    if (inc_comments != 0) or (inc_attachments != 0) or (card_id not in stats_map):
-                        upsert_task_stats(card_id, new_comments, new_attachments)
-                        stats_map[card_id] = {"comments_count": new_comments, "attachments_count": new_attachments}
-                elif need_mig_update:
-                    update_task_in_db(
-                        card_id, item['title'], item['description'],
-                        item['board_id'], item['board_title'],
-                        item['stack_id'], item['stack_title'],
-                        item.get('prev_stack_id'), item.get('prev_stack_title'),
-                        item.get('next_stack_id'), item.get('next_stack_title'),
-                        item.get('duedate'), item.get('done'), etag_new
-                    )
 
-                # labels
-                labels_api = set(item.get('labels', []))
-                labels_db = get_task_labels(card_id)
-                new_labels = labels_api - labels_db
-                old_labels = labels_db - labels_api
-                for label in old_labels:
-                    delete_task_label(card_id, label)
-
-                for label in new_labels:
-                    save_task_label(card_id, label)
-
-                # === Работа с назначенными (БД) — всегда ===
-                assigned_logins_db = get_task_assignees(card_id)
-                assigned_logins_api = set(item.get('assigned_logins', []))
-                new_assignees = assigned_logins_api - assigned_logins_db
-                old_assignees = assigned_logins_db - assigned_logins_api
-
-                for login in old_assignees:
-                    delete_task_assignee(card_id, login)
-
-                for login in new_assignees:
-                    save_task_assignee(card_id, login)
-
-                tg_ids = [login_map[login] for login in assigned_logins_api if login in login_map]
-
-                # === Уведомления новым назначенным ТОЛЬКО если не в исключениях ===
-                if _should_notify(card_id):
-                    for login in new_assignees:
-                        tg_id = login_map.get(login)
-                        if tg_id:
-                            kb = InlineKeyboardMarkup()
-                            prev_stack_id = item.get('prev_stack_id')
-                            next_stack_id = item.get('next_stack_id')
-                            if prev_stack_id is not None:
-                                kb.add(InlineKeyboardButton(
-                                    text=f"⬅ {item.get('prev_stack_title')}",
-                                    callback_data=f"move:{item['board_id']}:{item['stack_id']}:{card_id}:{prev_stack_id}"
-                                ))
-                            if next_stack_id is not None:
-                                kb.add(InlineKeyboardButton(
-                                    text=f"➡ {item.get('next_stack_title')}",
-                                    callback_data=f"move:{item['board_id']}:{item['stack_id']}:{card_id}:{next_stack_id}"
-                                ))
-
-                            need_zone = get_timezone(tg_id)
-                            duedat = item['duedate'].dt if item['duedate'] else "—"
-                            if isinstance(duedat, datetime):
-                                duedat_str = format_to_timezone(duedat, tz=need_zone) if duedat else "—"
-                            else:
-                                duedat_str = str(duedat)
-
-                            user_msg = (
-                                f"🆕 Новая задача: *{item['title']}*\n"
-                                f"Labels: {''.join(f'[{_to_hashtag(lab)}]' for lab in item['labels']) or '—'}\n"
-                                f"Board: {item['board_title']}\n"
-                                f"Column: {item['stack_title']}\n"
-                                f"Due: {duedat_str}\n"
-                                f"Description: \n\\\\\\{item['description'] or '—'}///"
-                            )
-                            kb.add(
-                                InlineKeyboardButton(text="Открыть на клауде", url=card_url(item["board_id"], card_id)))
-                            send_message_limited(
-                                tg_id,
-                                user_msg,
-                                reply_markup=kb,
-                            )
-
-                # === Уведомление о новой задаче в лог ТОЛЬКО если не в исключениях ===
-                if not saved and _should_notify(card_id):
-                    kb = InlineKeyboardMarkup()
-                    kb.add(InlineKeyboardButton(text="Открыть на клауде", url=card_url(item["board_id"], card_id)))
-                    send_log(
-                        f"🆕 *Новая задача*: {item['title']}\n"
-                        f"Labels: {''.join(f'[{_to_hashtag(lab)}]' for lab in item['labels']) or '—'}\n"
-                        f"Board: {item['board_title']}\n"
-                        f"Column: {item['stack_title']}\n"
-                        f"Due: {item['duedate'] or '—'}\n"
-                        f"Description: \n\\\\\\{item['description'] or '—'}///",
-                        board_id=item['board_id'],
-                        reply_markup=kb,
-                    )
-                # === Уведомления об изменениях ТОЛЬКО если не в исключениях ===
-                elif saved and changes and _should_notify(card_id):
-                    kb = InlineKeyboardMarkup()
-                    kb.add(InlineKeyboardButton(text="Открыть на клауде", url=card_url(item["board_id"], card_id)))
-                    for tg_id in tg_ids:
-                        need_zone = get_timezone(tg_id)
-                        for i in range(len(changes)):
-                            if isinstance(changes[i], list):
-                                od = changes[i][0].dt if changes[i][0] else "—"
-                                if isinstance(od, datetime):
-                                    od = format_to_timezone(od, tz=need_zone) if od else "—"
-                                else:
-                                    od = str(od)
-
-                                nd = changes[i][1].dt if changes[i][1] else "—"
-                                if isinstance(nd, datetime):
-                                    nd = format_to_timezone(nd, tz=need_zone) if nd else "—"
-                                else:
-                                    nd = str(nd)
-                                changes[i] = f"Due: `{od or '—'}` → `{nd or '—'}`"
-                        send_message_limited(
-                            tg_id,
-                            f"✏️ *Изменения в карточке* «{item['title']}» (ID {cid_link}):\n" + "\n".join(changes),
-                            reply_markup=kb,
+                try:
+                    apply_task_changes(changes)
+                except Exception as e:
+                    logger.error(f"CLOUD: не удалось сохранить изменения доски {board['id']} — {e}")
+                    if changes.deleted_cards:
+                        logger.error(
+                            f"CLOUD: не удалось удалить карточки {sorted(changes.deleted_cards)} "
+                            f"из БД после архивации"
                         )
-
-                    for i in range(len(changes)):
-                        if isinstance(changes[i], list):
-                            od = changes[i][0].dt if changes[i][0] else "—"
-                            if isinstance(od, datetime):
-                                od = format_to_timezone(od, tz=3) if od else "—"
-                            else:
-                                od = str(od)
-
-                            nd = changes[i][1].dt if changes[i][1] else "—"
-                            if isinstance(nd, datetime):
-                                nd = format_to_timezone(nd, tz=3) if nd else "—"
-                            else:
-                                nd = str(nd)
-                            changes[i] = f"Due: `{od or '—'}` → `{nd or '—'}`"
-                    send_log(
-                        f"✏️ *Изменения в карточке* «{item['title']}»:\n" + "\n".join(changes),
-                        board_id=item['board_id'],
-                        reply_markup=kb,
-                    )
-
-                # === Автоархивация: готова более ARCHIVE_AFTER_DAYS дней ===
-                done_ts = item.get('done')
-                if done_ts is not None and ARCHIVE_AFTER_DAYS > 0:
-                    done_utc = done_ts.replace(tzinfo=timezone.utc) if done_ts.tzinfo is None else done_ts
-                    now_utc = datetime.now(timezone.utc)
-                    if (now_utc - done_utc) > archive_threshold:
-                        if archive_card(item['board_id'], item['stack_id'], card_id):
-                            days_done = (now_utc - done_utc).days
-                            logger.info(
-                                f"CLOUD: карточка «{item['title']}» (ID {card_id}) "
-                                f"архивирована автоматически "
-                                f"(готова {days_done} дн.)"
-                            )
-                            try:
-                                delete_task_full(card_id)
-                                logger.info(
-                                    f"CLOUD: карточка {card_id} удалена из локальной БД"
-                                )
-                            except Exception as e:
-                                logger.error(
-                                    f"CLOUD: не удалось удалить карточку {card_id} "
-                                    f"из БД после архивации: {e}"
-                                )
-
+                    logger.debug(traceback.format_exc())
+                    continue
+                _coalescer.discard(changes.coalesced)
+                if changes.deleted_cards:
+                    logger.info(f"CLOUD: карточки {sorted(changes.deleted_cards)} удалены из локальной БД")
+                deadline_cards = changes.deadline_cards()
+                if deadline_cards:
+                    notify_deadline_changes(deadline_cards)
+                if changes.messages:
+                    wake_outbox()
+
+            dropped = _coalescer.drop_unseen(seen_cards, fetched_boards)
+            if dropped:
+                delete_pending_changes(dropped)
+                logger.info(f"CLOUD: отложенные уведомления по {len(dropped)} исчезнувшим карточкам отброшены")
+            if len(_coalescer):
+                logger.debug(f"CLOUD: ждут окна объединения: {len(_coalescer)} карточек")
             logger.info("CLOUD: " + ("изменения найдены." if changes_flag else "изменений не обнаружено."))
         except Exception as e:
             logger.error(f"CLOUD: ошибка плановой обработки задач — {e}")